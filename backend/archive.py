@@ -0,0 +1,264 @@
+"""
+Campaign archive.
+
+Ogni week brief e ogni post generato vengono salvati appena prodotti in
+SQLite, con un indice full-text FTS5 su caption, title, alt_text,
+keywords_used e hashtags (accenti e maiuscole ignorati). Brand, template e
+ruolo sono anch'essi colonne dell'indice: una ricerca "collana farfalla"
+di un brand interseca le posting list dentro FTS5 invece di filtrare dopo.
+
+I post sono salvati in ordine di creazione, quindi un intervallo di date
+diventa un intervallo di rowid e i risultati (dal più recente) escono
+scorrendo l'indice senza ordinare. Senza testo da cercare i filtri usano
+gli indici normali (brand, data).
+
+La colonna brand è BrandProfile.brand_key: il brand_id per i profili
+salvati (brands.py), altrimenti il brand_name passato nella richiesta.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "archive.sqlite3"
+MAX_LIMIT = 200
+MAX_ROWID = (1 << 63) - 1
+_SQLITE_ERROR = getattr(sqlite3, "SQLITE_ERROR", 1)
+
+# -----------------------------
+# Query
+# -----------------------------
+_QUERY_RE = re.compile(r'"([^"]+)"|(\S+)')
+_TERM_RE = re.compile(r"[^\w']+")
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def match_query(q: str = "", **columns: Optional[str]) -> str:
+    """FTS5 MATCH expression: every term (or "quoted phrase", or prefix*) AND the column filters."""
+    parts = []
+    for phrase, word in _QUERY_RE.findall(q or ""):
+        if phrase:
+            parts.append(_quote(phrase))
+            continue
+        prefix = word.endswith("*")
+        word = _TERM_RE.sub(" ", word).strip()
+        if word:
+            parts.append(_quote(word) + ("*" if prefix else ""))
+    for column, value in columns.items():
+        if value:
+            parts.append(f"{column} : {_quote(value)}")
+    return " AND ".join(parts)
+
+def _day_start(value: str) -> float:
+    return datetime.combine(date.fromisoformat(value), datetime.min.time()).timestamp()
+
+# -----------------------------
+# Archive
+# -----------------------------
+class CampaignArchive(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS briefs (
+        week_brief_id TEXT PRIMARY KEY,
+        brand TEXT NOT NULL,
+        week_id TEXT,
+        brief TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS briefs_brand ON briefs(brand, created_at);
+    CREATE TABLE IF NOT EXISTS posts (
+        post_id INTEGER PRIMARY KEY,
+        post_key TEXT NOT NULL UNIQUE,
+        brand TEXT NOT NULL,
+        week_brief_id TEXT,
+        slot_index INTEGER,
+        day_name TEXT,
+        template_id TEXT,
+        post_role TEXT,
+        caption TEXT NOT NULL,
+        title TEXT,
+        alt_text TEXT,
+        keywords_used TEXT,
+        hashtags TEXT,
+        image TEXT,
+        post TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS posts_brand ON posts(brand, created_at);
+    CREATE INDEX IF NOT EXISTS posts_brand_template ON posts(brand, template_id, created_at);
+    CREATE INDEX IF NOT EXISTS posts_created ON posts(created_at);
+    CREATE INDEX IF NOT EXISTS posts_brief ON posts(week_brief_id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        caption, title, alt_text, keywords_used, hashtags, brand, template_id, post_role,
+        content='posts', content_rowid='post_id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, caption, title, alt_text, keywords_used, hashtags, brand, template_id, post_role)
+        VALUES (new.post_id, new.caption, new.title, new.alt_text, new.keywords_used, new.hashtags,
+                new.brand, new.template_id, new.post_role);
+    END;
+    CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, caption, title, alt_text, keywords_used, hashtags, brand, template_id, post_role)
+        VALUES ('delete', old.post_id, old.caption, old.title, old.alt_text, old.keywords_used, old.hashtags,
+                old.brand, old.template_id, old.post_role);
+    END;
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH):
+        super().__init__(path)
+
+    # -----------------------------
+    # Write
+    # -----------------------------
+    def add_brief(self, brand: str, week_brief_id: Optional[str], brief: Dict[str, Any]) -> None:
+        if not week_brief_id:
+            return
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO briefs (week_brief_id, brand, week_id, brief, created_at) VALUES (?, ?, ?, ?, ?)",
+                (week_brief_id, brand, brief.get("week_id"), json.dumps(brief, ensure_ascii=False), time.time()),
+            )
+
+    def add_post(
+        self,
+        brand: str,
+        post: Dict[str, Any],
+        week_brief_id: Optional[str] = None,
+        slot_index: Optional[int] = None,
+        image: Optional[str] = None,
+    ) -> None:
+        """Archive a post; the same post of the same slot (e.g. a cache hit) is stored once."""
+        content = post.get("content") or {}
+        post_key = hashlib.sha256(
+            json.dumps([brand, week_brief_id, slot_index, post.get("caption")], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO posts (post_key, brand, week_brief_id, slot_index, day_name, template_id,"
+                " post_role, caption, title, alt_text, keywords_used, hashtags, image, post, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post_key, brand, week_brief_id, slot_index, post.get("day_name"), post.get("template_id"),
+                    post.get("post_role"), post.get("caption") or "", post.get("title"), content.get("alt_text"),
+                    " ".join(post.get("keywords_used") or []), " ".join(content.get("hashtags") or []),
+                    image, json.dumps(post, ensure_ascii=False), time.time(),
+                ),
+            )
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def search(
+        self,
+        q: str = "",
+        brand: Optional[str] = None,
+        template_id: Optional[str] = None,
+        post_role: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """Posts matching the text query and filters, newest first, with a highlighted snippet.
+
+        Niente ranking bm25: l'IDF di un termine presente quasi ovunque (es. l'hashtag
+        obbligatorio) costa una scansione dell'intera posting list.
+        date_from/date_to: date ISO (YYYY-MM-DD) di archiviazione, estremi inclusi.
+        """
+        where, params = [], []
+        for column, value in (("brand", brand), ("template_id", template_id), ("post_role", post_role)):
+            if value:
+                where.append(f"p.{column} = ?")
+                params.append(value)
+        if date_from:
+            where.append("p.created_at >= ?")
+            params.append(_day_start(date_from))
+        if date_to:
+            where.append("p.created_at < ?")
+            params.append(_day_start(date_to) + timedelta(days=1).total_seconds())
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        columns = (
+            "p.post_id, p.brand, p.week_brief_id, p.slot_index, p.day_name, p.template_id, p.post_role,"
+            " p.image, p.post, p.created_at"
+        )
+        conn = self.connect()
+        if match_query(q):
+            expr = match_query(q, brand=brand, template_id=template_id, post_role=post_role)
+            rowids = self._rowid_range(conn, date_from, date_to)
+            if rowids is None:
+                return []
+            # Il filtro vero lo fa MATCH (brand/template/ruolo sono colonne FTS): il "+" tiene
+            # il controllo esatto sulla riga senza far scegliere al planner gli indici di posts.
+            # Ordine per rowid: FTS5 scorre le posting list dal fondo e si ferma a LIMIT
+            sql = (
+                f"SELECT {columns}, snippet(posts_fts, -1, '[', ']', '…', 12) AS snippet"
+                " FROM posts_fts JOIN posts p ON p.post_id = posts_fts.rowid"
+                " WHERE posts_fts MATCH ? AND posts_fts.rowid BETWEEN ? AND ?"
+                + "".join(f" AND +{w}" for w in where)
+                + " ORDER BY posts_fts.rowid DESC LIMIT ? OFFSET ?"
+            )
+            params = [expr, *rowids, *params, limit, offset]
+        else:
+            sql = (
+                f"SELECT {columns}, NULL AS snippet FROM posts p"
+                + (" WHERE " + " AND ".join(where) if where else "")
+                + " ORDER BY p.created_at DESC LIMIT ? OFFSET ?"
+            )
+            params = [*params, limit, offset]
+
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # Espressione MATCH che FTS5 rifiuta: errore della richiesta, non del server
+            # (SQLITE_ERROR; database locked/busy resta un errore interno)
+            if match_query(q) and getattr(e, "sqlite_errorcode", _SQLITE_ERROR) == _SQLITE_ERROR:
+                raise ValueError(f"query di ricerca non valida: {e}") from e
+            raise
+        out = []
+        for r in rows:
+            item = dict(r)
+            item["post"] = json.loads(item["post"])
+            out.append(item)
+        return out
+
+    @staticmethod
+    def _rowid_range(conn, date_from: Optional[str], date_to: Optional[str]) -> Optional[Tuple[int, int]]:
+        """post_id bounds of a date range (posts are stored in creation order); None if empty."""
+        lo, hi = 0, MAX_ROWID
+        if date_from:
+            row = conn.execute(
+                "SELECT post_id FROM posts WHERE created_at >= ? ORDER BY created_at LIMIT 1", (_day_start(date_from),)
+            ).fetchone()
+            if row is None:
+                return None
+            lo = row[0]
+        if date_to:
+            row = conn.execute(
+                "SELECT post_id FROM posts WHERE created_at < ? ORDER BY created_at DESC LIMIT 1",
+                (_day_start(date_to) + timedelta(days=1).total_seconds(),),
+            ).fetchone()
+            if row is None:
+                return None
+            hi = row[0]
+        return (lo, hi) if lo <= hi else None
+
+    def get_brief(self, week_brief_id: str) -> Optional[Dict[str, Any]]:
+        row = self.connect().execute("SELECT * FROM briefs WHERE week_brief_id = ?", (week_brief_id,)).fetchone()
+        if row is None:
+            return None
+        out = dict(row)
+        out["brief"] = json.loads(out["brief"])
+        return out
+
+    def count(self) -> int:
+        return self.connect().execute("SELECT COUNT(*) FROM posts").fetchone()[0]
@@ -0,0 +1,398 @@
+"""
+Offline bulk generation via OpenAI Batch API files.
+
+Per la pianificazione di fine mese (molti brand x più settimane) la latenza
+non conta: conta il costo. Ogni chiamata di copywriter.generate_posts viene
+scritta come riga JSONL compatibile con la Batch API (/v1/responses) e i file
+di risultati vengono re-ingeriti e validati localmente.
+
+Flusso (lo stato resta in un file JSON tra uno step e l'altro):
+
+    python batch.py state.json plan campaigns.json   # {campaign_id: kwargs di generate_posts}
+    python batch.py state.json export-briefs briefs.jsonl
+    python batch.py state.json ingest briefs_results.jsonl
+    python batch.py state.json export-posts posts.jsonl
+    python batch.py state.json ingest posts_results.jsonl
+    python batch.py state.json export-repairs repairs.jsonl   # solo slot rifiutati da validate_post
+    python batch.py state.json ingest repairs_results.jsonl
+    python batch.py state.json assemble output.json
+
+Nessuno step usa la rete: caricare i file su /v1/batches e scaricare i
+risultati è compito del chiamante, quindi tutto è testabile con file locali.
+"""
+
+import copy
+import json
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import copywriter
+
+ENDPOINT = "/v1/responses"
+SEP = "|"
+
+def _request_line(custom_id: str, body: Dict[str, Any]) -> str:
+    return json.dumps(
+        {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body},
+        ensure_ascii=False,
+    )
+
+def _output_text(body: Dict[str, Any]) -> str:
+    """Text of a raw Responses API object (the SDK's output_text property)."""
+    if isinstance(body.get("output_text"), str):
+        return body["output_text"]
+    parts = []
+    for item in body.get("output", []):
+        for c in item.get("content") or []:
+            if c.get("type") == "output_text":
+                parts.append(c.get("text", ""))
+    return "".join(parts)
+
+def _body_usage(body: Dict[str, Any]) -> Dict[str, int]:
+    """Token counts of a raw Responses API object, as in providers.Completion.usage."""
+    u = body.get("usage") or {}
+    return {
+        "input_tokens": u.get("input_tokens") or 0,
+        "output_tokens": u.get("output_tokens") or 0,
+        "cached_tokens": (u.get("input_tokens_details") or {}).get("cached_tokens") or 0,
+    }
+
+def read_results(path: Path) -> Iterable[Tuple[str, Optional[str], Optional[str], Optional[Dict[str, int]]]]:
+    """Yield (custom_id, output_text, error, usage) for each line of a Batch results file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            cid = row["custom_id"]
+            if row.get("error"):
+                yield cid, None, json.dumps(row["error"], ensure_ascii=False), None
+                continue
+            resp = row.get("response") or {}
+            if resp.get("status_code", 200) != 200:
+                yield cid, None, f"HTTP {resp.get('status_code')}: {json.dumps(resp.get('body'), ensure_ascii=False)}", None
+                continue
+            body = resp.get("body") or {}
+            yield cid, _output_text(body), None, _body_usage(body)
+
+class BatchRun:
+    """State of a multi-campaign batch run, serializable to JSON."""
+
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    @classmethod
+    def load(cls, path: Path) -> "BatchRun":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, path: Path) -> None:
+        tmp = Path(f"{path}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        tmp.replace(path)
+
+    # -----------------------------
+    # Plan
+    # -----------------------------
+    @classmethod
+    def create(cls, campaigns: Dict[str, Dict[str, Any]]) -> "BatchRun":
+        """Plan every campaign like generate_posts does, without calling the API."""
+        state: Dict[str, Any] = {"campaigns": {}}
+        for cid, kw in campaigns.items():
+            if SEP in cid:
+                raise ValueError(f"campaign_id must not contain '{SEP}': {cid}")
+            state["campaigns"][cid] = cls._plan(kw)
+        return cls(state)
+
+    @staticmethod
+    def _plan(kw: Dict[str, Any]) -> Dict[str, Any]:
+        required_hashtags = kw.get("required_hashtags") or ["#handmade"]
+        base_hashtags = kw.get("base_hashtags") or []
+        brand_name = kw.get("brand_name", "Brand")
+        brand_tagline = kw.get("brand_tagline", "")
+        theme = kw["theme"]
+
+        plan = copywriter.plan_week(
+            kw["images"], kw.get("n_posts", 6), theme,
+            kw.get("strict_routing", False), kw.get("subject_from_file", True),
+        )
+        schedule, chosen_images, angles = plan["schedule"], plan["chosen_images"], plan["angles"]
+
+        slots = []
+        for idx, (day_name, template_id, post_role, cta_enabled) in enumerate(schedule):
+            slots.append({
+                "day_name": day_name,
+                "template_id": template_id,
+                "post_role": post_role,
+                "cta_enabled": cta_enabled,
+                "image_path": chosen_images[idx],
+                "subject": plan["subjects"][idx],
+                "angle": angles[idx],
+                "prev_angle": angles[idx - 1] if idx > 0 else None,
+                "post": None,
+                "rejected": None,
+                "error": None,
+                "repairs": 0,
+            })
+
+        return {
+            "params": {
+                "goal": kw["goal"],
+                "theme": theme,
+                "cta_mode": kw.get("cta_mode", "dm"),
+                "voice": kw.get("voice", "minimal"),
+                "featured_category": kw.get("featured_category", "mix"),
+                "availability_policy": kw.get("availability_policy", "no_availability"),
+                # Fissato al momento del plan: l'export può avvenire giorni dopo
+                "start_date": kw.get("start_date") or date.today().isoformat(),
+                "brand_name": brand_name,
+                "brand_tagline": brand_tagline,
+                "required_hashtags": required_hashtags,
+                "base_hashtags": base_hashtags,
+                "custom_banned_phrases": kw.get("custom_banned_phrases"),
+                "model": kw.get("model", copywriter.MODEL),
+            },
+            "brand_facts": copywriter.build_brand_facts(
+                brand_name, kw.get("brand_description", ""), brand_tagline, kw.get("brand_history", "")
+            ),
+            "schedule": [list(s) for s in schedule],
+            "chosen_images": chosen_images,
+            "week_brief": None,
+            "brief_error": None,
+            "slots": slots,
+            # Token per chiamata, stesso formato di generate_posts (usage.calls)
+            "usage": [],
+        }
+
+    # -----------------------------
+    # Request rendering
+    # -----------------------------
+    def _brief_body(self, camp: Dict[str, Any]) -> Dict[str, Any]:
+        p = camp["params"]
+        prompt = copywriter.build_week_brief_prompt(
+            p["goal"], p["theme"], camp["brand_facts"], p["cta_mode"], p["voice"],
+            p["featured_category"], p["availability_policy"], p["start_date"],
+        )
+        system_msg = copywriter.build_system_message(p["required_hashtags"])
+        return copywriter.week_brief_request(system_msg, prompt, p["model"])
+
+    def _post_body(self, camp: Dict[str, Any], idx: int) -> Dict[str, Any]:
+        p = camp["params"]
+        slot = camp["slots"][idx]
+        instructions = copywriter.build_post_instructions(
+            template_id=slot["template_id"],
+            subject=slot["subject"],
+            slot_index=idx,
+            day_name=slot["day_name"],
+            post_role=slot["post_role"],
+            cta_enabled=slot["cta_enabled"],
+            week_brief=camp["week_brief"],
+            brand_facts=camp["brand_facts"],
+            template_specs=copywriter.build_template_specs(p["brand_name"], p["brand_tagline"]),
+            required_hashtags=p["required_hashtags"],
+            base_hashtags=p["base_hashtags"],
+            availability_policy=p["availability_policy"],
+            angle=slot["angle"],
+            prev_angle=slot["prev_angle"],
+            custom_banned_phrases=p["custom_banned_phrases"],
+        )
+        system_msg = copywriter.build_system_message(p["required_hashtags"])
+        data_url = copywriter.img_to_data_url(slot["image_path"])
+        return copywriter.post_request(system_msg, instructions, data_url, p["model"])
+
+    def _repair_body(self, camp: Dict[str, Any], idx: int) -> Dict[str, Any]:
+        p = camp["params"]
+        slot = camp["slots"][idx]
+        fix = copywriter.build_post_fix_instructions(
+            slot["error"], slot["template_id"], slot["cta_enabled"], camp["week_brief"],
+            copywriter.build_template_specs(p["brand_name"], p["brand_tagline"]),
+            p["required_hashtags"], p["base_hashtags"],
+        )
+        system_msg = copywriter.build_system_message(p["required_hashtags"])
+        return copywriter.post_retry_request(system_msg, slot["rejected"], fix, p["model"])
+
+    # -----------------------------
+    # Export
+    # -----------------------------
+    def _write(self, path: Path, lines: List[str]) -> int:
+        with open(path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+        return len(lines)
+
+    def export_briefs(self, path: Path) -> int:
+        """Write brief requests for every campaign still without a valid brief."""
+        lines = [
+            _request_line(f"{cid}{SEP}brief", self._brief_body(camp))
+            for cid, camp in self.state["campaigns"].items()
+            if camp["week_brief"] is None
+        ]
+        return self._write(path, lines)
+
+    def export_posts(self, path: Path) -> int:
+        """Write post requests for slots never answered (or answered with an API error)."""
+        lines = []
+        for cid, camp in self.state["campaigns"].items():
+            if camp["week_brief"] is None:
+                continue
+            for idx, slot in enumerate(camp["slots"]):
+                if slot["post"] is None and slot["rejected"] is None:
+                    lines.append(_request_line(f"{cid}{SEP}post{SEP}{idx}", self._post_body(camp, idx)))
+        return self._write(path, lines)
+
+    def export_repairs(self, path: Path) -> int:
+        """Write a text-only repair request for each slot rejected by validate_post."""
+        lines = []
+        for cid, camp in self.state["campaigns"].items():
+            for idx, slot in enumerate(camp["slots"]):
+                if slot["rejected"] is not None and slot["repairs"] < copywriter.MAX_RETRIES_POST:
+                    lines.append(_request_line(f"{cid}{SEP}repair{SEP}{idx}", self._repair_body(camp, idx)))
+        return self._write(path, lines)
+
+    # -----------------------------
+    # Ingest
+    # -----------------------------
+    def ingest(self, path: Path) -> Dict[str, int]:
+        """Validate a Batch results file (briefs, posts or repairs) into the run state."""
+        counts = {"ok": 0, "rejected": 0, "errors": 0}
+        for custom_id, text, error, usage in read_results(path):
+            cid, kind, *rest = custom_id.split(SEP)
+            camp = self.state["campaigns"][cid]
+            if usage is not None:
+                call = {"brief": "brief", "post": "post", "repair": "retry"}[kind]
+                meta = {"call": call} if kind == "brief" else {"call": call, "slot_index": int(rest[0]), "image": kind == "post"}
+                camp.setdefault("usage", []).append({**meta, **usage})
+            if kind == "brief":
+                self._ingest_brief(camp, text, error, counts)
+            else:
+                slot = camp["slots"][int(rest[0])]
+                if kind == "repair":
+                    slot["repairs"] += 1
+                self._ingest_post(camp, int(rest[0]), slot, text, error, counts)
+        return counts
+
+    def _ingest_brief(self, camp, text, error, counts) -> None:
+        if error is None:
+            try:
+                brief = json.loads(text)
+                copywriter.validate_week_brief(brief)
+                camp["week_brief"], camp["brief_error"] = brief, None
+                counts["ok"] += 1
+                return
+            except Exception as e:
+                error = str(e)
+        camp["brief_error"] = error
+        counts["errors"] += 1
+
+    def _ingest_post(self, camp, idx, slot, text, error, counts) -> None:
+        if error is not None:
+            slot["error"] = error
+            counts["errors"] += 1
+            return
+        p = camp["params"]
+        try:
+            post = json.loads(text)
+        except ValueError as e:
+            slot["error"] = f"invalid JSON: {e}"
+            counts["errors"] += 1
+            return
+        try:
+            post = copywriter.validate_or_repair(
+                post, slot["template_id"], slot["day_name"], camp["week_brief"], slot["cta_enabled"],
+                copywriter.build_template_specs(p["brand_name"], p["brand_tagline"]),
+                p["required_hashtags"],
+                slot["post_role"],
+                copywriter.banned_matcher(p["custom_banned_phrases"]),
+            )
+        except Exception as e:
+            slot["rejected"], slot["error"] = post, str(e)
+            counts["rejected"] += 1
+            return
+        slot["post"], slot["rejected"], slot["error"] = post, None, None
+        counts["ok"] += 1
+
+    # -----------------------------
+    # Assemble
+    # -----------------------------
+    def pending(self) -> Dict[str, List[str]]:
+        """Campaign ids with missing brief or posts, and why."""
+        out: Dict[str, List[str]] = {}
+        for cid, camp in self.state["campaigns"].items():
+            reasons = []
+            if camp["week_brief"] is None:
+                reasons.append(f"brief: {camp['brief_error'] or 'not ingested'}")
+            for idx, slot in enumerate(camp["slots"]):
+                if slot["post"] is None:
+                    reasons.append(f"slot {idx}: {slot['error'] or 'not ingested'}")
+            if reasons:
+                out[cid] = reasons
+        return out
+
+    def assemble(self) -> Dict[str, Dict[str, Any]]:
+        """Complete campaigns in the same structure generate_posts returns."""
+        incomplete = self.pending()
+        results = {}
+        for cid, camp in self.state["campaigns"].items():
+            if cid in incomplete:
+                continue
+            p = camp["params"]
+            brief = camp["week_brief"]
+            posts = [
+                copywriter.finalize_post(copy.deepcopy(slot["post"]), p["required_hashtags"], p["base_hashtags"])
+                for slot in camp["slots"]
+            ]
+            results[cid] = {
+                "week_brief": brief,
+                "week_brief_id": copywriter.brief_store.save(brief) if copywriter.brief_store else None,
+                "schedule": [tuple(s) for s in camp["schedule"]],
+                "chosen_images": camp["chosen_images"],
+                "posts": posts,
+                "usage": {"calls": camp.get("usage", []), "totals": copywriter.summarize_usage(camp.get("usage", []))},
+            }
+        return results
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv: List[str]) -> int:
+    if len(argv) != 3:
+        print(__doc__)
+        return 2
+    state_path, cmd, file_path = Path(argv[0]), argv[1], Path(argv[2])
+
+    if cmd == "plan":
+        with open(file_path, encoding="utf-8") as f:
+            run = BatchRun.create(json.load(f))
+        run.save(state_path)
+        print(f"Pianificate {len(run.state['campaigns'])} campagne")
+        return 0
+
+    run = BatchRun.load(state_path)
+    if cmd == "export-briefs":
+        print(f"{run.export_briefs(file_path)} richieste brief")
+    elif cmd == "export-posts":
+        print(f"{run.export_posts(file_path)} richieste post")
+    elif cmd == "export-repairs":
+        print(f"{run.export_repairs(file_path)} richieste di repair")
+    elif cmd == "ingest":
+        print(run.ingest(file_path))
+    elif cmd == "assemble":
+        results = run.assemble()
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "pending": run.pending()}, f, ensure_ascii=False, indent=2)
+        print(f"{len(results)} campagne complete, {len(run.pending())} incomplete")
+        return 0
+    else:
+        print(f"Comando sconosciuto: {cmd}")
+        return 2
+    run.save(state_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1 @@
+"""Benchmark harness: mock Responses API server and load driver for main.app."""
@@ -0,0 +1,405 @@
+"""
+Local stand-in for the OpenAI Responses API (POST /v1/responses).
+
+Risponde anche su POST /v1/chat/completions (stesso comportamento), per
+provare il provider OpenAI-compatibile.
+
+Restituisce JSON conformi agli schema `week_brief` / `post` ricostruendo
+template, giorno, keyword, CTA e hashtag obbligatori dal prompt, così il
+resto della pipeline (validazione, repair, cache) lavora come in produzione.
+
+Comportamenti configurabili:
+- latenza log-normale (mediana + sigma)
+- percentuale di 429 (con header retry-after e x-ratelimit-*) e di 500
+- post che violano validate_post di proposito: `invalid_rate` (riparabili
+  localmente) e `retry_rate` (servono una chiamata di correzione)
+
+Avvio standalone:
+    python -m bench.mock_responses --port 8099 --latency-ms 800
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+IMAGE_TOKENS = 765          # costo di un'immagine 768x768 con detail high
+CACHE_MIN_TOKENS = 1024     # sotto questa soglia il prompt caching non si applica
+CACHE_BLOCK_TOKENS = 128
+
+BRIEF_KEYWORDS = ["legno", "mani", "luce", "venatura"]
+BRIEF_CTA = "Scrivici in DM per informazioni."
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _input_parts(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten the `input` messages to [{role, text, images}]."""
+    parts = []
+    for msg in body.get("input", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            parts.append({"role": msg["role"], "text": content, "images": 0})
+            continue
+        text = "".join(c.get("text", "") for c in content if c.get("type") == "input_text")
+        images = sum(1 for c in content if c.get("type") == "input_image")
+        parts.append({"role": msg["role"], "text": text, "images": images})
+    return parts
+
+def _chat_parts(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """chat/completions messages -> same shape as _input_parts."""
+    parts = []
+    for msg in body.get("messages", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            parts.append({"role": msg["role"], "text": content, "images": 0})
+            continue
+        text = "".join(c.get("text", "") for c in content if c.get("type") == "text")
+        images = sum(1 for c in content if c.get("type") == "image_url")
+        parts.append({"role": msg["role"], "text": text, "images": images})
+    return parts
+
+def _literal_list(pattern: str, text: str) -> List[str]:
+    m = re.search(pattern, text)
+    return list(ast.literal_eval(m.group(1))) if m else []
+
+class MockBehaviour:
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        latency_sigma: float = 0.4,
+        rate_429: float = 0.0,
+        error_rate: float = 0.0,
+        invalid_rate: float = 0.1,
+        retry_rate: float = 0.05,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.retry_rate = retry_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._prefixes: set = set()
+        self.stats = {
+            "requests": 0, "briefs": 0, "posts": 0, "retries": 0,
+            "rate_limited": 0, "errors": 0, "invalid_repairable": 0, "invalid_retry": 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self._rng.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+    def fault(self) -> Optional[int]:
+        r = self._random()
+        if r < self.rate_429:
+            self._count("rate_limited")
+            return 429
+        if r < self.rate_429 + self.error_rate:
+            self._count("errors")
+            return 500
+        return None
+
+    def cached_tokens(self, parts: List[Dict[str, Any]]) -> int:
+        """Simula il prompt caching: system + primo messaggio user già visti => cached."""
+        prefix = "".join(p["text"] for p in parts[:2])
+        n = _tokens(prefix)
+        if n < CACHE_MIN_TOKENS:
+            return 0
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            seen = key in self._prefixes
+            self._prefixes.add(key)
+        return (n // CACHE_BLOCK_TOKENS) * CACHE_BLOCK_TOKENS if seen else 0
+
+    # -----------------------------
+    # Bodies
+    # -----------------------------
+    def week_brief(self, text: str) -> Dict[str, Any]:
+        self._count("briefs")
+        field = lambda name: (re.search(rf"^{name}: (.*)$", text, re.M) or [None, ""])[1]
+        return {
+            "week_id": field("week_id"),
+            "theme": field("theme"),
+            "goal": field("goal"),
+            "voice": field("voice"),
+            "featured_category": field("featured_category"),
+            "availability_policy": field("availability_policy"),
+            "keywords": BRIEF_KEYWORDS,
+            "cta": {"day": "sun", "text": BRIEF_CTA},
+            "continuity_rules": "Stessa luce naturale e sfondo neutro per tutta la settimana.",
+        }
+
+    def post(self, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        text = "\n".join(p["text"] for p in parts)
+        rejected = next((p["text"] for p in parts if p["role"] == "assistant"), None)
+        required = _literal_list(r"hashtags devono includere almeno: (\[.*?\])", text)
+
+        if rejected is not None:
+            # Correzione: riparte dal JSON rifiutato e restituisce sempre un post valido
+            self._count("retries")
+            prev = json.loads(rejected)
+            slot = {
+                "template_id": prev["template_id"],
+                "day_name": prev["day_name"],
+                "slot_index": prev["slot_index"],
+                "post_role": prev["post_role"],
+                "cta": "DEVE terminare" in text,
+            }
+            keywords = _literal_list(r"keywords_used: 1 o 2 elementi presi da (\[.*?\])", text)
+            m = re.search(r"ultima riga\): (.*)$", text, re.M)
+            cta_text = m.group(1).strip() if m else BRIEF_CTA
+            return self._post_body(slot, keywords, cta_text, required, broken=None)
+
+        self._count("posts")
+        brief = json.loads(re.search(r"^WEEK_BRIEF: (.*)$", text, re.M).group(1))
+        slot = {
+            "template_id": re.search(r"TEMPLATE: (\w+)", text).group(1),
+            "day_name": re.search(r"DAY_NAME: (\w+)", text).group(1),
+            "slot_index": int(re.search(r"SLOT_INDEX: (\d+)", text).group(1)),
+            "post_role": re.search(r"POST_ROLE: (\w+)", text).group(1),
+            "cta": "CTA_ENABLED: True" in text,
+        }
+        r = self._random()
+        broken = None
+        if r < self.retry_rate:
+            broken = "retry"
+            self._count("invalid_retry")
+        elif r < self.retry_rate + self.invalid_rate:
+            broken = "repairable"
+            self._count("invalid_repairable")
+        return self._post_body(slot, brief["keywords"], brief["cta"]["text"].strip(), required, broken)
+
+    def _post_body(
+        self,
+        slot: Dict[str, Any],
+        keywords: List[str],
+        cta_text: str,
+        required: List[str],
+        broken: Optional[str],
+    ) -> Dict[str, Any]:
+        kw = keywords[slot["slot_index"] % len(keywords)] if keywords else "legno"
+        caption = f"Un oggetto in {kw} sul banco di lavoro. La luce segue la superficie lisciata a mano."
+        if broken == "retry":
+            # Quattro frasi: repair_post non le accorcia, serve la correzione del modello
+            caption += " Ogni pezzo è diverso. Nessuno è uguale all'altro."
+        if slot["cta"]:
+            caption += f"\n{cta_text}"
+        tags = list(dict.fromkeys(required + ["#artigianato", "#fattoamano"]))
+        full = caption + "\n" + " ".join(tags)
+        if broken == "repairable":
+            # Hashtag obbligatori mancanti e ig_caption_full disallineato: riparabili in locale
+            tags = tags[len(required):]
+            full = caption
+        needs_title = slot["template_id"] in ("T3_PROCESSO", "T4_STORIA")
+        return {
+            "template_id": slot["template_id"],
+            "subject": "oggetto artigianale",
+            "slot_index": slot["slot_index"],
+            "day_name": slot["day_name"],
+            "post_role": slot["post_role"],
+            "title": "Mani al lavoro" if needs_title else None,
+            "caption": caption,
+            "keywords_used": [kw],
+            "do_not_use": [],
+            "ig_caption_full": full,
+            "content": {
+                "hashtags": tags,
+                "alt_text": "Un oggetto in legno su un banco di lavoro.",
+                "visual_description": "Oggetto in legno chiaro, luce laterale morbida.",
+            },
+        }
+
+    def _complete(self, parts: List[Dict[str, Any]], name: Optional[str]) -> Tuple[str, int, int, int]:
+        """(output JSON, input tokens, output tokens, cached tokens)."""
+        if name == "week_brief":
+            payload = self.week_brief("\n".join(p["text"] for p in parts))
+        elif name == "post":
+            payload = self.post(parts)
+        else:
+            raise ValueError(f"unsupported response format: {name!r}")
+        output = json.dumps(payload, ensure_ascii=False)
+        input_tokens = sum(_tokens(p["text"]) + p["images"] * IMAGE_TOKENS for p in parts)
+        return output, input_tokens, _tokens(output), self.cached_tokens(parts)
+
+    def respond_chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        name = body.get("response_format", {}).get("json_schema", {}).get("name")
+        output, input_tokens, output_tokens, cached = self._complete(_chat_parts(body), name)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": output},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": input_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached},
+            },
+        }
+
+    def respond(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        name = body.get("text", {}).get("format", {}).get("name")
+        output, input_tokens, output_tokens, cached = self._complete(_input_parts(body), name)
+        return {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": body.get("model", ""),
+            "output": [{
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": output, "annotations": []}],
+            }],
+            "usage": {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": cached},
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behaviour: MockBehaviour = None  # impostato da MockResponsesServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        b = self.behaviour
+        b._count("requests")
+        path = self.path.rstrip("/")
+        if path.endswith("/responses"):
+            respond = b.respond
+        elif path.endswith("/chat/completions"):
+            respond = b.respond_chat
+        else:
+            self._send(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        time.sleep(b.latency())
+        status = b.fault()
+        if status == 429:
+            self._send(429, {"error": {
+                "message": "Rate limit reached (mock).", "type": "requests", "code": "rate_limit_exceeded",
+            }}, {
+                "retry-after-ms": "200",
+                "x-ratelimit-limit-requests": "500",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "200ms",
+            })
+            return
+        if status == 500:
+            self._send(500, {"error": {"message": "Internal error (mock).", "type": "server_error"}})
+            return
+
+        try:
+            payload = respond(json.loads(raw))
+        except (ValueError, KeyError, AttributeError) as e:
+            self._send(400, {"error": {"message": f"mock could not parse request: {e}", "type": "invalid_request_error"}})
+            return
+        self._send(200, payload, {
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-remaining-requests": "499",
+            "x-ratelimit-limit-tokens": "2000000",
+            "x-ratelimit-remaining-tokens": "1999000",
+        })
+
+class MockResponsesServer:
+    """ThreadingHTTPServer in un thread daemon; `base_url` va passato al client OpenAI."""
+
+    def __init__(self, behaviour: Optional[MockBehaviour] = None, host: str = "127.0.0.1", port: int = 0):
+        self.behaviour = behaviour or MockBehaviour()
+        handler = type("Handler", (_Handler,), {"behaviour": self.behaviour})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockResponsesServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-responses", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_behaviour_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="mediana della latenza simulata")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="sigma della log-normale (0 = costante)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="quota di risposte 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="quota di risposte 500")
+    parser.add_argument("--invalid-rate", type=float, default=0.1, help="quota di post invalidi riparabili in locale")
+    parser.add_argument("--retry-rate", type=float, default=0.05, help="quota di post che richiedono un retry")
+    parser.add_argument("--seed", type=int, default=None)
+
+def behaviour_from_args(args: argparse.Namespace) -> MockBehaviour:
+    return MockBehaviour(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        error_rate=args.error_rate,
+        invalid_rate=args.invalid_rate,
+        retry_rate=args.retry_rate,
+        seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI Responses API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_behaviour_args(parser)
+    args = parser.parse_args()
+    server = MockResponsesServer(behaviour_from_args(args), args.host, args.port)
+    print(f"Mock Responses API su {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,301 @@
+"""
+Load test of main.app against the local mock Responses API.
+
+Avvia il mock, un uvicorn con main.app in un thread (un solo worker, come in
+produzione per processo) e lancia N richieste /generate con la concorrenza
+indicata. Con --workers N > 1 uvicorn gira invece in un sottoprocesso con N
+worker, per misurare come scala il throughput. Tutto gira in una directory
+temporanea (uploads, data, cache), così le cache di un run non falsano il
+successivo.
+
+Esegui dalla directory backend/:
+    python -m bench.run --concurrency 8 --requests 64 --out bench-results.json
+    python -m bench.run --workers 8 --concurrency 64 --requests 512
+
+Il report JSON contiene configurazione, throughput, percentili di latenza,
+retry e repair, statistiche del mock e picco di RSS del processo (con più
+worker: del worker più grande; repair non è disponibile, è per processo).
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from bench.mock_responses import MockResponsesServer, add_behaviour_args, behaviour_from_args
+
+PREFIXES = ["oggetto", "dettaglio", "processo", "storia"]
+PERCENTILES = (50, 90, 95, 99)
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear-interpolated percentile (values need not be sorted)."""
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    out = {f"p{p}": round(percentile(values, p), 4) for p in PERCENTILES}
+    out["mean"] = round(sum(values) / len(values), 4) if values else 0.0
+    out["max"] = round(max(values), 4) if values else 0.0
+    return out
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss: KB su Linux, byte su macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def make_images(directory: Path, per_prefix: int, size: int) -> List[str]:
+    """Synthetic test photos named with the routing prefixes."""
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for prefix in PREFIXES:
+        for i in range(per_prefix):
+            path = directory / f"{prefix}_bench_{i:02d}.jpg"
+            if Image is not None:
+                # Rumore: si comprime male, come una foto vera
+                Image.frombytes("RGB", (size, size * 3 // 4), os.urandom(size * size * 3 // 4 * 3)).save(path, quality=90)
+            else:
+                path.write_bytes(b"\xff\xd8" + os.urandom(size * 64) + b"\xff\xd9")
+            paths.append(str(path))
+    return paths
+
+def start_app(port: int):
+    """uvicorn + main.app in a daemon thread; returns (main, server)."""
+    import uvicorn
+    import main
+
+    main.OPENAI_API_KEY = "sk-bench"
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.05)
+    return main, server
+
+def start_app_processes(port: int, workers: int) -> subprocess.Popen:
+    """uvicorn main:app --workers N in a subprocess (cwd = current workdir)."""
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        WEB_CONCURRENCY=str(workers),
+        PYTHONPATH=os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")])),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.time() + 60
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2) as resp:
+                if json.loads(resp.read()).get("status") == "ready":
+                    return proc
+        except (OSError, ValueError):
+            pass
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.2)
+
+def stop_app_processes(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def _post(url: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        body = resp.read()
+    if url.endswith("/stream"):
+        events = [json.loads(line) for line in body.splitlines() if line.strip()]
+        done = next((e for e in events if e["event"] == "done"), None)
+        if done is None:
+            error = next((e for e in events if e["event"] == "error"), {"detail": "no done event"})
+            raise RuntimeError(error["detail"])
+        return {"posts": [e for e in events if e["event"] == "post"], "usage": {"totals": done["usage"]}}
+    return json.loads(body)
+
+def run_one(url: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        result = _post(url, payload, timeout)
+    except urllib.error.HTTPError as e:
+        return {"ok": False, "seconds": time.perf_counter() - start, "status": e.code}
+    except Exception as e:
+        return {"ok": False, "seconds": time.perf_counter() - start, "status": type(e).__name__}
+    totals = result.get("usage", {}).get("totals", {})
+    return {
+        "ok": True,
+        "seconds": time.perf_counter() - start,
+        "status": 200,
+        "posts": len(result["posts"]),
+        "retries": totals.get("retry", {}).get("calls", 0),
+        "tokens": {
+            k: sum(t.get(k, 0) for t in totals.values())
+            for k in ("input_tokens", "output_tokens", "cached_tokens")
+        },
+    }
+
+def build_report(args: argparse.Namespace, results: List[Dict[str, Any]], wall: float, main, mock, repair, rss: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["ok"]]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    posts = sum(r["posts"] for r in ok)
+    copywriter = main.copywriter
+    return {
+        "benchmark": "generate",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "endpoint": args.endpoint,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "n_posts": args.n_posts,
+            "use_cache": args.use_cache,
+            "caption_dup_action": os.environ.get("CAPTION_DUP_ACTION"),
+            "mock": {
+                "latency_ms": args.latency_ms,
+                "latency_sigma": args.latency_sigma,
+                "rate_429": args.rate_429,
+                "error_rate": args.error_rate,
+                "invalid_rate": args.invalid_rate,
+                "retry_rate": args.retry_rate,
+                "seed": args.seed,
+            },
+            "model": copywriter.MODEL,
+            "max_concurrent_posts": copywriter.MAX_CONCURRENT_POSTS,
+            "generation_workers": main.GENERATION_WORKERS,
+        },
+        "results": {
+            "wall_seconds": round(wall, 3),
+            "succeeded": len(ok),
+            "failed": len(results) - len(ok),
+            "status_counts": statuses,
+            "throughput": {
+                "requests_per_second": round(len(ok) / wall, 3) if wall else 0.0,
+                "posts_per_second": round(posts / wall, 3) if wall else 0.0,
+            },
+            "latency_seconds": latency_summary([r["seconds"] for r in ok]),
+            "posts": posts,
+            "model_retries": sum(r["retries"] for r in ok),
+            "tokens": {
+                k: sum(r["tokens"][k] for r in ok)
+                for k in ("input_tokens", "output_tokens", "cached_tokens")
+            },
+            "repair": repair,
+            "mock": dict(mock.behaviour.stats),
+            "peak_rss_mb": rss,
+        },
+    }
+
+def main_cli(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Load test di /generate contro il mock Responses API")
+    parser.add_argument("--concurrency", type=int, default=4, help="richieste /generate in parallelo")
+    parser.add_argument("--requests", type=int, default=16, help="richieste totali")
+    parser.add_argument("--n-posts", type=int, default=7)
+    parser.add_argument("--endpoint", choices=["generate", "stream"], default="generate")
+    parser.add_argument("--workers", type=int, default=1, help="processi uvicorn (>1: sottoprocesso con --workers)")
+    parser.add_argument("--use-cache", action="store_true", help="lascia attive cache risposte/brief (default: bypass)")
+    parser.add_argument("--images-per-prefix", type=int, default=2)
+    parser.add_argument("--image-size", type=int, default=1600, help="lato lungo delle immagini sintetiche")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--workdir", default=None, help="directory di lavoro (default: temporanea)")
+    parser.add_argument("--out", default=None, help="file JSON del report (default: stdout)")
+    add_behaviour_args(parser)
+    args = parser.parse_args(argv)
+
+    out = Path(args.out).resolve() if args.out else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="copywriter-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)  # uploads/ e data/ di main sono relativi alla cwd
+
+    mock = MockResponsesServer(behaviour_from_args(args)).start()
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    # Il mock scrive caption quasi uguali tra slot e richieste: col controllo dei
+    # duplicati ogni post costerebbe un retry che in produzione non c'è
+    os.environ.setdefault("CAPTION_DUP_ACTION", "off")
+    image_paths = make_images(workdir / "uploads", args.images_per_prefix, args.image_size)
+    if args.workers > 1:
+        import main
+
+        proc = start_app_processes(args.port, args.workers)
+    else:
+        main, server = start_app(args.port)
+
+    url = f"http://127.0.0.1:{args.port}/generate" + ("/stream" if args.endpoint == "stream" else "")
+    payload = {
+        "goal": "benchmark",
+        "theme": "legno e luce",
+        "images": image_paths,
+        "n_posts": args.n_posts,
+        "brand_name": "Bench",
+        "brand_description": "Laboratorio artigianale di oggetti in legno.",
+        "required_hashtags": ["#handmade"],
+        "base_hashtags": ["#legno"],
+        "bypass_cache": not args.use_cache,
+    }
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda _: run_one(url, payload, args.timeout), range(args.requests)))
+        wall = time.perf_counter() - start
+    finally:
+        if args.workers > 1:
+            stop_app_processes(proc)
+        else:
+            server.should_exit = True
+        mock.stop()
+    if args.workers > 1:
+        report = build_report(args, results, wall, main, mock, None, peak_rss_mb(resource.RUSAGE_CHILDREN))
+    else:
+        report = build_report(args, results, wall, main, mock, main.copywriter.repair_stats(), peak_rss_mb())
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if out is not None:
+        out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return report
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,146 @@
+"""
+Brand profiles.
+
+Con centinaia di brand ogni /generate ripeteva l'intero payload del brand e
+copywriter ricostruiva brand facts, template, system message, do_not_use e
+matcher della blacklist. I profili stanno in SQLite (condivisi tra i worker)
+e le richieste li citano per brand_id.
+
+La versione compilata di un profilo resta in memoria per processo, legata
+alla revisione (hash del contenuto). Ogni uso rilegge solo la revisione
+(lookup sulla primary key): un profilo modificato, anche da un altro worker,
+viene ricompilato alla richiesta successiva, e solo allora.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from response_cache import fingerprint
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "brands.sqlite3"
+COMPILED_CACHE_SIZE = 1024  # profili compilati tenuti in memoria per processo
+
+# Campo -> default; brand_name è obbligatorio
+FIELDS: Dict[str, Any] = {
+    "brand_name": None,
+    "brand_description": "",
+    "brand_tagline": "",
+    "brand_history": "",
+    "required_hashtags": ["#handmade"],
+    "base_hashtags": [],
+    "custom_banned_phrases": None,
+}
+
+_BRAND_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+def normalize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Profile with every field (defaults filled in); ValueError on unknown or missing fields."""
+    unknown = set(profile) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"campi non previsti nel profilo: {sorted(unknown)}")
+    out = {}
+    for field, default in FIELDS.items():
+        value = profile.get(field)
+        out[field] = list(default) if value is None and isinstance(default, list) else (default if value is None else value)
+    if not isinstance(out["brand_name"], str) or not out["brand_name"].strip():
+        raise ValueError("brand_name mancante")
+    return out
+
+class BrandStore(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS brands (
+        brand_id TEXT PRIMARY KEY,
+        profile TEXT NOT NULL,
+        revision TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, build: Optional[Callable[[str, Dict[str, Any]], Any]] = None):
+        """build: (brand_id, profile dict) -> compiled profile (copywriter.BrandProfile)."""
+        super().__init__(path)
+        self.build = build
+        self._compiled: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # CRUD
+    # -----------------------------
+    def put(self, brand_id: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Create or replace a profile; the revision changes only if the content does."""
+        if not _BRAND_ID_RE.match(brand_id or ""):
+            raise ValueError("brand_id non valido (lettere, cifre, _ . -, max 64)")
+        profile = normalize_profile(profile)
+        revision = fingerprint(kind="brand", profile=profile)[:16]
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO brands (brand_id, profile, revision, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(brand_id) DO UPDATE SET profile = excluded.profile, revision = excluded.revision,"
+                " updated_at = excluded.updated_at WHERE brands.revision != excluded.revision",
+                (brand_id, json.dumps(profile, ensure_ascii=False), revision, now, now),
+            )
+        return self.get(brand_id)
+
+    def get(self, brand_id: str) -> Optional[Dict[str, Any]]:
+        row = self.connect().execute("SELECT * FROM brands WHERE brand_id = ?", (brand_id,)).fetchone()
+        return _row_to_dict(row) if row is not None else None
+
+    def list(self, limit: int = 100, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Profiles ordered by brand_id, after `cursor` (the last brand_id of the previous page)."""
+        rows = self.connect().execute(
+            "SELECT * FROM brands WHERE brand_id > ? ORDER BY brand_id LIMIT ?", (cursor or "", limit)
+        ).fetchall()
+        return [_row_to_dict(r) for r in rows]
+
+    def delete(self, brand_id: str) -> bool:
+        conn = self.connect()
+        with conn:
+            cur = conn.execute("DELETE FROM brands WHERE brand_id = ?", (brand_id,))
+        with self._lock:
+            self._compiled.pop(brand_id, None)
+        return cur.rowcount > 0
+
+    # -----------------------------
+    # Compiled profiles
+    # -----------------------------
+    def profile(self, brand_id: str) -> Optional[Any]:
+        """Compiled profile of a brand, rebuilt only when its revision changed; None if unknown."""
+        row = self.connect().execute("SELECT revision FROM brands WHERE brand_id = ?", (brand_id,)).fetchone()
+        if row is None:
+            with self._lock:
+                self._compiled.pop(brand_id, None)
+            return None
+        with self._lock:
+            cached = self._compiled.get(brand_id)
+            if cached is not None and cached[0] == row["revision"]:
+                self._compiled.move_to_end(brand_id)
+                return cached[1]
+
+        found = self.get(brand_id)
+        if found is None:
+            return None
+        compiled = self.build(brand_id, found["profile"]) if self.build is not None else found["profile"]
+        with self._lock:
+            self._compiled[brand_id] = (found["revision"], compiled)
+            self._compiled.move_to_end(brand_id)
+            while len(self._compiled) > COMPILED_CACHE_SIZE:
+                self._compiled.popitem(last=False)
+        return compiled
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {
+        "brand_id": row["brand_id"],
+        "revision": row["revision"],
+        "profile": json.loads(row["profile"]),
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
@@ -0,0 +1,103 @@
+"""
+Week brief store.
+
+Ogni brief ha un id stabile (hash del contenuto) e viene associato
+all'impronta degli input che l'hanno prodotto (brand facts, goal, theme,
+voice, cta_mode, week_id, modello...). Un /generate con gli stessi input
+riusa il brief invece di rifare la chiamata.
+
+Un brief "pinned" non scade e resta quello usato per i suoi input finché
+non viene sbloccato o invalidato.
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from response_cache import fingerprint
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "briefs.sqlite3"
+TTL_SECONDS = 7 * 24 * 3600
+
+def brief_id(brief: Dict[str, Any]) -> str:
+    """Content-derived id, identical for identical briefs."""
+    return fingerprint(kind="week_brief", brief=brief)[:24]
+
+class BriefStore(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS briefs (
+        brief_id TEXT PRIMARY KEY,
+        brief TEXT NOT NULL,
+        pinned INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS brief_inputs (
+        input_key TEXT PRIMARY KEY,
+        brief_id TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS brief_inputs_brief ON brief_inputs(brief_id);
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, ttl_seconds: float = TTL_SECONDS):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+
+    def save(self, brief: Dict[str, Any], input_key: Optional[str] = None) -> str:
+        """Store a brief (idempotent) and optionally map input_key to it."""
+        bid = brief_id(brief)
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO briefs (brief_id, brief, pinned, created_at) VALUES (?, ?, 0, ?)",
+                (bid, json.dumps(brief, ensure_ascii=False), now),
+            )
+            if input_key is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO brief_inputs (input_key, brief_id, created_at) VALUES (?, ?, ?)",
+                    (input_key, bid, now),
+                )
+        return bid
+
+    def lookup(self, input_key: str, include_unpinned: bool = True) -> Optional[Dict[str, Any]]:
+        """Brief previously generated for these inputs (pinned ones never expire)."""
+        row = self.connect().execute(
+            "SELECT b.brief, b.pinned, m.created_at FROM brief_inputs m"
+            " JOIN briefs b ON b.brief_id = m.brief_id WHERE m.input_key = ?",
+            (input_key,),
+        ).fetchone()
+        if row is None:
+            return None
+        if not row["pinned"]:
+            if not include_unpinned or row["created_at"] < time.time() - self.ttl_seconds:
+                return None
+        return json.loads(row["brief"])
+
+    def get(self, bid: str) -> Optional[Dict[str, Any]]:
+        row = self.connect().execute(
+            "SELECT brief_id, brief, pinned, created_at FROM briefs WHERE brief_id = ?", (bid,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "week_brief_id": row["brief_id"],
+            "week_brief": json.loads(row["brief"]),
+            "pinned": bool(row["pinned"]),
+            "created_at": row["created_at"],
+        }
+
+    def pin(self, bid: str, pinned: bool = True) -> bool:
+        conn = self.connect()
+        with conn:
+            cur = conn.execute("UPDATE briefs SET pinned = ? WHERE brief_id = ?", (int(pinned), bid))
+        return cur.rowcount > 0
+
+    def invalidate(self, bid: str) -> bool:
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM brief_inputs WHERE brief_id = ?", (bid,))
+            cur = conn.execute("DELETE FROM briefs WHERE brief_id = ?", (bid,))
+        return cur.rowcount > 0
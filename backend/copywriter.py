@@ -12,25 +12,98 @@ Features:
    - max_output_tokens capped
    - retries reduced (default 1 retry)
    - short "fix" prompt on retry
+5) Slots generated concurrently once the week brief exists (MAX_CONCURRENT_POSTS).
+6) Images downscaled to the model's working resolution and cached (images.py).
+7) Validated posts cached on disk by request fingerprint (response_cache.py).
+8) Week briefs memoized by input fingerprint, can be pinned or passed in (brief_store.py).
+9) Mechanical validation failures repaired locally before spending a retry call.
+10) Retries are text-only correction turns (no image); token usage reported per call.
+11) Prompts laid out as a static prefix shared by all slots + per-slot suffix (prompt caching).
+12) Model calls go through a provider (providers.py): OpenAI or OpenAI-compatible endpoints.
+13) Uploaded images routed from the upload catalog (upload_store.py), no per-file stat.
+14) Banned phrases enforced by validate_post with a compiled matcher (phrases.py);
+    the prompt carries only the first PROMPT_PHRASES of the blacklist.
+15) Captions archived per brand with MinHash/LSH (dedup.py): near-copies of past
+    captions get one correction retry, then are flagged in `near_duplicates`.
+    Brand = brand_id for stored profiles, otherwise brand_name (BrandProfile.brand_key).
+16) Week briefs and posts archived as they are produced, full-text searchable (archive.py).
+17) Brand profiles stored server-side (brands.py): prompt components, hashtag sets and
+    banned-phrase matcher compiled once per profile revision (BrandProfile).
+18) Multi-week calendars (generate_calendar): images routed over the whole date range
+    without reuse, briefs in parallel, all slots through one concurrency budget.
 """
 
 import os
 import re
 import json
-import base64
-import mimetypes
+import threading
 from pathlib import Path
 from collections import defaultdict
-from datetime import date
-from typing import List, Dict, Any, Optional, Tuple
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
-client: Optional[OpenAI] = None
+import archive
+import brands
+import dedup
+import images
+import metrics
+import phrases
+import providers
+from brief_store import BriefStore, brief_id
+from response_cache import ResponseCache, fingerprint
+from upload_store import UploadCatalog
 
-def init_client(api_key: str):
-    """Initialize OpenAI client with provided API key."""
-    global client
-    client = OpenAI(api_key=api_key)
+response_cache: Optional[ResponseCache] = None
+brief_store: Optional[BriefStore] = None
+upload_catalog: Optional[UploadCatalog] = None
+caption_archive: Optional[dedup.CaptionArchive] = None
+campaign_archive: Optional[archive.CampaignArchive] = None
+brand_store: Optional[brands.BrandStore] = None
+
+def init_client(api_key: str, base_url: Optional[str] = None):
+    """Register the OpenAI provider as default (base_url: e.g. a local mock server)."""
+    return providers.register(
+        providers.OpenAIProvider(api_key, base_url=base_url, limiter=providers.limiter_from_env("openai", "OPENAI")),
+        default=True,
+    )
+
+def init_response_cache(path=None, **kwargs) -> ResponseCache:
+    """Enable the persistent cache of validated post responses."""
+    global response_cache
+    response_cache = ResponseCache(path, **kwargs) if path else ResponseCache(**kwargs)
+    return response_cache
+
+def init_brief_store(path=None, **kwargs) -> BriefStore:
+    """Enable reuse of week briefs across requests with identical inputs."""
+    global brief_store
+    brief_store = BriefStore(path, **kwargs) if path else BriefStore(**kwargs)
+    return brief_store
+
+def init_caption_archive(path=None, **kwargs) -> dedup.CaptionArchive:
+    """Check new captions against the brand's past captions (near-duplicates)."""
+    global caption_archive
+    caption_archive = dedup.CaptionArchive(path, **kwargs) if path else dedup.CaptionArchive(**kwargs)
+    return caption_archive
+
+def init_campaign_archive(path=None) -> archive.CampaignArchive:
+    """Archive every brief and post as it is produced (full-text search)."""
+    global campaign_archive
+    campaign_archive = archive.CampaignArchive(path) if path else archive.CampaignArchive()
+    return campaign_archive
+
+def init_brand_store(path=None) -> brands.BrandStore:
+    """Enable brand profiles referenced by brand_id."""
+    global brand_store
+    build = lambda brand_id, profile: BrandProfile(**profile, brand_id=brand_id)
+    brand_store = brands.BrandStore(path, build=build) if path else brands.BrandStore(build=build)
+    return brand_store
+
+def init_upload_catalog(catalog: Optional[UploadCatalog]) -> Optional[UploadCatalog]:
+    """Route uploaded images with the catalog instead of checking each file on disk."""
+    global upload_catalog
+    upload_catalog = catalog
+    return upload_catalog
 
 # -----------------------------
 # Cost-control knobs
@@ -40,6 +113,9 @@ TEMPERATURE = 0.2
 MAX_OUTPUT_TOKENS_POST = 1024
 MAX_OUTPUT_TOKENS_BRIEF = 1024
 MAX_RETRIES_POST = 1
+MAX_CONCURRENT_POSTS = 4  # post calls in flight per campaign (1 = serial)
+MAX_CONCURRENT_CALENDAR = 16  # brief + post calls in flight per calendar, shared by all its weeks
+MAX_CALENDAR_WEEKS = 26
 
 # -----------------------------
 # Default anti-repetition blacklist
@@ -72,15 +148,21 @@ def choose_angle(prev_angle: Optional[str]) -> str:
     except ValueError:
         return ANGLES[0]
 
+def plan_angles(n_slots: int) -> List[str]:
+    """Angles for a whole schedule, so slots can be generated independently."""
+    angles: List[str] = []
+    prev_angle: Optional[str] = None
+    for _ in range(n_slots):
+        prev_angle = choose_angle(prev_angle)
+        angles.append(prev_angle)
+    return angles
+
 # -----------------------------
 # Helpers
 # -----------------------------
 def img_to_data_url(image_path: str) -> str:
-    mime, _ = mimetypes.guess_type(image_path)
-    mime = mime or "image/jpeg"
-    with open(image_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    return f"data:{mime};base64,{b64}"
+    """Downscaled, metadata-free data URL, cached by content hash (see images.py)."""
+    return images.image_data_url(image_path)
 
 def ensure_paths(images: List[str]) -> List[str]:
     out = []
@@ -258,10 +340,57 @@ def default_do_not_use(
     if availability_policy == "no_availability":
         base += ["disponibile", "disponibili"]
     
-    banned = custom_banned_phrases if custom_banned_phrases else DEFAULT_BANNED_PHRASES
-    base += banned
+    # Blacklist lunghe: nel prompt solo le prime frasi, le altre le blocca validate_post
+    base += phrases.prompt_phrases(banned_phrases(custom_banned_phrases))
     return sorted(set(base))
 
+def banned_phrases(custom_banned_phrases: List[str] = None) -> List[str]:
+    return custom_banned_phrases if custom_banned_phrases else DEFAULT_BANNED_PHRASES
+
+def banned_matcher(custom_banned_phrases: List[str] = None) -> phrases.PhraseMatcher:
+    """Compiled (and cached) matcher for the blacklist in use."""
+    return phrases.matcher_for(banned_phrases(custom_banned_phrases))
+
+# -----------------------------
+# Brand profile
+# -----------------------------
+class BrandProfile:
+    """Brand-dependent prompt components, built once and shared by every slot and request."""
+
+    def __init__(
+        self,
+        brand_name: str = "Brand",
+        brand_description: str = "",
+        brand_tagline: str = "",
+        brand_history: str = "",
+        required_hashtags: List[str] = None,
+        base_hashtags: List[str] = None,
+        custom_banned_phrases: List[str] = None,
+        brand_id: Optional[str] = None,
+    ):
+        self.brand_name = brand_name
+        self.brand_id = brand_id
+        # Chiave di archivio e dedup: il brand_id dei profili salvati (stabile anche se
+        # il nome cambia, distinto tra brand omonimi), altrimenti il nome
+        self.brand_key = brand_id or brand_name
+        self.required_hashtags = required_hashtags if required_hashtags is not None else ["#handmade"]
+        self.base_hashtags = base_hashtags if base_hashtags is not None else []
+        self.custom_banned_phrases = custom_banned_phrases
+        self.brand_facts = build_brand_facts(brand_name, brand_description, brand_tagline, brand_history)
+        self.template_specs = build_template_specs(brand_name, brand_tagline)
+        self.system_message = build_system_message(self.required_hashtags)
+        self.banned_matcher = banned_matcher(custom_banned_phrases)
+        self._do_not_use: Dict[Tuple[str, bool], List[str]] = {}
+
+    def do_not_use(self, availability_policy: str, cta_enabled: bool) -> List[str]:
+        """default_do_not_use for this brand, memoized per (policy, cta)."""
+        key = (availability_policy, cta_enabled)
+        found = self._do_not_use.get(key)
+        if found is None:
+            found = default_do_not_use(availability_policy, cta_enabled, self.custom_banned_phrases)
+            self._do_not_use[key] = found
+        return found
+
 # -----------------------------
 # Subject from filename
 # -----------------------------
@@ -280,11 +409,16 @@ def subject_from_filename(image_path: str, fallback: str) -> str:
 # Validation
 # -----------------------------
 def validate_week_brief(brief: Dict[str, Any]) -> None:
-    if brief["cta"]["day"] != "sun":
+    missing = [k for k in WEEK_BRIEF_SCHEMA["required"] if k not in brief]
+    if missing:
+        raise ValueError(f"week_brief missing fields: {missing}")
+    if not isinstance(brief["cta"], dict) or not isinstance(brief["keywords"], list):
+        raise ValueError("week_brief.cta must be an object and keywords a list")
+    if brief["cta"].get("day") != "sun":
         raise ValueError("cta.day must be 'sun'")
-    if _EMOJI_RE.search(brief["cta"]["text"]):
+    if _EMOJI_RE.search(brief["cta"].get("text", "")):
         raise ValueError("CTA must not contain emoji")
-    if not brief["cta"]["text"].strip():
+    if not brief["cta"].get("text", "").strip():
         raise ValueError("CTA text must be non-empty")
 
 def validate_post(
@@ -294,7 +428,8 @@ def validate_post(
     week_brief: Dict[str, Any],
     cta_enabled: bool,
     template_specs: Dict[str, Any],
-    required_hashtags: List[str]
+    required_hashtags: List[str],
+    banned: Optional[phrases.PhraseMatcher] = None,
 ) -> None:
     if post["template_id"] != template_id:
         raise ValueError("template_id mismatch")
@@ -351,21 +486,122 @@ def validate_post(
         if last_line != cta_text:
             raise ValueError("CTA slot caption must end with CTA line")
 
+    if banned is not None:
+        hits = banned.scan_post(post)
+        if hits:
+            raise ValueError(f"banned phrases: {', '.join(str(h) for h in hits[:5])}")
+
+# -----------------------------
+# Local repair
+# -----------------------------
+# Molti fallimenti di validate_post sono meccanici (hashtag mancanti o
+# duplicati, ig_caption_full non allineato, titolo troppo lungo, emoji,
+# riga CTA fuori posto): si correggono qui senza pagare un'altra chiamata.
+REPAIR_STATS = {"validation_failures": 0, "repaired_locally": 0, "model_retries": 0}
+_repair_lock = threading.Lock()
+
+def _count_repair(name: str) -> None:
+    with _repair_lock:
+        REPAIR_STATS[name] += 1
+
+def repair_stats() -> Dict[str, int]:
+    with _repair_lock:
+        return dict(REPAIR_STATS)
+
+def _strip_emoji(text: str) -> str:
+    text = _EMOJI_RE.sub("", text)
+    text = re.sub(r"[ \t]{2,}", " ", text)
+    text = re.sub(r" +([.,;:!?])", r"\1", text)
+    return "\n".join(line.strip() for line in text.splitlines()).strip()
+
+def repair_post(
+    post: Dict[str, Any],
+    template_id: str,
+    day_name: str,
+    week_brief: Dict[str, Any],
+    cta_enabled: bool,
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+) -> Dict[str, Any]:
+    """Deterministic fixes for mechanical validation failures (returns a new dict)."""
+    post = json.loads(json.dumps(post))
+    post["template_id"] = template_id
+    post["day_name"] = day_name
+
+    caption = _strip_emoji(post.get("caption") or "")
+    title = post.get("title")
+
+    spec = template_specs[template_id]
+    if not spec["needs_title"]:
+        title = None
+    elif isinstance(title, str):
+        title = " ".join(_strip_emoji(title).split()[:3]) or None
+    post["title"] = title
+
+    cta_text = week_brief["cta"]["text"].strip()
+    if cta_enabled and cta_text:
+        lines = [ln for ln in caption.splitlines() if ln.strip() and ln.strip() != cta_text]
+        body = "\n".join(lines).replace(cta_text, "").strip()
+        caption = f"{body}\n{cta_text}" if body else cta_text
+    post["caption"] = caption
+
+    week_kw = week_brief["keywords"]
+    used = [k for k in post.get("keywords_used") or [] if k in week_kw]
+    if not used:
+        used = [k for k in week_kw if k.lower() in caption.lower()]
+    post["keywords_used"] = list(dict.fromkeys(used))[:2]
+
+    content = post.setdefault("content", {})
+    tags = [t for t in content.get("hashtags") or [] if isinstance(t, str)]
+    tags = list(dict.fromkeys(list(required_hashtags) + tags))
+    content["hashtags"] = tags
+    post["ig_caption_full"] = caption.rstrip() + "\n" + " ".join(tags)
+    return post
+
+def validate_or_repair(
+    post: Dict[str, Any],
+    template_id: str,
+    day_name: str,
+    week_brief: Dict[str, Any],
+    cta_enabled: bool,
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+    post_role: str = "",
+    banned: Optional[phrases.PhraseMatcher] = None,
+) -> Dict[str, Any]:
+    """validate_post, falling back to repair_post; raises the original error if unrepairable."""
+    args = (template_id, day_name, week_brief, cta_enabled, template_specs, required_hashtags)
+    labels = {"template_id": template_id, "post_role": post_role}
+    with metrics.VALIDATION_SECONDS.time(**labels):
+        try:
+            validate_post(post, *args, banned=banned)
+            return post
+        except Exception as e:
+            _count_repair("validation_failures")
+            error = e
+        try:
+            fixed = repair_post(post, *args)
+            validate_post(fixed, *args, banned=banned)
+        except Exception:
+            metrics.VALIDATION_FAILURES.inc(error=metrics.error_label(error), outcome="rejected", **labels)
+            raise error
+    metrics.VALIDATION_FAILURES.inc(error=metrics.error_label(error), outcome="repaired", **labels)
+    _count_repair("repaired_locally")
+    return fixed
+
 # -----------------------------
 # Week brief generation
 # -----------------------------
-def generate_week_brief(
+def build_week_brief_prompt(
     goal: str,
     theme: str,
     brand_facts: str,
-    required_hashtags: List[str],
     cta_mode: str = "dm",
     voice: str = "minimal",
     featured_category: str = "mix",
     availability_policy: str = "no_availability",
     start_date: Optional[str] = None,
-    model: str = MODEL,
-) -> Dict[str, Any]:
+) -> str:
     wk = start_date or date.today().isoformat()
     if cta_mode == "dm":
         cta_hint = "CTA domenica: una riga che invita a scrivere in DM."
@@ -376,9 +612,7 @@ def generate_week_brief(
     else:
         raise ValueError("cta_mode must be dm|link_in_bio|fiera")
 
-    system_msg = build_system_message(required_hashtags)
-    
-    prompt = (
+    return (
         f"{brand_facts}\n\n"
         f"week_id: {wk}\n"
         f"theme: {theme}\n"
@@ -394,22 +628,80 @@ def generate_week_brief(
         "- Niente emoji.\n"
     )
 
-    resp = client.responses.create(
+def week_brief_request(system_msg: str, prompt: str, model: str = MODEL) -> Dict[str, Any]:
+    """Body of the Responses API call for a week brief (also used for batch files)."""
+    return {
+        "model": model,
+        "input": [{"role":"system","content":system_msg},{"role":"user","content":prompt}],
+        "temperature": TEMPERATURE,
+        "max_output_tokens": MAX_OUTPUT_TOKENS_BRIEF,
+        "text": {"format":{"type":"json_schema","name":"week_brief","strict":True,"schema":WEEK_BRIEF_SCHEMA}},
+        "store": False,
+    }
+
+def week_brief_input_key(system_msg: str, prompt: str, model: str = MODEL, provider: str = "openai") -> str:
+    return fingerprint(
+        kind="week_brief",
+        provider=provider,
         model=model,
-        input=[{"role":"system","content":system_msg},{"role":"user","content":prompt}],
+        schema=WEEK_BRIEF_SCHEMA,
         temperature=TEMPERATURE,
-        max_output_tokens=MAX_OUTPUT_TOKENS_BRIEF,
-        text={"format":{"type":"json_schema","name":"week_brief","strict":True,"schema":WEEK_BRIEF_SCHEMA}},
-        store=False,
+        system=system_msg,
+        prompt=prompt,
+    )
+
+def generate_week_brief(
+    goal: str,
+    theme: str,
+    brand_facts: str,
+    required_hashtags: List[str],
+    cta_mode: str = "dm",
+    voice: str = "minimal",
+    featured_category: str = "mix",
+    availability_policy: str = "no_availability",
+    start_date: Optional[str] = None,
+    model: str = MODEL,
+    use_cache: bool = True,
+    usage: Optional[List[Dict[str, Any]]] = None,
+    provider: Optional[str] = None,
+    system_msg: Optional[str] = None,
+) -> Dict[str, Any]:
+    llm = providers.get(provider)
+    if system_msg is None:
+        system_msg = build_system_message(required_hashtags)
+    prompt = build_week_brief_prompt(
+        goal, theme, brand_facts, cta_mode, voice, featured_category, availability_policy, start_date
     )
+
+    # Stessi input => stesso brief. Con use_cache=False si rigenera,
+    # a meno che il brief associato a questi input sia stato pinnato.
+    input_key = None
+    if brief_store is not None:
+        input_key = week_brief_input_key(system_msg, prompt, model, llm.name)
+        cached = brief_store.lookup(input_key, include_unpinned=use_cache)
+        if cached is not None:
+            if usage is not None:
+                usage.append({"call": "brief", "cache_hit": True})
+            return cached
+
+    labels = {"provider": llm.name, "model": model, "template_id": "", "post_role": ""}
+    with metrics.MODEL_CALL_SECONDS.time(call="brief", **labels):
+        resp = llm.complete(week_brief_request(system_msg, prompt, model))
+    record_usage(usage, resp, call="brief")
+    observe_tokens(resp, call="brief", **labels)
     brief = json.loads(resp.output_text)
     validate_week_brief(brief)
+    if input_key is not None:
+        brief_store.save(brief, input_key=input_key)
     return brief
 
 # -----------------------------
 # Writing rules builder
 # -----------------------------
-def build_writing_rules(angle: str, prev_angle: Optional[str]) -> str:
+# Le regole sono divise in una parte statica (uguale per tutti gli slot, va nel
+# prefisso del prompt) e una parte per slot (angolo), così il prefisso resta
+# identico byte per byte e il caching automatico del provider si applica.
+def build_static_writing_rules() -> str:
     return (
         "SCRITTURA (vincoli obbligatori):\n"
         "- Caption in italiano, massimo 3 frasi totali.\n"
@@ -420,66 +712,95 @@ def build_writing_rules(angle: str, prev_angle: Optional[str]) -> str:
         "- Frase 1: descrizione concreta di ciò che si vede nell'immagine.\n"
         "- Frase 2: un aspetto materiale o manuale specifico coerente con l'immagine.\n"
         "- Frase 3: chiusura fissa di brand (se prevista dal template).\n\n"
+        "CONTENUTO:\n"
+        "- Usa ESATTAMENTE 1 o 2 parole chiave da WEEK_BRIEF.keywords.\n"
+        "- Riporta le parole chiave scelte anche nel campo keywords_used.\n"
+    )
+
+def build_angle_rules(angle: str, prev_angle: Optional[str]) -> str:
+    return (
         "VARIAZIONE (anti-ripetizione):\n"
         f"- Angolo descrittivo di questo post: '{angle}'. Usa SOLO questo angolo.\n"
         + (f"- Angolo del post precedente: '{prev_angle}'. Non ripeterlo.\n" if prev_angle else "")
-        + "\nCONTENUTO:\n"
-        "- Usa ESATTAMENTE 1 o 2 parole chiave da WEEK_BRIEF.keywords.\n"
-        "- Riporta le parole chiave scelte anche nel campo keywords_used.\n"
-        "- Non usare CTA.\n"
     )
 
+def build_writing_rules(angle: str, prev_angle: Optional[str]) -> str:
+    return build_static_writing_rules() + "\n" + build_angle_rules(angle, prev_angle)
+
 # -----------------------------
 # Post generation
 # -----------------------------
-def generate_post(
+def build_post_prefix(
+    week_brief: Dict[str, Any],
+    brand_facts: str,
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+    base_hashtags: List[str],
+    availability_policy: str,
+    custom_banned_phrases: List[str] = None,
+    base_do_not_use: Optional[List[str]] = None,
+) -> str:
+    """Static part of the post prompt: byte-identical for every slot of a campaign."""
+    # Lista comune a tutti gli slot; gli slot senza CTA aggiungono le parole CTA nel suffisso
+    if base_do_not_use is None:
+        base_do_not_use = default_do_not_use(availability_policy, True, custom_banned_phrases)
+    fixed_hashtags = required_hashtags + base_hashtags
+
+    template_rules = "".join(
+        f"{tid}:\n- {spec['title_rule']}\n- {spec['caption_rule']}\n- {spec['alt_rule']}\n"
+        for tid, spec in sorted(template_specs.items())
+    )
+
+    return (
+        f"{brand_facts}\n\n"
+        f"WEEK_BRIEF: {json.dumps(week_brief, ensure_ascii=False, sort_keys=True)}\n\n"
+        f"do_not_use (lista base, comune a tutti i post): {base_do_not_use}\n\n"
+        "VINCOLI TEMPLATE (applica SOLO quelli del TEMPLATE indicato nello SLOT):\n"
+        + template_rules + "\n"
+        + build_static_writing_rules() +
+        "\nOUTPUT:\n"
+        "- Restituisci SOLO JSON conforme allo schema.\n"
+        "- ig_caption_full = caption + newline + hashtags su una sola riga.\n"
+        f"- hashtags devono includere almeno: {fixed_hashtags}\n"
+    )
+
+def build_post_suffix(
     template_id: str,
     subject: str,
-    image_path: str,
     slot_index: int,
     day_name: str,
     post_role: str,
     cta_enabled: bool,
     week_brief: Dict[str, Any],
-    brand_facts: str,
-    template_specs: Dict[str, Any],
-    required_hashtags: List[str],
-    base_hashtags: List[str],
     availability_policy: str,
     angle: str,
     prev_angle: Optional[str],
     custom_banned_phrases: List[str] = None,
-    model: str = MODEL,
-) -> Dict[str, Any]:
-    spec = template_specs[template_id]
-    data_url = img_to_data_url(image_path)
+    base_do_not_use: Optional[List[str]] = None,
+    do_not_use: Optional[List[str]] = None,
+) -> str:
+    """Per-slot part of the post prompt, sent after the static prefix."""
     cta_text = week_brief["cta"]["text"].strip()
-    do_not_use = default_do_not_use(availability_policy, cta_enabled, custom_banned_phrases)
+    if base_do_not_use is None:
+        base_do_not_use = default_do_not_use(availability_policy, True, custom_banned_phrases)
+    if do_not_use is None:
+        do_not_use = default_do_not_use(availability_policy, cta_enabled, custom_banned_phrases)
+    extra_do_not_use = [w for w in do_not_use if w not in base_do_not_use]
 
-    system_msg = build_system_message(required_hashtags)
-    writing_rules = build_writing_rules(angle=angle, prev_angle=prev_angle)
-    
-    fixed_hashtags = required_hashtags + base_hashtags
-
-    user_instructions = (
-        f"{brand_facts}\n\n"
-        f"WEEK_BRIEF: {json.dumps(week_brief, ensure_ascii=False)}\n"
+    return (
+        "SLOT:\n"
         f"TEMPLATE: {template_id}\n"
         f"SLOT_INDEX: {slot_index}\n"
         f"DAY_NAME: {day_name}\n"
         f"POST_ROLE: {post_role}\n"
         f"CTA_ENABLED: {cta_enabled}\n"
         f"SUBJECT (hint): {subject}\n\n"
-        f"do_not_use (esattamente questa lista): {do_not_use}\n\n"
-        "VINCOLI TEMPLATE:\n"
-        f"- {spec['title_rule']}\n"
-        f"- {spec['caption_rule']}\n"
-        f"- {spec['alt_rule']}\n\n"
-        + writing_rules +
-        "\nOUTPUT:\n"
-        "- Restituisci SOLO JSON conforme allo schema.\n"
-        "- ig_caption_full = caption + newline + hashtags su una sola riga.\n"
-        f"- hashtags devono includere almeno: {fixed_hashtags}\n"
+        + (
+            f"do_not_use di questo post = lista base + {extra_do_not_use}\n\n"
+            if extra_do_not_use else
+            "do_not_use di questo post = lista base\n\n"
+        )
+        + build_angle_rules(angle, prev_angle)
         + (
             f"- Poiché CTA_ENABLED=True: la caption DEVE terminare con questa riga identica (ultima riga): {cta_text}\n"
             if cta_enabled else
@@ -487,36 +808,307 @@ def generate_post(
         )
     )
 
-    def _call(extra: Optional[str] = None) -> Dict[str, Any]:
-        msgs = [
-            {"role":"system","content":system_msg},
-            {"role":"user","content":[
-                {"type":"input_text","text":user_instructions},
-                {"type":"input_image","image_url":data_url},
-            ]},
-        ]
-        if extra:
-            msgs.append({"role":"user","content":extra})
-        r = client.responses.create(
-            model=model,
-            input=msgs,
-            temperature=TEMPERATURE,
-            max_output_tokens=MAX_OUTPUT_TOKENS_POST,
-            text={"format":{"type":"json_schema","name":"post","strict":True,"schema":POST_SCHEMA}},
-            store=False,
+def build_post_instructions(
+    template_id: str,
+    subject: str,
+    slot_index: int,
+    day_name: str,
+    post_role: str,
+    cta_enabled: bool,
+    week_brief: Dict[str, Any],
+    brand_facts: str,
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+    base_hashtags: List[str],
+    availability_policy: str,
+    angle: str,
+    prev_angle: Optional[str],
+    custom_banned_phrases: List[str] = None,
+    profile: Optional[BrandProfile] = None,
+) -> Tuple[str, str]:
+    """(static prefix, per-slot suffix) of the post prompt."""
+    base_do_not_use = do_not_use = None
+    if profile is not None:
+        base_do_not_use = profile.do_not_use(availability_policy, True)
+        do_not_use = profile.do_not_use(availability_policy, cta_enabled)
+    prefix = build_post_prefix(
+        week_brief, brand_facts, template_specs, required_hashtags, base_hashtags,
+        availability_policy, custom_banned_phrases, base_do_not_use,
+    )
+    suffix = build_post_suffix(
+        template_id, subject, slot_index, day_name, post_role, cta_enabled, week_brief,
+        availability_policy, angle, prev_angle, custom_banned_phrases, base_do_not_use, do_not_use,
+    )
+    return prefix, suffix
+
+def post_request(
+    system_msg: str,
+    instructions: Tuple[str, str],
+    data_url: str,
+    model: str = MODEL,
+) -> Dict[str, Any]:
+    """Body of the Responses API call for a post (also used for batch files).
+
+    Order matters for prompt caching: system + static prefix first (shared by
+    every slot), then the slot suffix and the image.
+    """
+    prefix, suffix = instructions
+    msgs = [
+        {"role":"system","content":system_msg},
+        {"role":"user","content":[{"type":"input_text","text":prefix}]},
+        {"role":"user","content":[
+            {"type":"input_text","text":suffix},
+            {"type":"input_image","image_url":data_url},
+        ]},
+    ]
+    return {
+        "model": model,
+        "input": msgs,
+        "temperature": TEMPERATURE,
+        "max_output_tokens": MAX_OUTPUT_TOKENS_POST,
+        "text": {"format":{"type":"json_schema","name":"post","strict":True,"schema":POST_SCHEMA}},
+        "store": False,
+    }
+
+def build_post_fix_instructions(
+    error: Any,
+    template_id: str,
+    cta_enabled: bool,
+    week_brief: Dict[str, Any],
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+    base_hashtags: List[str],
+) -> str:
+    """Only the constraints a correction needs: no brand facts, brief or image."""
+    spec = template_specs[template_id]
+    cta_text = week_brief["cta"]["text"].strip()
+    return (
+        "Il JSON precedente non ha superato la validazione.\n"
+        f"ERRORE: {str(error)}\n\n"
+        "VINCOLI:\n"
+        f"- {spec['title_rule']}\n"
+        f"- {spec['caption_rule']}\n"
+        "- Caption: massimo 3 frasi, niente emoji.\n"
+        f"- keywords_used: 1 o 2 elementi presi da {week_brief['keywords']}\n"
+        f"- hashtags devono includere almeno: {required_hashtags + base_hashtags}, senza duplicati\n"
+        "- ig_caption_full = caption + newline + hashtags su una sola riga.\n"
+        + (
+            f"- La caption DEVE terminare con questa riga identica (ultima riga): {cta_text}\n"
+            if cta_enabled else
+            "- NON inserire CTA (DM/link/acquisto/disponibilità).\n"
         )
-        return json.loads(r.output_text)
+        + "\nCorreggi SOLO il problema indicato, senza cambiare il resto. Restituisci solo il JSON corretto."
+    )
+
+def post_retry_request(
+    system_msg: str,
+    rejected_post: Dict[str, Any],
+    fix_instructions: str,
+    model: str = MODEL,
+) -> Dict[str, Any]:
+    """Text-only correction turn: the rejected JSON plus the error, never the image."""
+    msgs = [
+        {"role":"system","content":system_msg},
+        {"role":"assistant","content":json.dumps(rejected_post, ensure_ascii=False)},
+        {"role":"user","content":fix_instructions},
+    ]
+    return {
+        "model": model,
+        "input": msgs,
+        "temperature": TEMPERATURE,
+        "max_output_tokens": MAX_OUTPUT_TOKENS_POST,
+        "text": {"format":{"type":"json_schema","name":"post","strict":True,"schema":POST_SCHEMA}},
+        "store": False,
+    }
+
+# -----------------------------
+# Token usage
+# -----------------------------
+def record_usage(usage: Optional[List[Dict[str, Any]]], resp: providers.Completion, **meta: Any) -> None:
+    """Append the token counts of a provider result to `usage` (if collecting)."""
+    if usage is None:
+        return
+    usage.append({**meta, **resp.usage})
+
+def observe_tokens(resp: providers.Completion, **labels: str) -> None:
+    """Token counts of a call into the /metrics counters."""
+    for k, n in resp.usage.items():
+        metrics.MODEL_TOKENS.inc(n, kind=k[:-len("_tokens")], **labels)
+
+def summarize_usage(usage: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Totals per call kind (brief / post / retry), with the share of cached input tokens."""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for rec in usage:
+        t = totals.setdefault(rec["call"], {"calls": 0, "cache_hits": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0})
+        if rec.get("cache_hit"):
+            t["cache_hits"] += 1
+            continue
+        t["calls"] += 1
+        for k in ("input_tokens", "output_tokens", "cached_tokens"):
+            t[k] += rec.get(k, 0)
+    for t in totals.values():
+        t["cached_ratio"] = round(t["cached_tokens"] / t["input_tokens"], 4) if t["input_tokens"] else 0.0
+    return totals
+
+def post_cache_key(
+    system_msg: str,
+    instructions: Tuple[str, str],
+    image_path: str,
+    model: str = MODEL,
+    provider: str = "openai",
+) -> str:
+    return fingerprint(
+        kind="post",
+        provider=provider,
+        model=model,
+        schema=POST_SCHEMA,
+        temperature=TEMPERATURE,
+        max_output_tokens=MAX_OUTPUT_TOKENS_POST,
+        system=system_msg,
+        instructions=list(instructions),
+        image_sha256=images.file_digest(image_path),
+    )
 
-    post = _call()
+def generate_post(
+    template_id: str,
+    subject: str,
+    image_path: str,
+    slot_index: int,
+    day_name: str,
+    post_role: str,
+    cta_enabled: bool,
+    week_brief: Dict[str, Any],
+    brand_facts: str,
+    template_specs: Dict[str, Any],
+    required_hashtags: List[str],
+    base_hashtags: List[str],
+    availability_policy: str,
+    angle: str,
+    prev_angle: Optional[str],
+    custom_banned_phrases: List[str] = None,
+    model: str = MODEL,
+    use_cache: bool = True,
+    usage: Optional[List[Dict[str, Any]]] = None,
+    provider: Optional[str] = None,
+    brand: Optional[str] = None,
+    profile: Optional[BrandProfile] = None,
+) -> Dict[str, Any]:
+    llm = providers.get(provider)
+    system_msg = profile.system_message if profile is not None else build_system_message(required_hashtags)
+    instructions = build_post_instructions(
+        template_id=template_id,
+        subject=subject,
+        slot_index=slot_index,
+        day_name=day_name,
+        post_role=post_role,
+        cta_enabled=cta_enabled,
+        week_brief=week_brief,
+        brand_facts=brand_facts,
+        template_specs=template_specs,
+        required_hashtags=required_hashtags,
+        base_hashtags=base_hashtags,
+        availability_policy=availability_policy,
+        angle=angle,
+        prev_angle=prev_angle,
+        custom_banned_phrases=custom_banned_phrases,
+        profile=profile,
+    )
+
+    # Cache: stessa richiesta (istruzioni + immagine) => stesso post validato.
+    # Con use_cache=False si forza un output nuovo, che poi sostituisce quello in cache.
+    cache_key = None
+    check_duplicates = caption_archive is not None and bool(brand) and dedup.ACTION != "off"
+    if response_cache is not None or check_duplicates:
+        cache_key = post_cache_key(system_msg, instructions, image_path, model, llm.name)
+    labels = {"template_id": template_id, "post_role": post_role}
+    if response_cache is not None:
+        if use_cache:
+            cached = response_cache.get(cache_key)
+            # Anche i post in cache passano dal controllo: l'archivio può avere caption
+            # più recenti (di altre richieste) di quando il post è stato salvato
+            matches = []
+            if cached is not None and check_duplicates:
+                matches = caption_archive.find(brand, cached["caption"], exclude_post_key=cache_key)
+            if cached is not None and not (matches and dedup.ACTION == "regenerate"):
+                if usage is not None:
+                    usage.append({"call": "post", "slot_index": slot_index, "cache_hit": True})
+                if check_duplicates:
+                    _archive_caption(cached, matches, brand, cache_key, labels)
+                return cached
+            # Duplicato con ACTION=regenerate: si genera un post nuovo, che sostituisce quello in cache
+
+    data_url = img_to_data_url(image_path)
+
+    call_labels = {"provider": llm.name, "model": model, **labels}
+    with metrics.MODEL_CALL_SECONDS.time(call="post", **call_labels):
+        r = llm.complete(post_request(system_msg, instructions, data_url, model))
+    record_usage(usage, r, call="post", slot_index=slot_index, image=True)
+    observe_tokens(r, call="post", **call_labels)
+    post = json.loads(r.output_text)
+
+    validation_args = (
+        template_id, day_name, week_brief, cta_enabled, template_specs, required_hashtags, post_role,
+        profile.banned_matcher if profile is not None else banned_matcher(custom_banned_phrases),
+    )
     try:
-        validate_post(post, template_id, day_name, week_brief, cta_enabled, template_specs, required_hashtags)
-        return post
+        post = validate_or_repair(post, *validation_args)
     except Exception as e:
         if MAX_RETRIES_POST <= 0:
             raise
-        post2 = _call(extra=f"Fix ONLY the validation issue: {str(e)}. Return only corrected JSON.")
-        validate_post(post2, template_id, day_name, week_brief, cta_enabled, template_specs, required_hashtags)
-        return post2
+        _count_repair("model_retries")
+        metrics.POST_RETRIES.inc(error=metrics.error_label(e), **labels)
+        # Correzione solo testo: JSON rifiutato + errore + vincoli del template
+        fix = build_post_fix_instructions(
+            e, template_id, cta_enabled, week_brief, template_specs, required_hashtags, base_hashtags
+        )
+        with metrics.MODEL_CALL_SECONDS.time(call="retry", **call_labels):
+            r = llm.complete(post_retry_request(system_msg, post, fix, model))
+        record_usage(usage, r, call="retry", slot_index=slot_index, image=False, error=str(e))
+        observe_tokens(r, call="retry", **call_labels)
+        post = validate_or_repair(json.loads(r.output_text), *validation_args)
+
+    if check_duplicates:
+        # La stessa richiesta rigenerata (post_key uguale) non conta come duplicato
+        matches = caption_archive.find(brand, post["caption"], exclude_post_key=cache_key)
+        if matches and dedup.ACTION == "regenerate":
+            error = (
+                f"caption troppo simile (similarità {matches[0]['similarity']}) a una caption già pubblicata: "
+                f"\"{matches[0]['caption']}\". Riscrivi la caption con parole e struttura diverse"
+            )
+            fix = build_post_fix_instructions(
+                error, template_id, cta_enabled, week_brief, template_specs, required_hashtags, base_hashtags
+            )
+            try:
+                with metrics.MODEL_CALL_SECONDS.time(call="retry", **call_labels):
+                    r = llm.complete(post_retry_request(system_msg, post, fix, model))
+                record_usage(usage, r, call="retry", slot_index=slot_index, image=False, error="near duplicate")
+                observe_tokens(r, call="retry", **call_labels)
+                rewritten = validate_or_repair(json.loads(r.output_text), *validation_args)
+            except Exception:
+                rewritten = None  # il post originale è valido: meglio segnalato che perso
+            if rewritten is not None:
+                post = rewritten
+                matches = caption_archive.find(brand, post["caption"], exclude_post_key=cache_key)
+                if not matches:
+                    metrics.NEAR_DUPLICATES.inc(outcome="regenerated", **labels)
+        _archive_caption(post, matches, brand, cache_key, labels)
+
+    if response_cache is not None:
+        response_cache.put(cache_key, post)
+    return post
+
+def _archive_caption(
+    post: Dict[str, Any], matches: List[Dict[str, Any]], brand: str, post_key: str, labels: Dict[str, str]
+) -> None:
+    """Flag the near duplicates still left on `post` (in place) and archive its caption."""
+    post.pop("near_duplicates", None)
+    if matches:
+        metrics.NEAR_DUPLICATES.inc(outcome="flagged", **labels)
+        post["near_duplicates"] = [
+            {k: m.get(k) for k in ("similarity", "caption", "created_at", "template_id", "post_role")}
+            for m in matches
+        ]
+    caption_archive.add(brand, post["caption"], post_key=post_key, **labels)
 
 # -----------------------------
 # Image routing
@@ -535,9 +1127,14 @@ def _infer_prefix(image_path: str) -> str:
     return name.split("_", 1)[0].strip()
 
 def bucket_images_by_prefix(images: List[str]) -> Dict[str, List[str]]:
+    # Immagini nel catalogo degli upload: esistenza e prefisso da una sola
+    # query; le altre (path arbitrari) vengono controllate su disco
+    catalogued = upload_catalog.lookup(images) if upload_catalog is not None else {}
+    ensure_paths([p for p in images if p not in catalogued])
     buckets = defaultdict(list)
-    for p in ensure_paths(images):
-        prefix = _infer_prefix(p)
+    for p in images:
+        row = catalogued.get(p)
+        prefix = row["prefix"] if row is not None and row["prefix"] else _infer_prefix(p)
         if prefix not in PREFIX_TO_TEMPLATE:
             raise ValueError(f"Unknown prefix '{prefix}' in {Path(p).name}. Use: {list(PREFIX_TO_TEMPLATE)}")
         buckets[PREFIX_TO_TEMPLATE[prefix]].append(p)
@@ -584,6 +1181,7 @@ BASE_CYCLE = [
     ("sat","T2_DETTAGLIO","material", False),
 ]
 CTA_SLOT = ("sun","T4_STORIA","cta", True)
+DAY_OFFSETS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
 
 def build_schedule(n_posts: int) -> List[Tuple[str, str, str, bool]]:
     if n_posts <= 0:
@@ -637,6 +1235,156 @@ def auto_hashtags_for_post(
 
     return out[:n_total]
 
+def finalize_post(post: dict, required_hashtags: List[str], base_hashtags: List[str]) -> dict:
+    """Replace model hashtags with the brand/role set and rebuild ig_caption_full."""
+    tags = auto_hashtags_for_post(post, required_hashtags, base_hashtags, n_total=10)
+    post["content"]["hashtags"] = tags
+    post["ig_caption_full"] = post["caption"].rstrip() + "\n" + " ".join(tags)
+    return post
+
+# -----------------------------
+# Week plan
+# -----------------------------
+def plan_week(
+    images: List[str],
+    n_posts: int,
+    theme: str,
+    strict_routing: bool = False,
+    subject_from_file: bool = True,
+) -> Dict[str, Any]:
+    """Schedule, routed images, angles and subjects: everything a slot needs except the brief."""
+    schedule = build_schedule(n_posts)
+    buckets = bucket_images_by_prefix(images)
+    chosen_images = select_images_for_schedule(schedule, buckets, strict=strict_routing)
+    subjects = [
+        subject_from_filename(p, fallback=theme) if subject_from_file else theme
+        for p in chosen_images
+    ]
+    return {
+        "schedule": schedule,
+        "chosen_images": chosen_images,
+        "angles": plan_angles(len(schedule)),
+        "subjects": subjects,
+    }
+
+def save_week_brief(week_brief: Dict[str, Any], brand: str) -> Optional[str]:
+    """Store (brief_store) and archive a week brief under `brand` (BrandProfile.brand_key); its id, if the brief store is enabled."""
+    week_brief_id = brief_store.save(week_brief) if brief_store is not None else None
+    if campaign_archive is not None:
+        campaign_archive.add_brief(brand, week_brief_id or brief_id(week_brief), week_brief)
+    return week_brief_id
+
+def generate_planned_post(
+    plan: Dict[str, Any],
+    idx: int,
+    week_brief: Dict[str, Any],
+    week_brief_id: Optional[str],
+    brand_profile: BrandProfile,
+    availability_policy: str = "no_availability",
+    model: str = MODEL,
+    provider: Optional[str] = None,
+    use_cache: bool = True,
+    usage: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Generate, finalize and archive slot `idx` of a plan (plan_week / plan_calendar)."""
+    day_name, template_id, post_role, cta_enabled = plan["schedule"][idx]
+    angles = plan["angles"]
+    image_path = plan["chosen_images"][idx]
+    post = generate_post(
+        template_id=template_id,
+        subject=plan["subjects"][idx],
+        image_path=image_path,
+        slot_index=idx,
+        day_name=day_name,
+        post_role=post_role,
+        cta_enabled=cta_enabled,
+        week_brief=week_brief,
+        brand_facts=brand_profile.brand_facts,
+        template_specs=brand_profile.template_specs,
+        required_hashtags=brand_profile.required_hashtags,
+        base_hashtags=brand_profile.base_hashtags,
+        availability_policy=availability_policy,
+        angle=angles[idx],
+        # Nel calendario il primo slot di una settimana continua dall'ultimo della precedente
+        prev_angle=angles[idx - 1] if idx > 0 else plan.get("prev_angle"),
+        custom_banned_phrases=brand_profile.custom_banned_phrases,
+        model=model,
+        provider=provider,
+        use_cache=use_cache,
+        usage=usage,
+        brand=brand_profile.brand_key,
+        profile=brand_profile,
+    )
+    post = finalize_post(post, brand_profile.required_hashtags, brand_profile.base_hashtags)
+    if campaign_archive is not None:
+        campaign_archive.add_post(
+            brand_profile.brand_key, post, week_brief_id or brief_id(week_brief), slot_index=idx, image=image_path
+        )
+    return post
+
+# -----------------------------
+# Calendar plan
+# -----------------------------
+def build_calendar(start_date: str, end_date: str, n_posts: int = 6) -> List[Dict[str, Any]]:
+    """Monday-aligned weeks covering the range, each with the build_schedule slots that fall inside it."""
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    if end < start:
+        raise ValueError("end_date must be >= start_date")
+    week_start = start - timedelta(days=start.weekday())
+    if (end - week_start).days // 7 + 1 > MAX_CALENDAR_WEEKS:
+        raise ValueError(f"calendar can span at most {MAX_CALENDAR_WEEKS} weeks")
+
+    weekly = build_schedule(n_posts)
+    weeks = []
+    while week_start <= end:
+        slots = [
+            (slot, week_start + timedelta(days=DAY_OFFSETS[slot[0]]))
+            for slot in weekly
+        ]
+        # Settimane parziali agli estremi: solo gli slot dentro l'intervallo
+        slots = [(slot, day) for slot, day in slots if start <= day <= end]
+        if slots:
+            weeks.append({
+                "week_start": week_start.isoformat(),
+                "schedule": [slot for slot, _ in slots],
+                "dates": [day.isoformat() for _, day in slots],
+            })
+        week_start += timedelta(days=7)
+    return weeks
+
+def plan_calendar(
+    images: List[str],
+    start_date: str,
+    end_date: str,
+    n_posts: int,
+    theme: str,
+    strict_routing: bool = False,
+    subject_from_file: bool = True,
+) -> List[Dict[str, Any]]:
+    """plan_week for every week of the range, with images routed over the whole range (no reuse)."""
+    weeks = build_calendar(start_date, end_date, n_posts)
+    schedule = [slot for week in weeks for slot in week["schedule"]]
+    if len(images) < len(schedule):
+        raise ValueError(
+            f"the calendar has {len(schedule)} slots but only {len(images)} images (images are not reused)"
+        )
+    buckets = bucket_images_by_prefix(images)
+    chosen_images = select_images_for_schedule(schedule, buckets, strict=strict_routing)
+    angles = plan_angles(len(schedule))
+
+    offset = 0
+    for week in weeks:
+        n = len(week["schedule"])
+        week["chosen_images"] = chosen_images[offset:offset + n]
+        week["angles"] = angles[offset:offset + n]
+        week["prev_angle"] = angles[offset - 1] if offset else None
+        week["subjects"] = [
+            subject_from_filename(p, fallback=theme) if subject_from_file else theme
+            for p in week["chosen_images"]
+        ]
+        offset += n
+    return weeks
+
 # -----------------------------
 # MAIN: generate_posts
 # -----------------------------
@@ -652,6 +1400,8 @@ def generate_posts(
     availability_policy: str = "no_availability",
     strict_routing: bool = False,
     subject_from_file: bool = True,
+    # Data di inizio della settimana (ISO) per il brief; default oggi
+    start_date: Optional[str] = None,
     # Brand params (configurable)
     brand_name: str = "Brand",
     brand_description: str = "",
@@ -660,77 +1410,272 @@ def generate_posts(
     required_hashtags: List[str] = None,
     base_hashtags: List[str] = None,
     custom_banned_phrases: List[str] = None,
+    # Profilo compilato (brands.py): se passato sostituisce i brand params
+    brand_profile: Optional[BrandProfile] = None,
     # Model
     model: str = MODEL,
+    provider: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENT_POSTS,
+    use_cache: bool = True,
+    # Brief già pronto (es. da /briefs): salta la chiamata generate_week_brief
+    week_brief: Optional[Dict[str, Any]] = None,
+    # Progress hooks (job, streaming): chiamati dai thread di generazione
+    on_brief: Optional[Callable[[Dict[str, Any], Optional[str]], None]] = None,
+    on_post: Optional[Callable[[int, Dict[str, Any], str], None]] = None,
 ) -> Dict[str, Any]:
     
-    # Defaults
-    if required_hashtags is None:
-        required_hashtags = ["#handmade"]
-    if base_hashtags is None:
-        base_hashtags = []
-    
-    # Build brand-specific components
-    brand_facts = build_brand_facts(brand_name, brand_description, brand_tagline, brand_history)
-    template_specs = build_template_specs(brand_name, brand_tagline)
+    # Build brand-specific components (once per profile revision for stored brands)
+    if brand_profile is None:
+        brand_profile = BrandProfile(
+            brand_name, brand_description, brand_tagline, brand_history,
+            required_hashtags, base_hashtags, custom_banned_phrases,
+        )
 
-    schedule = build_schedule(n_posts)
-    buckets = bucket_images_by_prefix(images)
-    chosen_images = select_images_for_schedule(schedule, buckets, strict=strict_routing)
+    plan = plan_week(images, n_posts, theme, strict_routing, subject_from_file)
+    schedule, chosen_images = plan["schedule"], plan["chosen_images"]
+    usage: List[Dict[str, Any]] = []
 
-    week_brief = generate_week_brief(
-        goal=goal,
-        theme=theme,
-        brand_facts=brand_facts,
+    if week_brief is not None:
+        validate_week_brief(week_brief)
+    else:
+        week_brief = generate_week_brief(
+            goal=goal,
+            theme=theme,
+            brand_facts=brand_profile.brand_facts,
+            required_hashtags=brand_profile.required_hashtags,
+            cta_mode=cta_mode,
+            voice=voice,
+            featured_category=featured_category,
+            availability_policy=availability_policy,
+            start_date=start_date,
+            model=model,
+            provider=provider,
+            use_cache=use_cache,
+            usage=usage,
+            system_msg=brand_profile.system_message,
+        )
+    week_brief_id = save_week_brief(week_brief, brand_profile.brand_key)
+    if on_brief is not None:
+        on_brief(week_brief, week_brief_id)
+
+    def _generate_slot(idx: int) -> Dict[str, Any]:
+        post = generate_planned_post(
+            plan, idx, week_brief, week_brief_id, brand_profile, availability_policy,
+            model=model, provider=provider, use_cache=use_cache, usage=usage,
+        )
+        if on_post is not None:
+            on_post(idx, post, chosen_images[idx])
+        return post
+
+    # Slots only share the week brief: fan them out, results keep schedule order
+    workers = max(1, min(max_concurrency, len(schedule)))
+    if workers == 1:
+        posts = [_generate_slot(idx) for idx in range(len(schedule))]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="post") as pool:
+            posts = list(pool.map(_generate_slot, range(len(schedule))))
+
+    return {
+        "week_brief": week_brief,
+        "week_brief_id": week_brief_id,
+        "schedule": schedule,
+        "chosen_images": chosen_images,
+        "posts": posts,
+        "usage": {"calls": usage, "totals": summarize_usage(usage)},
+    }
+
+# -----------------------------
+# Single-slot regeneration
+# -----------------------------
+def regenerate_post(
+    week_brief: Dict[str, Any],
+    slot_index: int,
+    theme: str,
+    images: List[str],
+    n_posts: int = 6,
+    availability_policy: str = "no_availability",
+    strict_routing: bool = False,
+    subject_from_file: bool = True,
+    # Brand params (configurable)
+    brand_name: str = "Brand",
+    brand_description: str = "",
+    brand_tagline: str = "",
+    brand_history: str = "",
+    required_hashtags: List[str] = None,
+    base_hashtags: List[str] = None,
+    custom_banned_phrases: List[str] = None,
+    brand_profile: Optional[BrandProfile] = None,
+    # Model
+    model: str = MODEL,
+    provider: Optional[str] = None,
+    # Override dello slot (default: quelli del piano originale)
+    image_path: Optional[str] = None,
+    angle: Optional[str] = None,
+    # Di default si vuole un testo diverso da quello già in cache
+    use_cache: bool = False,
+) -> Dict[str, Any]:
+    """Re-run generate_post for one slot of an existing week, reusing its brief and plan."""
+    if brand_profile is None:
+        brand_profile = BrandProfile(
+            brand_name, brand_description, brand_tagline, brand_history,
+            required_hashtags, base_hashtags, custom_banned_phrases,
+        )
+    required_hashtags = brand_profile.required_hashtags
+    base_hashtags = brand_profile.base_hashtags
+
+    validate_week_brief(week_brief)
+    plan = plan_week(images, n_posts, theme, strict_routing, subject_from_file)
+    schedule = plan["schedule"]
+    if not 0 <= slot_index < len(schedule):
+        raise ValueError(f"slot_index must be in 0..{len(schedule) - 1}")
+    day_name, template_id, post_role, cta_enabled = schedule[slot_index]
+
+    subject = plan["subjects"][slot_index]
+    if image_path is None:
+        image_path = plan["chosen_images"][slot_index]
+    else:
+        image_path = ensure_paths([image_path])[0]
+        subject = subject_from_filename(image_path, fallback=theme) if subject_from_file else theme
+
+    angle = angle or plan["angles"][slot_index]
+    usage: List[Dict[str, Any]] = []
+
+    post = generate_post(
+        template_id=template_id,
+        subject=subject,
+        image_path=image_path,
+        slot_index=slot_index,
+        day_name=day_name,
+        post_role=post_role,
+        cta_enabled=cta_enabled,
+        week_brief=week_brief,
+        brand_facts=brand_profile.brand_facts,
+        template_specs=brand_profile.template_specs,
         required_hashtags=required_hashtags,
-        cta_mode=cta_mode,
-        voice=voice,
-        featured_category=featured_category,
+        base_hashtags=base_hashtags,
         availability_policy=availability_policy,
+        angle=angle,
+        prev_angle=plan["angles"][slot_index - 1] if slot_index > 0 else None,
+        custom_banned_phrases=brand_profile.custom_banned_phrases,
         model=model,
+        provider=provider,
+        use_cache=use_cache,
+        usage=usage,
+        brand=brand_profile.brand_key,
+        profile=brand_profile,
     )
+    post = finalize_post(post, required_hashtags, base_hashtags)
+    if campaign_archive is not None:
+        campaign_archive.add_post(brand_profile.brand_key, post, brief_id(week_brief), slot_index=slot_index, image=image_path)
+    return {
+        "usage": {"calls": usage, "totals": summarize_usage(usage)},
+        "slot_index": slot_index,
+        "schedule_slot": schedule[slot_index],
+        "image_path": image_path,
+        "angle": angle,
+        "post": post,
+    }
 
-    posts = []
-    prev_angle: Optional[str] = None
+# -----------------------------
+# Multi-week calendar
+# -----------------------------
+def generate_calendar(
+    goal: str,
+    theme: str,
+    images: List[str],
+    start_date: str,
+    end_date: str,
+    n_posts: int = 6,
+    cta_mode: str = "dm",
+    voice: str = "minimal",
+    featured_category: str = "mix",
+    availability_policy: str = "no_availability",
+    strict_routing: bool = False,
+    subject_from_file: bool = True,
+    # Brand params (configurable)
+    brand_name: str = "Brand",
+    brand_description: str = "",
+    brand_tagline: str = "",
+    brand_history: str = "",
+    required_hashtags: List[str] = None,
+    base_hashtags: List[str] = None,
+    custom_banned_phrases: List[str] = None,
+    brand_profile: Optional[BrandProfile] = None,
+    # Model
+    model: str = MODEL,
+    provider: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENT_CALENDAR,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """Generate every week of a date range (n_posts per full week) as one calendar document.
 
-    for idx, (day_name, template_id, post_role, cta_enabled) in enumerate(schedule):
-        angle = choose_angle(prev_angle)
-
-        subj = theme
-        if subject_from_file:
-            subj = subject_from_filename(chosen_images[idx], fallback=theme)
-
-        post = generate_post(
-            template_id=template_id,
-            subject=subj,
-            image_path=chosen_images[idx],
-            slot_index=idx,
-            day_name=day_name,
-            post_role=post_role,
-            cta_enabled=cta_enabled,
-            week_brief=week_brief,
-            brand_facts=brand_facts,
-            template_specs=template_specs,
-            required_hashtags=required_hashtags,
-            base_hashtags=base_hashtags,
+    Brand components and image routing are computed once for the whole range.
+    Week briefs are requested concurrently, and each week's slots enter the
+    same pool as soon as its brief is ready, so brief and post calls share one
+    concurrency budget: at most max_concurrency calls in flight for the whole
+    calendar, however many weeks it spans.
+    """
+    if brand_profile is None:
+        brand_profile = BrandProfile(
+            brand_name, brand_description, brand_tagline, brand_history,
+            required_hashtags, base_hashtags, custom_banned_phrases,
+        )
+    weeks = plan_calendar(images, start_date, end_date, n_posts, theme, strict_routing, subject_from_file)
+    usage: List[Dict[str, Any]] = []
+
+    def _week_brief(week: Dict[str, Any]) -> Dict[str, Any]:
+        week_brief = generate_week_brief(
+            goal=goal,
+            theme=theme,
+            brand_facts=brand_profile.brand_facts,
+            required_hashtags=brand_profile.required_hashtags,
+            cta_mode=cta_mode,
+            voice=voice,
+            featured_category=featured_category,
             availability_policy=availability_policy,
-            angle=angle,
-            prev_angle=prev_angle,
-            custom_banned_phrases=custom_banned_phrases,
+            start_date=week["week_start"],
             model=model,
+            provider=provider,
+            use_cache=use_cache,
+            usage=usage,
+            system_msg=brand_profile.system_message,
+        )
+        week["week_brief"] = week_brief
+        week["week_brief_id"] = save_week_brief(week_brief, brand_profile.brand_key)
+        return week
+
+    def _slot(week: Dict[str, Any], idx: int) -> Dict[str, Any]:
+        return generate_planned_post(
+            week, idx, week["week_brief"], week["week_brief_id"], brand_profile, availability_policy,
+            model=model, provider=provider, use_cache=use_cache, usage=usage,
         )
-        
-        # Add hashtags
-        tags = auto_hashtags_for_post(post, required_hashtags, base_hashtags, n_total=10)
-        post["content"]["hashtags"] = tags
-        post["ig_caption_full"] = post["caption"].rstrip() + "\n" + " ".join(tags)
-        
-        posts.append(post)
-        prev_angle = angle
+
+    workers = max(1, min(max_concurrency, sum(len(w["schedule"]) for w in weeks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="calendar") as pool:
+        try:
+            post_futures = {}
+            for done in as_completed([pool.submit(_week_brief, week) for week in weeks]):
+                week = done.result()
+                for idx in range(len(week["schedule"])):
+                    post_futures[(week["week_start"], idx)] = pool.submit(_slot, week, idx)
+            for week in weeks:
+                week["posts"] = [
+                    post_futures[(week["week_start"], idx)].result() for idx in range(len(week["schedule"]))
+                ]
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
 
     return {
-        "week_brief": week_brief,
-        "schedule": schedule,
-        "chosen_images": chosen_images,
-        "posts": posts,
-    }
\ No newline at end of file
+        "start_date": start_date,
+        "end_date": end_date,
+        "n_posts_per_week": n_posts,
+        "weeks": [
+            {
+                k: week[k]
+                for k in ("week_start", "week_brief", "week_brief_id", "schedule", "dates", "chosen_images", "posts")
+            }
+            for week in weeks
+        ],
+        "usage": {"calls": usage, "totals": summarize_usage(usage)},
+    }
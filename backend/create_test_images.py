@@ -62,6 +62,8 @@ def create_test_images():
     print("Creazione immagini di test...")
     for filename in TEST_IMAGES:
         filepath = UPLOAD_DIR / filename
+        # Gli upload sono hard link a blob condivisi (upload_store): mai riscriverli sul posto
+        filepath.unlink(missing_ok=True)
         with open(filepath, 'wb') as f:
             f.write(PLACEHOLDER_JPEG)
         print(f"  ✓ Creato: {filename}")
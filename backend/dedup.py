@@ -0,0 +1,175 @@
+"""
+Near-duplicate captions across weeks.
+
+Ogni caption generata finisce in un archivio per brand con la sua firma
+MinHash (shingle di caratteri sul testo normalizzato come in phrases.py).
+Le firme sono indicizzate con LSH a bande: una caption nuova viene
+confrontata solo con le caption che condividono almeno una banda, quindi
+il controllo costa qualche lookup indicizzato anche con anni di storico.
+
+La similarità stimata (frazione di minhash uguali ≈ Jaccard degli shingle)
+va confrontata con THRESHOLD: con BANDS x ROWS = 16 x 4 una coppia al 0.8
+diventa candidata con probabilità > 99.9%.
+"""
+
+import array
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import phrases
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "captions.sqlite3"
+
+# -----------------------------
+# Knobs (override da env)
+# -----------------------------
+THRESHOLD = float(os.environ.get("CAPTION_DUP_THRESHOLD", "0.8"))
+# regenerate: un retry di correzione, poi flag; flag: solo segnalato; off: nessun controllo
+ACTION = os.environ.get("CAPTION_DUP_ACTION", "regenerate")
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+MAX_MATCHES = 3
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+_rng = random.Random(0x5EED)  # permutazioni fisse: le firme salvate restano confrontabili
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+# -----------------------------
+# MinHash
+# -----------------------------
+def shingles(text: str) -> set:
+    norm = _NON_WORD_RE.sub(" ", phrases.normalize(text)[0]).strip()
+    if len(norm) <= SHINGLE_SIZE:
+        return {norm} if norm else set()
+    return {norm[i:i + SHINGLE_SIZE] for i in range(len(norm) - SHINGLE_SIZE + 1)}
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+def signature(text: str) -> List[int]:
+    """MinHash signature (NUM_PERM values) of the caption's shingles."""
+    hashes = [_hash64(s) for s in shingles(text)]
+    if not hashes:
+        return [_PRIME] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+def band_keys(sig: List[int]) -> List[int]:
+    """One signed 64-bit key per LSH band (band index included in the hash)."""
+    keys = []
+    for band in range(BANDS):
+        chunk = sig[band * ROWS:(band + 1) * ROWS]
+        h = _hash64(f"{band}:" + ",".join(map(str, chunk)))
+        keys.append(h - (1 << 64) if h >= 1 << 63 else h)  # INTEGER di SQLite è con segno
+    return keys
+
+def _pack(sig: List[int]) -> bytes:
+    return array.array("Q", sig).tobytes()
+
+def _unpack(blob: bytes) -> List[int]:
+    a = array.array("Q")
+    a.frombytes(blob)
+    return a.tolist()
+
+# -----------------------------
+# Archive
+# -----------------------------
+class CaptionArchive(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS captions (
+        caption_id INTEGER PRIMARY KEY,
+        brand TEXT NOT NULL,
+        post_key TEXT,
+        caption TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        meta TEXT NOT NULL DEFAULT '{}',
+        created_at REAL NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS captions_post_key ON captions(brand, post_key);
+    CREATE TABLE IF NOT EXISTS caption_bands (
+        brand TEXT NOT NULL,
+        band_key INTEGER NOT NULL,
+        caption_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS caption_bands_lookup ON caption_bands(brand, band_key);
+    CREATE INDEX IF NOT EXISTS caption_bands_caption ON caption_bands(caption_id);
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, threshold: float = THRESHOLD):
+        super().__init__(path)
+        self.threshold = threshold
+
+    def find(
+        self,
+        brand: str,
+        caption: str,
+        threshold: Optional[float] = None,
+        exclude_post_key: Optional[str] = None,
+        sig: Optional[List[int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Archived captions of `brand` at or above the threshold, most similar first."""
+        threshold = self.threshold if threshold is None else threshold
+        sig = sig or signature(caption)
+        keys = band_keys(sig)
+        rows = self.connect().execute(
+            "SELECT c.caption_id, c.post_key, c.caption, c.signature, c.meta, c.created_at FROM captions c"
+            " WHERE c.caption_id IN (SELECT caption_id FROM caption_bands"
+            f" WHERE brand = ? AND band_key IN ({', '.join('?' for _ in keys)}))",
+            (brand, *keys),
+        ).fetchall()
+        matches = []
+        for r in rows:
+            if exclude_post_key is not None and r["post_key"] == exclude_post_key:
+                continue
+            score = similarity(sig, _unpack(r["signature"]))
+            if score >= threshold:
+                matches.append({
+                    "caption_id": r["caption_id"],
+                    "similarity": round(score, 3),
+                    "caption": r["caption"],
+                    "created_at": r["created_at"],
+                    **json.loads(r["meta"]),
+                })
+        matches.sort(key=lambda m: -m["similarity"])
+        return matches[:MAX_MATCHES]
+
+    def add(self, brand: str, caption: str, post_key: Optional[str] = None, **meta: Any) -> int:
+        """Archive a caption; a new caption for the same post_key replaces the old one."""
+        sig = signature(caption)
+        conn = self.connect()
+        with conn:
+            if post_key is not None:
+                old = conn.execute(
+                    "SELECT caption_id FROM captions WHERE brand = ? AND post_key = ?", (brand, post_key)
+                ).fetchone()
+                if old is not None:
+                    conn.execute("DELETE FROM caption_bands WHERE caption_id = ?", (old["caption_id"],))
+                    conn.execute("DELETE FROM captions WHERE caption_id = ?", (old["caption_id"],))
+            cur = conn.execute(
+                "INSERT INTO captions (brand, post_key, caption, signature, meta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (brand, post_key, caption, _pack(sig), json.dumps(meta, ensure_ascii=False), time.time()),
+            )
+            caption_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO caption_bands (brand, band_key, caption_id) VALUES (?, ?, ?)",
+                [(brand, key, caption_id) for key in band_keys(sig)],
+            )
+        return caption_id
+
+    def count(self, brand: Optional[str] = None) -> int:
+        if brand is None:
+            return self.connect().execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+        return self.connect().execute("SELECT COUNT(*) FROM captions WHERE brand = ?", (brand,)).fetchone()[0]
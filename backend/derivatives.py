@@ -0,0 +1,145 @@
+"""
+Thumbnail e preview delle immagini caricate.
+
+Dopo ogni upload un pool di worker genera, fuori dal path della richiesta,
+le derivate del contenuto (vedi SPECS) sotto uploads/.derived/<kind>/. Le URL
+contengono versione e SHA-256 del contenuto, /media/<kind>/v<N>/<sha256>:
+lo stesso URL indica sempre gli stessi byte, quindi si servono con ETag forte
+e Cache-Control immutable. "original" serve il blob così com'è.
+
+Una derivata non ancora pronta viene generata al primo GET (stesso pool, e
+se è già in coda si aspetta quel job). Cambiare SPECS o l'encoding richiede
+di incrementare VERSION, così i client non riusano le vecchie copie.
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import images
+import metrics
+from storage import UPLOAD_DIR
+
+# -----------------------------
+# Knobs
+# -----------------------------
+VERSION = 1
+# kind -> (lato lungo, lato corto) massimi; preview = card Instagram 1080x1350
+SPECS = {
+    "thumb": (320, 320),
+    "preview": (1350, 1080),
+}
+ORIGINAL = "original"
+KINDS = (*SPECS, ORIGINAL)
+DERIVED_DIR = UPLOAD_DIR / ".derived"
+WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", "2"))
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+# jpg/png dal resize; gif/webp solo senza Pillow (file originale così com'è)
+_EXT_TO_MIME = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+_MIME_TO_EXT = {v: k for k, v in _EXT_TO_MIME.items()}
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value or ""))
+
+def media_url(digest: str, kind: str) -> str:
+    return f"/media/{kind}/v{VERSION}/{digest}"
+
+def media_urls(digest: str) -> Dict[str, str]:
+    """URL of every derivative (and of the original) of a content hash."""
+    return {kind: media_url(digest, kind) for kind in KINDS}
+
+def etag(digest: str, kind: str) -> str:
+    return f'"{digest[:32]}-{kind}-v{VERSION}"'
+
+def sniff_mime(path: Path) -> str:
+    """MIME type of an image from its magic bytes (blobs have no extension)."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+class DerivativeStore:
+    def __init__(self, root: Path = DERIVED_DIR, workers: int = WORKERS):
+        self.root = Path(root)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="derive")
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # Paths
+    # -----------------------------
+    def _base(self, digest: str, kind: str) -> Path:
+        return self.root / kind / digest[:2] / f"{digest}.v{VERSION}"
+
+    def path(self, digest: str, kind: str) -> Optional[Tuple[Path, str]]:
+        """(file, mime) of a ready derivative, None if not generated yet."""
+        base = self._base(digest, kind)
+        for ext, mime in _EXT_TO_MIME.items():
+            p = base.with_name(base.name + ext)
+            if p.is_file():
+                return p, mime
+        return None
+
+    def missing(self, digest: str) -> List[str]:
+        return [kind for kind in SPECS if self.path(digest, kind) is None]
+
+    # -----------------------------
+    # Generation
+    # -----------------------------
+    def schedule(self, source: str, digest: str) -> Optional[Future]:
+        """Queue generation of the missing derivatives of `source`; None if all are ready."""
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            if not self.missing(digest):
+                return None
+            future = self._executor.submit(self._generate, source, digest)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._done(digest))
+        return future
+
+    def _done(self, digest: str) -> None:
+        with self._lock:
+            self._pending.pop(digest, None)
+
+    def _generate(self, source: str, digest: str) -> None:
+        for kind in self.missing(digest):
+            start = time.perf_counter()
+            max_long, max_short = SPECS[kind]
+            data, mime = images.prepare_image(source, max_long, max_short)
+            self._write(digest, kind, data, mime)
+            metrics.DERIVATIVE_SECONDS.observe(time.perf_counter() - start, kind=kind)
+
+    def _write(self, digest: str, kind: str, data: bytes, mime: str) -> None:
+        base = self._base(digest, kind)
+        final = base.with_name(base.name + _MIME_TO_EXT.get(mime, ".jpg"))
+        final.parent.mkdir(parents=True, exist_ok=True)
+        # Stessa scrittura atomica della cache vision: più worker possono
+        # generare la stessa derivata, vince l'ultimo rename (byte identici)
+        tmp = final.with_name(f".{final.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, final)
+
+    def remove(self, digest: str) -> None:
+        """Drop every derivative of a content hash (its blob was collected)."""
+        for kind in SPECS:
+            found = self.path(digest, kind)
+            if found is not None:
+                found[0].unlink(missing_ok=True)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
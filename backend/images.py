@@ -0,0 +1,216 @@
+"""
+Image preparation for the vision model.
+
+Le foto originali (spesso 10+ MB da smartphone) vengono ridimensionate alla
+risoluzione massima che il modello usa davvero, ri-codificate senza metadati
+e messe in cache come data URL, con chiave hash del contenuto + dimensione target.
+
+Cache a due livelli:
+- memoria: LRU di data URL pronti
+- disco: file ri-codificati sotto uploads/.derived/vision/
+
+Pillow è opzionale: senza Pillow l'immagine viene inviata così com'è
+(ma resta comunque in cache per contenuto).
+"""
+
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import metrics
+from storage import UPLOAD_DIR
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow opzionale
+    Image = None
+    ImageOps = None
+
+# -----------------------------
+# Knobs
+# -----------------------------
+# Con detail "high" il modello riporta l'immagine dentro 2048x2048 e poi
+# porta il lato corto a 768px: oltre questi limiti i pixel vengono buttati.
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+MEMORY_CACHE_ITEMS = 64
+CACHE_DIR = UPLOAD_DIR / ".derived" / "vision"
+
+_HASH_CHUNK = 1024 * 1024
+
+# -----------------------------
+# Content hash
+# -----------------------------
+_digest_memo: Dict[Tuple[str, int, int, int], str] = {}
+_digest_lock = threading.Lock()
+
+def file_digest(path: str) -> str:
+    """SHA-256 of the file content, memoized on (path, inode, size, mtime)."""
+    st = os.stat(path)
+    # L'inode distingue alias ri-linkati a blob diversi (anche da altri worker)
+    key = (os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_memo.get(key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_memo[key] = digest
+    return digest
+
+def prime_digest(path: str, digest: str) -> None:
+    """Record a digest computed elsewhere (e.g. while streaming an upload)."""
+    st = os.stat(path)
+    with _digest_lock:
+        _digest_memo[(os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns)] = digest
+
+# -----------------------------
+# Resize / re-encode
+# -----------------------------
+_EXIF_ORIENTATION = 0x0112
+
+def image_size(image_path: str) -> Optional[Tuple[int, int]]:
+    """(width, height) as displayed (EXIF rotation applied); None without Pillow or if unreadable."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(image_path) as img:  # legge solo l'header
+            width, height = img.size
+            if img.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+    except (OSError, ValueError):
+        return None
+
+def target_size(width: int, height: int, max_long: int = MAX_LONG_SIDE, max_short: int = MAX_SHORT_SIDE) -> Tuple[int, int]:
+    """Largest size (never upscaled) that fits both model limits."""
+    scale = min(1.0, max_long / max(width, height), max_short / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def prepare_image(
+    image_path: str,
+    max_long: int = MAX_LONG_SIDE,
+    max_short: int = MAX_SHORT_SIDE,
+) -> Tuple[bytes, str]:
+    """Return (bytes, mime) of the image as it should be sent to the model."""
+    if Image is None:
+        mime, _ = mimetypes.guess_type(image_path)
+        with open(image_path, "rb") as f:
+            return f.read(), mime or "image/jpeg"
+
+    with Image.open(image_path) as img:
+        # Per i JPEG decodifica direttamente a risoluzione ridotta
+        img.draft("RGB", target_size(img.width, img.height, max_long, max_short))
+        img = ImageOps.exif_transpose(img)
+        size = target_size(img.width, img.height, max_long, max_short)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+
+        # Salvando senza exif/icc/info i metadati vengono scartati
+        buf = io.BytesIO()
+        if has_alpha:
+            img.save(buf, format="PNG", optimize=True)
+            return buf.getvalue(), "image/png"
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buf.getvalue(), "image/jpeg"
+
+# -----------------------------
+# Data URL cache
+# -----------------------------
+_EXT_TO_MIME = {".jpg": "image/jpeg", ".png": "image/png"}
+_MIME_TO_EXT = {v: k for k, v in _EXT_TO_MIME.items()}
+
+class DataUrlCache:
+    """LRU in memoria + file ri-codificati su disco."""
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_items: int = MEMORY_CACHE_ITEMS):
+        self.cache_dir = Path(cache_dir)
+        self.max_items = max_items
+        self._mem: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            url = self._mem.get(key)
+            if url is not None:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+            return url
+
+    def _mem_put(self, key: str, url: str) -> None:
+        with self._lock:
+            self._mem[key] = url
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        for ext, mime in _EXT_TO_MIME.items():
+            p = self.cache_dir / f"{key}{ext}"
+            try:
+                return p.read_bytes(), mime
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _disk_put(self, key: str, data: bytes, mime: str) -> None:
+        ext = _MIME_TO_EXT.get(mime)
+        if ext is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        final = self.cache_dir / f"{key}{ext}"
+        tmp = final.with_name(f".{final.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, final)
+
+    def get(self, image_path: str, max_long: int = MAX_LONG_SIDE, max_short: int = MAX_SHORT_SIDE) -> str:
+        start = time.perf_counter()
+        key = f"{file_digest(image_path)}-{max_long}x{max_short}"
+        url = self._mem_get(key)
+        if url is not None:
+            _observe_image("memory", start, url)
+            return url
+
+        hit = self._disk_get(key)
+        if hit is not None:
+            data, mime = hit
+            source = "disk"
+            with self._lock:
+                self.stats["disk_hits"] += 1
+        else:
+            data, mime = prepare_image(image_path, max_long, max_short)
+            source = "encoded"
+            if Image is not None:
+                self._disk_put(key, data, mime)
+            with self._lock:
+                self.stats["misses"] += 1
+
+        url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        self._mem_put(key, url)
+        _observe_image(source, start, url)
+        return url
+
+def _observe_image(source: str, start: float, url: str) -> None:
+    metrics.IMAGE_PREPARE_SECONDS.observe(time.perf_counter() - start, source=source)
+    metrics.IMAGE_BYTES.observe(len(url), source=source)
+
+data_url_cache = DataUrlCache()
+
+def image_data_url(image_path: str) -> str:
+    """Downscaled, metadata-free data URL for the vision model (cached)."""
+    return data_url_cache.get(image_path)
@@ -0,0 +1,287 @@
+"""
+Persistent job queue for long-running generations.
+
+POST /jobs salva la richiesta in SQLite e ritorna subito; un pool di worker
+thread prende i job in coda, esegue la generazione e aggiorna stato e
+avanzamento per slot. I job sopravvivono a un riavvio: quelli rimasti
+"running" senza heartbeat recente tornano in coda (gli slot già pagati
+vengono poi ripresi dalla cache delle risposte).
+
+Ogni claim è un lease (worker + numero di tentativo): mentre il job gira un
+thread rinnova l'heartbeat, e progress/finish scrivono solo se il lease è
+ancora loro, così un worker lento non sovrascrive chi ha ripreso il job.
+Dopo MAX_ATTEMPTS tentativi orfani il job viene chiuso come failed.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "jobs.sqlite3"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # per processo
+LEASE_SECONDS = 300  # un job "running" senza heartbeat da così tanto è considerato orfano
+HEARTBEAT_SECONDS = LEASE_SECONDS / 5
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = 2.0
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class JobStore(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        request TEXT NOT NULL,
+        progress TEXT NOT NULL DEFAULT '{}',
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        heartbeat_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at);
+    """
+    # Colonne aggiunte dopo la prima versione (ALTER su db esistenti)
+    COLUMNS = {"worker": "TEXT"}
+    # Il lease è di chi l'ha preso, per il tentativo in corso
+    OWNED = "job_id = ? AND status = 'running' AND worker = ? AND attempts = ?"
+
+    def __init__(self, path: Path = DEFAULT_PATH):
+        super().__init__(path)
+        conn = self.connect()
+        with conn:
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in self.COLUMNS.items():
+                if name not in existing:
+                    try:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                    except sqlite3.OperationalError:
+                        pass  # aggiunta nel frattempo da un altro worker
+
+    def create(self, request: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, request, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request, ensure_ascii=False), now, now),
+            )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest queued (or orphaned) job to running, leased to `worker`.
+
+        Gli orfani che hanno già esaurito MAX_ATTEMPTS vengono chiusi come failed.
+        """
+        conn = self.connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?"
+                " WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, f"interrotto dopo {MAX_ATTEMPTS} tentativi", now, RUNNING, now - LEASE_SECONDS, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT job_id, request, attempts FROM jobs"
+                " WHERE status = ? OR (status = ? AND heartbeat_at < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now - LEASE_SECONDS),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, heartbeat_at = ?, updated_at = ?"
+                " WHERE job_id = ?",
+                (RUNNING, worker, now, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {
+            "job_id": row["job_id"],
+            "request": json.loads(row["request"]),
+            "worker": worker,
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, job_id: str, worker: str, attempts: int) -> bool:
+        """Renew the lease; False if the job is no longer ours."""
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            cur = conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE {self.OWNED}", (now, job_id, worker, attempts)
+            )
+        return cur.rowcount > 0
+
+    def update_progress(self, job_id: str, worker: str, attempts: int, progress: Dict[str, Any]) -> bool:
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            cur = conn.execute(
+                f"UPDATE jobs SET progress = ?, heartbeat_at = ?, updated_at = ? WHERE {self.OWNED}",
+                (json.dumps(progress, ensure_ascii=False), now, now, job_id, worker, attempts),
+            )
+        return cur.rowcount > 0
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        attempts: int,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Close the job if the lease is still ours; False if another attempt took it over."""
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            cur = conn.execute(
+                f"UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE {self.OWNED}",
+                (
+                    FAILED if error is not None else DONE,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    now,
+                    job_id,
+                    worker,
+                    attempts,
+                ),
+            )
+        return cur.rowcount > 0
+
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        row = self.connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _row_to_job(row, include_result) if row is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM jobs"
+        args: list = []
+        if status:
+            sql += " WHERE status = ?"
+            args.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        return [_row_to_job(r, include_result=False) for r in self.connect().execute(sql, args)]
+
+def _row_to_job(row, include_result: bool) -> Dict[str, Any]:
+    job = {
+        "job_id": row["job_id"],
+        "status": row["status"],
+        "progress": json.loads(row["progress"]),
+        "error": row["error"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if include_result:
+        job["result"] = json.loads(row["result"]) if row["result"] else None
+    return job
+
+class JobProgress:
+    """Per-slot progress of a running job, persisted on every update (while the lease is ours)."""
+
+    def __init__(self, store: JobStore, job: Dict[str, Any], total: int):
+        self.store = store
+        self.job_id = job["job_id"]
+        self.lease = (job["worker"], job["attempts"])
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {"week_brief": False, "total": total, "completed": []}
+        self._save()
+
+    def _save(self) -> None:
+        self.store.update_progress(self.job_id, *self.lease, self.state)
+
+    def brief_ready(self, week_brief: Dict[str, Any], week_brief_id: Optional[str]) -> None:
+        with self._lock:
+            self.state["week_brief"] = True
+            self.state["week_brief_id"] = week_brief_id
+            self._save()
+
+    def post_ready(self, slot_index: int, post: Dict[str, Any], image_path: Optional[str] = None) -> None:
+        with self._lock:
+            self.state["completed"] = sorted(self.state["completed"] + [slot_index])
+            self._save()
+
+class JobRunner:
+    """Pool of worker threads executing queued jobs with `execute(request, progress)`."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        execute: Callable[[Dict[str, Any], JobProgress], Dict[str, Any]],
+        total_slots: Callable[[Dict[str, Any]], int],
+        workers: int = JOB_WORKERS,
+    ):
+        self.store = store
+        self.execute = execute
+        self.total_slots = total_slots
+        self.workers = workers
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def submit(self, request: Dict[str, Any]) -> str:
+        job_id = self.store.create(request)
+        self._wake.set()
+        return job_id
+
+    def _loop(self) -> None:
+        worker = f"{os.getpid()}:{uuid.uuid4().hex[:8]}:{threading.current_thread().name}"
+        while not self._stop.is_set():
+            job = self.store.claim(worker)
+            if job is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id, lease = job["job_id"], (job["worker"], job["attempts"])
+        done = threading.Event()
+        beat = threading.Thread(
+            target=self._heartbeat, args=(job_id, lease, done), name=f"job-heartbeat-{job_id[:8]}", daemon=True
+        )
+        beat.start()
+        try:
+            progress = JobProgress(self.store, job, self.total_slots(job["request"]))
+            result = self.execute(job["request"], progress)
+        except Exception as e:
+            traceback.print_exc()
+            outcome = {"error": f"{type(e).__name__}: {e}"}
+        else:
+            outcome = {"result": result}
+        finally:
+            done.set()
+            beat.join()
+        if not self.store.finish(job_id, *lease, **outcome):
+            print(f"Job {job_id}: lease perso (tentativo {lease[1]}), risultato scartato")
+
+    def _heartbeat(self, job_id: str, lease: tuple, done: threading.Event) -> None:
+        """Renew the lease every HEARTBEAT_SECONDS until the job ends (or someone else owns it)."""
+        while not done.wait(HEARTBEAT_SECONDS):
+            if not self.store.heartbeat(job_id, *lease):
+                return
@@ -1,24 +1,58 @@
 """
 Instagram Copywriter API
+
+Multi-processo: `WEB_CONCURRENCY=8 python main.py` (o `uvicorn main:app
+--workers 8` con WEB_CONCURRENCY=8 nell'ambiente, così i rate limiter si
+dividono i limiti dell'account). Lo stato condiviso tra i worker sta in
+SQLite WAL sotto COPYWRITER_DATA_DIR (cache risposte, brief, job, indice
+upload) e nei file sotto COPYWRITER_UPLOAD_DIR; per processo restano solo
+client HTTP, rate limiter, cache in memoria delle immagini e metriche.
 """
 
 import os
+import json
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-import shutil
 
 import copywriter
+import derivatives
+import metrics
+import providers
+from jobs import JOB_WORKERS, JobProgress, JobRunner, JobStore
+from storage import DATA_DIR, UPLOAD_DIR
+from upload_store import UploadStore
 
 # =============================================================================
 # API KEY 
 # =============================================================================
-OPENAI_API_KEY = "sk-proj-YOUR_API_KEY_HERE"
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "sk-proj-YOUR_API_KEY_HERE")
 # =============================================================================
 
+# Campagne in generazione contemporaneamente (ognuna usa a sua volta fino a
+# copywriter.MAX_CONCURRENT_POSTS chiamate in parallelo), per processo
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", "32"))
+
+# Chiamate (brief e post insieme) in volo o in coda per un /calendar: il
+# calendario occupa un solo worker di generazione e al più tanti posti nella
+# coda FIFO del rate limiter, quindi una /generate arrivata dopo aspetta
+# quelle chiamate, non tutte le settimane del calendario
+CALENDAR_CONCURRENCY = int(os.environ.get("CALENDAR_CONCURRENCY", copywriter.MAX_CONCURRENT_CALENDAR))
+
+# Executor dedicato: le chiamate OpenAI bloccanti non occupano l'event loop
+# né il threadpool condiviso di Starlette usato dagli altri endpoint
+generation_executor = ThreadPoolExecutor(
+    max_workers=GENERATION_WORKERS, thread_name_prefix="generate"
+)
+
 app = FastAPI(
     title="Instagram Copywriter API",
     description="API per la generazione automatica di contenuti Instagram",
@@ -33,17 +67,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = Path("./uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+def _inferred_template(filename: str) -> str:
+    try:
+        prefix = copywriter._infer_prefix(filename)
+        return copywriter.PREFIX_TO_TEMPLATE.get(prefix, "unknown")
+    except:
+        return "unknown"
+
+
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Thumbnail/preview generate in background dopo l'upload, rimosse con il blob
+derivative_store = derivatives.DerivativeStore()
+
+
+def _schedule_derivatives(digest: str) -> None:
+    derivative_store.schedule(str(upload_store.blob_path(digest)), digest)
+
+
+upload_store = UploadStore(
+    UPLOAD_DIR,
+    on_collect=derivative_store.remove,
+    template_of=_inferred_template,
+    on_index=_schedule_derivatives,
+)
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 @app.on_event("startup")
 async def startup_event():
     if OPENAI_API_KEY == "sk-proj-YOUR_API_KEY_HERE":
-        print("ATTENZIONE: Inserire la API key OpenAI in main.py")
-    else:
-        copywriter.init_client(OPENAI_API_KEY)
-        print("Client OpenAI inizializzato")
+        print("ATTENZIONE: Impostare OPENAI_API_KEY (ambiente o main.py)")
+    # OpenAI (se c'è la key) + endpoint compatibile da COMPAT_BASE_URL
+    configured = providers.init_providers(
+        OPENAI_API_KEY if OPENAI_API_KEY != "sk-proj-YOUR_API_KEY_HERE" else None
+    )
+    if configured:
+        print(f"Provider inizializzati: {configured} (default: {providers.default_name()})")
+    copywriter.init_response_cache()
+    copywriter.init_brief_store()
+    copywriter.init_caption_archive()
+    copywriter.init_campaign_archive()
+    copywriter.init_brand_store()
+    # File copiati a mano in uploads/ (es. create_test_images.py) entrano nel catalogo
+    await asyncio.to_thread(upload_store.reindex)
+    copywriter.init_upload_catalog(upload_store.catalog)
+    if configured:
+        job_runner.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_runner.stop()
+    generation_executor.shutdown(wait=False, cancel_futures=True)
+    derivative_store.shutdown()
+    providers.close_all()
+
+
+def _tracked(func, *args, **kwargs):
+    """Chiama func aggiornando le metriche di generazione (in corso, durata, esito)."""
+    operation = func.__name__
+    start = time.perf_counter()
+    outcome = "error"
+    with metrics.GENERATIONS_IN_FLIGHT.track(operation=operation):
+        try:
+            result = func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            metrics.GENERATION_SECONDS.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+
+
+async def run_generation(func, *args, **kwargs):
+    """Esegue una funzione sincrona di copywriter sull'executor di generazione."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(generation_executor, partial(_tracked, func, *args, **kwargs))
 
 
 # -----------------------------
@@ -61,13 +157,52 @@ class GenerateRequest(BaseModel):
     availability_policy: str = "no_availability"
     strict_routing: bool = False
     
-    # Brand params (configurabili dall'utente)
+    # Brand: profilo salvato (PUT /brands/{brand_id}) oppure i parametri inline
+    brand_id: Optional[str] = None
+
+    # Brand params (configurabili dall'utente; obbligatori senza brand_id)
+    brand_name: Optional[str] = None
+    brand_description: Optional[str] = None
+    brand_tagline: str = ""
+    brand_history: str = ""
+    required_hashtags: Optional[List[str]] = None
+    base_hashtags: List[str] = []
+
+    # Provider e modello (default: provider di default e il suo modello / copywriter.MODEL)
+    provider: Optional[str] = None
+    model: Optional[str] = None
+
+    # Forza output nuovo ignorando la cache delle risposte
+    bypass_cache: bool = False
+
+    # Brief settimanale già pronto (inline o per id): nessuna chiamata per il brief
+    week_brief: Optional[Dict[str, Any]] = None
+    week_brief_id: Optional[str] = None
+
+
+class CalendarRequest(GenerateRequest):
+    # Intervallo di date (ISO, estremi inclusi); n_posts = post per settimana piena.
+    # week_brief/week_brief_id non si usano: ogni settimana ha il suo brief
+    start_date: str
+    end_date: str
+
+
+class BrandProfileRequest(BaseModel):
     brand_name: str
-    brand_description: str
+    brand_description: str = ""
     brand_tagline: str = ""
     brand_history: str = ""
-    required_hashtags: List[str]
+    required_hashtags: List[str] = ["#handmade"]
     base_hashtags: List[str] = []
+    custom_banned_phrases: Optional[List[str]] = None
+
+
+class RegenerateSlotRequest(GenerateRequest):
+    # Stessi campi della richiesta originale (servono a ricostruire il piano)
+    # + lo slot da rigenerare. Serve week_brief o week_brief_id.
+    slot_index: int
+    image: Optional[str] = None  # nuova immagine per lo slot (es. /uploads/xxx.jpg)
+    angle: Optional[str] = None  # nuovo angolo descrittivo
 
 
 # -----------------------------
@@ -78,115 +213,478 @@ async def root():
     return {
         "message": "Instagram Copywriter API",
         "version": "1.0.0",
-        "status": "ready" if OPENAI_API_KEY != "sk-proj-YOUR_API_KEY_HERE" else "api_key_missing"
+        "status": "ready" if providers.available() else "api_key_missing"
+    }
+
+
+def _upload_entry(row: dict) -> dict:
+    return {
+        "filename": row["filename"],
+        "path": f"/uploads/{row['filename']}",
+        "full_path": str((UPLOAD_DIR / row["filename"]).absolute()),
+        "inferred_template": row["template_id"],
+        "prefix": row["prefix"],
+        "brand": row["brand"],
+        "sha256": row["sha256"],
+        "size": row["size"],
+        "width": row["width"],
+        "height": row["height"],
+        "uploaded_at": row["uploaded_at"],
+        "derivatives": derivatives.media_urls(row["sha256"]),
     }
 
 
+async def _store_upload(file: UploadFile, brand: Optional[str] = None) -> dict:
+    try:
+        stored = await upload_store.save(file.filename, file.read, brand=brand)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    dedup = "true" if stored["deduplicated"] else "false"
+    metrics.UPLOADS.inc(deduplicated=dedup)
+    metrics.UPLOAD_BYTES.inc(stored["size"], deduplicated=dedup)
+    _schedule_derivatives(stored["sha256"])
+    return {**_upload_entry(stored), "deduplicated": stored["deduplicated"]}
+
+
 @app.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(file: UploadFile = File(...), brand: Optional[str] = Form(None)):
     """Upload singola immagine."""
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Il file deve essere un'immagine")
     
-    file_path = UPLOAD_DIR / file.filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    try:
-        prefix = copywriter._infer_prefix(str(file_path))
-        template = copywriter.PREFIX_TO_TEMPLATE.get(prefix, "unknown")
-    except:
-        template = "unknown"
-    
-    return {
-        "filename": file.filename,
-        "path": f"/uploads/{file.filename}",
-        "full_path": str(file_path.absolute()),
-        "inferred_template": template
-    }
+    return await _store_upload(file, brand)
 
 
 @app.post("/upload-multiple")
-async def upload_multiple_images(files: List[UploadFile] = File(...)):
+async def upload_multiple_images(files: List[UploadFile] = File(...), brand: Optional[str] = Form(None)):
     """Upload multiple immagini."""
     results = []
     for file in files:
         if not file.content_type.startswith("image/"):
             continue
         
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        try:
-            prefix = copywriter._infer_prefix(str(file_path))
-            template = copywriter.PREFIX_TO_TEMPLATE.get(prefix, "unknown")
-        except:
-            template = "unknown"
-        
-        results.append({
-            "filename": file.filename,
-            "path": f"/uploads/{file.filename}",
-            "full_path": str(file_path.absolute()),
-            "inferred_template": template
-        })
+        results.append(await _store_upload(file, brand))
     
     return {"uploaded": results}
 
 
+def _http_error(e: Exception) -> HTTPException:
+    """HTTP error for an exception raised while generating."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, FileNotFoundError):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=400, detail=str(e))
+    if isinstance(e, providers.ProviderError):
+        # Rate limit ancora superato dopo tutti i tentativi => 503, altri errori del provider => 502
+        return HTTPException(status_code=503 if e.status_code == 429 else 502, detail=f"Errore provider: {str(e)}")
+    return HTTPException(status_code=500, detail=f"Errore generazione: {str(e)}")
+
+
+def _check_api_key():
+    if not providers.available():
+        raise HTTPException(
+            status_code=500, 
+            detail="Nessun provider configurato. Impostare OPENAI_API_KEY o COMPAT_BASE_URL"
+        )
+
+
+def _resolve_image_paths(images: List[str]) -> List[str]:
+    # Converti path relativi in assoluti
+    image_paths = []
+    for img in images:
+        if img.startswith("/uploads/"):
+            image_paths.append(str(UPLOAD_DIR / Path(img).name))
+        else:
+            image_paths.append(img)
+    return image_paths
+
+
+def _brand_kwargs(request: GenerateRequest) -> dict:
+    """Brand params di copywriter: il profilo compilato (brand_id) o i campi inline."""
+    if request.brand_id:
+        profile = copywriter.brand_store.profile(request.brand_id) if copywriter.brand_store else None
+        if profile is None:
+            raise HTTPException(status_code=404, detail="Brand non trovato")
+        return {"brand_profile": profile}
+    if not request.brand_name or request.brand_description is None or request.required_hashtags is None:
+        raise HTTPException(
+            status_code=400, detail="Serve brand_id oppure brand_name, brand_description e required_hashtags"
+        )
+    return dict(
+        brand_name=request.brand_name,
+        brand_description=request.brand_description,
+        brand_tagline=request.brand_tagline,
+        brand_history=request.brand_history,
+        required_hashtags=request.required_hashtags,
+        base_hashtags=request.base_hashtags,
+    )
+
+
+def _campaign_kwargs(request: GenerateRequest) -> dict:
+    """Parametri di campagna, brand e modello comuni a generate_posts e generate_calendar."""
+    image_paths = _resolve_image_paths(request.images)
+
+    try:
+        llm = providers.get(request.provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return dict(
+        # Campaign params
+        goal=request.goal,
+        theme=request.theme,
+        images=image_paths,
+        n_posts=request.n_posts,
+        cta_mode=request.cta_mode,
+        voice=request.voice,
+        featured_category=request.featured_category,
+        availability_policy=request.availability_policy,
+        strict_routing=request.strict_routing,
+        # Brand params
+        **_brand_kwargs(request),
+        # Model
+        provider=llm.name,
+        model=request.model or llm.default_model or copywriter.MODEL,
+        use_cache=not request.bypass_cache,
+    )
+
+
+def _generation_kwargs(request: GenerateRequest) -> dict:
+    """Parametri di copywriter.generate_posts per una GenerateRequest."""
+    week_brief = request.week_brief
+    if week_brief is None and request.week_brief_id:
+        week_brief = _load_week_brief(request.week_brief_id)["week_brief"]
+    return {**_campaign_kwargs(request), "week_brief": week_brief}
+
+
+def _image_urls_by_path(request: GenerateRequest) -> dict:
+    """Path passato a copywriter -> URL/path originale della richiesta."""
+    kwargs_images = _resolve_image_paths(request.images)
+    return dict(zip(kwargs_images, request.images))
+
+
+def _attach_image_urls(result: dict, request: GenerateRequest) -> dict:
+    # Aggiungi URL immagini per il frontend: ogni post riceve l'immagine
+    # effettivamente scelta per il suo slot (routing per prefisso)
+    urls = _image_urls_by_path(request)
+    for post, path in zip(result["posts"], result["chosen_images"]):
+        post["image_url"] = urls.get(path, path)
+    return result
+
+
 @app.post("/generate")
 async def generate_posts(request: GenerateRequest):
     """Genera i post Instagram."""
     
-    if OPENAI_API_KEY == "sk-proj-YOUR_API_KEY_HERE":
-        raise HTTPException(
-            status_code=500, 
-            detail="API key OpenAI non configurata. Modificare OPENAI_API_KEY in main.py"
-        )
+    _check_api_key()
     
     try:
-        # Converti path relativi in assoluti
-        image_paths = []
-        for img in request.images:
-            if img.startswith("/uploads/"):
-                image_paths.append(str(UPLOAD_DIR / Path(img).name))
-            else:
-                image_paths.append(img)
+        # Profilo brand e brief salvato si leggono da SQLite: fuori dall'event loop
+        kwargs = await asyncio.to_thread(_generation_kwargs, request)
+        result = await run_generation(copywriter.generate_posts, **kwargs)
+        return _attach_image_urls(result, request)
         
-        # Chiama generate_posts con tutti i parametri
-        result = copywriter.generate_posts(
-            # Campaign params
-            goal=request.goal,
-            theme=request.theme,
-            images=image_paths,
-            n_posts=request.n_posts,
-            cta_mode=request.cta_mode,
-            voice=request.voice,
-            featured_category=request.featured_category,
-            availability_policy=request.availability_policy,
-            strict_routing=request.strict_routing,
-            # Brand params
-            brand_name=request.brand_name,
-            brand_description=request.brand_description,
-            brand_tagline=request.brand_tagline,
-            brand_history=request.brand_history,
-            required_hashtags=request.required_hashtags,
-            base_hashtags=request.base_hashtags,
+    except Exception as e:
+        raise _http_error(e)
+
+
+@app.post("/calendar")
+async def generate_calendar(request: CalendarRequest):
+    """Genera un calendario di più settimane: immagini mai riusate, brief in parallelo."""
+    
+    _check_api_key()
+    
+    try:
+        kwargs = await asyncio.to_thread(_campaign_kwargs, request)
+        result = await run_generation(
+            copywriter.generate_calendar,
+            start_date=request.start_date,
+            end_date=request.end_date,
+            max_concurrency=CALENDAR_CONCURRENCY,
+            **kwargs,
         )
-        
-        # Aggiungi URL immagini per il frontend
-        for i, post in enumerate(result["posts"]):
-            if i < len(request.images):
-                post["image_url"] = request.images[i]
-        
+        urls = _image_urls_by_path(request)
+        for week in result["weeks"]:
+            for post, path in zip(week["posts"], week["chosen_images"]):
+                post["image_url"] = urls.get(path, path)
         return result
         
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise _http_error(e)
+
+
+@app.post("/regenerate-slot")
+async def regenerate_slot(request: RegenerateSlotRequest):
+    """Rigenera un solo post di una settimana già generata (stesso brief, stesso piano)."""
+    
+    _check_api_key()
+    if request.week_brief is None and not request.week_brief_id:
+        raise HTTPException(status_code=400, detail="Serve week_brief o week_brief_id")
+    
+    try:
+        # Stessi parametri (brand compreso, risolto una volta sola) di /generate,
+        # meno quelli che servono solo al brief; use_cache resta quello di regenerate_post
+        kwargs = await asyncio.to_thread(_generation_kwargs, request)
+        for key in ("goal", "cta_mode", "voice", "featured_category", "use_cache"):
+            kwargs.pop(key)
+        image_path = _resolve_image_paths([request.image])[0] if request.image else None
+        slot = await run_generation(
+            copywriter.regenerate_post,
+            slot_index=request.slot_index,
+            image_path=image_path,
+            angle=request.angle,
+            **kwargs,
+        )
+        urls = _image_urls_by_path(request)
+        if request.image:
+            urls[image_path] = request.image
+        slot["post"]["image_url"] = urls.get(slot["image_path"], slot["image_path"])
+        return slot
+        
+    except Exception as e:
+        raise _http_error(e)
+
+
+@app.post("/generate/stream")
+async def generate_posts_stream(request: GenerateRequest):
+    """Come /generate, ma in NDJSON: week brief, poi ogni post appena validato, poi un riepilogo."""
+    
+    _check_api_key()
+    kwargs = await asyncio.to_thread(_generation_kwargs, request)
+    urls = _image_urls_by_path(request)
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    # I callback girano nei thread di generazione: passano gli eventi al loop
+    def emit(event: dict):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def on_brief(week_brief, week_brief_id):
+        emit({"event": "week_brief", "week_brief": week_brief, "week_brief_id": week_brief_id})
+
+    def on_post(slot_index, post, image_path):
+        emit({"event": "post", "slot_index": slot_index, "post": {**post, "image_url": urls.get(image_path, image_path)}})
+
+    future = loop.run_in_executor(
+        generation_executor,
+        partial(_tracked, copywriter.generate_posts, **kwargs, on_brief=on_brief, on_post=on_post),
+    )
+    future.add_done_callback(lambda _: events.put_nowait(finished))
+
+    async def stream():
+        while True:
+            event = await events.get()
+            if event is finished:
+                break
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+        try:
+            result = future.result()
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": f"Errore generazione: {str(e)}"}, ensure_ascii=False) + "\n"
+            return
+        summary = {
+            "event": "done",
+            "week_brief_id": result["week_brief_id"],
+            "schedule": result["schedule"],
+            "chosen_images": result["chosen_images"],
+            "n_posts": len(result["posts"]),
+            "usage": result["usage"]["totals"],
+        }
+        yield json.dumps(summary, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# -----------------------------
+# Jobs (generazione asincrona)
+# -----------------------------
+def _execute_job(payload: dict, progress: JobProgress) -> dict:
+    request = GenerateRequest(**payload)
+    result = _tracked(
+        copywriter.generate_posts,
+        **_generation_kwargs(request),
+        on_brief=progress.brief_ready,
+        on_post=progress.post_ready,
+    )
+    return _attach_image_urls(result, request)
+
+
+job_runner = JobRunner(
+    JobStore(DATA_DIR / "jobs.sqlite3"),
+    execute=_execute_job,
+    total_slots=lambda payload: payload.get("n_posts", 6),
+    workers=JOB_WORKERS,
+)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: GenerateRequest):
+    """Mette in coda una generazione; lo stato si legge da GET /jobs/{job_id}."""
+    _check_api_key()
+    await asyncio.to_thread(_brand_kwargs, request)  # brand sconosciuto => 404 subito, non a job fallito
+    job_id = await asyncio.to_thread(job_runner.submit, request.model_dump())
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Stato, avanzamento per slot e risultato di un job."""
+    job = await asyncio.to_thread(job_runner.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """Ultimi job (senza risultato), opzionalmente filtrati per stato."""
+    return {"jobs": await asyncio.to_thread(job_runner.store.list, status, min(limit, 500))}
+
+
+def _load_week_brief(week_brief_id: str) -> dict:
+    found = copywriter.brief_store.get(week_brief_id) if copywriter.brief_store else None
+    if found is None:
+        raise HTTPException(status_code=404, detail="Week brief non trovato")
+    return found
+
+
+@app.get("/briefs/{week_brief_id}")
+async def get_week_brief(week_brief_id: str):
+    """Recupera un week brief salvato."""
+    return _load_week_brief(week_brief_id)
+
+
+@app.put("/briefs/{week_brief_id}/pin")
+async def pin_week_brief(week_brief_id: str):
+    """Blocca il brief: viene riusato per gli stessi input e non scade."""
+    if not copywriter.brief_store or not copywriter.brief_store.pin(week_brief_id, True):
+        raise HTTPException(status_code=404, detail="Week brief non trovato")
+    return {"week_brief_id": week_brief_id, "pinned": True}
+
+
+@app.delete("/briefs/{week_brief_id}/pin")
+async def unpin_week_brief(week_brief_id: str):
+    """Sblocca il brief."""
+    if not copywriter.brief_store or not copywriter.brief_store.pin(week_brief_id, False):
+        raise HTTPException(status_code=404, detail="Week brief non trovato")
+    return {"week_brief_id": week_brief_id, "pinned": False}
+
+
+@app.delete("/briefs/{week_brief_id}")
+async def invalidate_week_brief(week_brief_id: str):
+    """Invalida il brief: il prossimo /generate con gli stessi input lo rigenera."""
+    if not copywriter.brief_store or not copywriter.brief_store.invalidate(week_brief_id):
+        raise HTTPException(status_code=404, detail="Week brief non trovato")
+    return {"deleted": week_brief_id}
+
+
+# -----------------------------
+# Brand profiles
+# -----------------------------
+def _brand_store():
+    if copywriter.brand_store is None:
+        raise HTTPException(status_code=404, detail="Profili brand non attivi")
+    return copywriter.brand_store
+
+
+@app.put("/brands/{brand_id}")
+async def put_brand(brand_id: str, profile: BrandProfileRequest):
+    """Crea o sostituisce il profilo di un brand (usato da /generate con brand_id)."""
+    try:
+        return await asyncio.to_thread(_brand_store().put, brand_id, profile.model_dump())
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore generazione: {str(e)}")
+
+
+@app.get("/brands/{brand_id}")
+async def get_brand(brand_id: str):
+    """Profilo di un brand."""
+    found = await asyncio.to_thread(_brand_store().get, brand_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Brand non trovato")
+    return found
+
+
+@app.get("/brands")
+async def list_brands(limit: int = 100, cursor: Optional[str] = None):
+    """Profili brand in ordine di brand_id, a pagine (next_cursor)."""
+    limit = max(1, min(limit, 1000))
+    rows = await asyncio.to_thread(_brand_store().list, limit=limit + 1, cursor=cursor)
+    page = rows[:limit]
+    next_cursor = page[-1]["brand_id"] if len(rows) > limit else None
+    return {"brands": page, "next_cursor": next_cursor}
+
+
+@app.delete("/brands/{brand_id}")
+async def delete_brand(brand_id: str):
+    """Elimina il profilo di un brand."""
+    if not await asyncio.to_thread(_brand_store().delete, brand_id):
+        raise HTTPException(status_code=404, detail="Brand non trovato")
+    return {"deleted": brand_id}
+
+
+@app.get("/archive/search")
+async def search_archive(
+    q: str = "",
+    # Profili salvati: brand_id; generazioni con parametri inline: brand (il nome)
+    brand_id: Optional[str] = None,
+    brand: Optional[str] = None,
+    template_id: Optional[str] = None,
+    post_role: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """Ricerca full-text nei post archiviati (caption, titolo, alt text, keyword, hashtag)."""
+    if copywriter.campaign_archive is None:
+        raise HTTPException(status_code=404, detail="Archivio non attivo")
+    try:
+        results = await asyncio.to_thread(
+            copywriter.campaign_archive.search,
+            q=q,
+            brand=brand_id or brand,
+            template_id=template_id,
+            post_role=post_role,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit,
+            offset=max(0, offset),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results, "count": len(results)}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss della cache delle risposte."""
+    if copywriter.response_cache is None:
+        return {"enabled": False}
+    stats = await asyncio.to_thread(copywriter.response_cache.snapshot)
+    return {"enabled": True, **stats}
+
+
+@app.get("/repair/stats")
+async def repair_stats():
+    """Fallimenti di validazione corretti localmente vs retry pagati al modello."""
+    return copywriter.repair_stats()
+
+
+@app.get("/providers")
+async def list_providers():
+    """Provider LLM configurati e quello di default."""
+    return {"providers": providers.snapshot(), "default": providers.default_name()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Metriche in formato Prometheus (latenze, token, retry, immagini, upload)."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/schedule-preview")
@@ -216,35 +714,83 @@ async def preview_schedule(n_posts: int = 6):
 
 
 @app.get("/uploads")
-async def list_uploads():
-    """Lista file caricati."""
-    files = []
-    for f in UPLOAD_DIR.iterdir():
-        if f.is_file() and f.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-            try:
-                prefix = copywriter._infer_prefix(str(f))
-                template = copywriter.PREFIX_TO_TEMPLATE.get(prefix, "unknown")
-            except:
-                template = "unknown"
-            
-            files.append({
-                "filename": f.name,
-                "path": f"/uploads/{f.name}",
-                "inferred_template": template
-            })
-    return {"files": files}
+async def list_uploads(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    template_id: Optional[str] = None,
+    prefix: Optional[str] = None,
+    brand: Optional[str] = None,
+):
+    """Lista file caricati dal catalogo, a pagine (next_cursor) e con filtri."""
+    limit = max(1, min(limit, 1000))
+    rows = await asyncio.to_thread(
+        upload_store.list,
+        limit=limit + 1,
+        cursor=cursor,
+        template_id=template_id,
+        prefix=prefix.lower() if prefix else None,
+        brand=brand,
+    )
+    page = rows[:limit]
+    next_cursor = page[-1]["filename"] if len(rows) > limit else None
+    return {"files": [_upload_entry(row) for row in page], "next_cursor": next_cursor}
+
+
+def _etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates or f"W/{tag}" in candidates
+
+
+@app.get("/media/{kind}/{version}/{digest}")
+async def get_media(kind: str, version: str, digest: str, request: Request):
+    """Thumbnail, preview o originale per hash del contenuto (cache immutabile)."""
+    if kind not in derivatives.KINDS or version != f"v{derivatives.VERSION}" or not derivatives.is_digest(digest):
+        raise HTTPException(status_code=404, detail="File non trovato")
+    tag = derivatives.etag(digest, kind)
+    headers = {"ETag": tag, "Cache-Control": derivatives.CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+
+    blob = upload_store.blob_path(digest)
+    if kind == derivatives.ORIGINAL:
+        found = (blob, derivatives.sniff_mime(blob)) if blob.is_file() else None
+    else:
+        found = derivative_store.path(digest, kind)
+        if found is None and blob.is_file():
+            # Non ancora pronta (o generata da un altro worker): aspetta il job
+            future = derivative_store.schedule(str(blob), digest)
+            if future is not None:
+                try:
+                    await asyncio.wrap_future(future)
+                except (FileNotFoundError, OSError, ValueError):
+                    pass
+            found = derivative_store.path(digest, kind)
+    if found is None:
+        raise HTTPException(status_code=404, detail="File non trovato")
+    path, mime = found
+    return FileResponse(path, media_type=mime, headers=headers)
 
 
 @app.delete("/uploads/{filename}")
 async def delete_upload(filename: str):
     """Elimina file."""
-    file_path = UPLOAD_DIR / filename
-    if file_path.exists():
-        file_path.unlink()
+    try:
+        deleted = await asyncio.to_thread(upload_store.delete, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if deleted:
         return {"deleted": filename}
     raise HTTPException(status_code=404, detail="File non trovato")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+    )
\ No newline at end of file
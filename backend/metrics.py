@@ -0,0 +1,263 @@
+"""
+Prometheus metrics without external dependencies.
+
+Counter, Gauge e Histogram con label, esposti da GET /metrics nel formato
+testo di Prometheus (0.0.4). I valori sono per processo: con più worker
+ogni processo va interrogato (o aggregato) separatamente.
+
+Le metriche della pipeline sono definite qui in fondo, così copywriter,
+images e main condividono gli stessi oggetti.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+BYTES_BUCKETS = tuple(2 ** i * 1024 for i in range(4, 16, 2))  # 16 KB .. 16 MB
+
+_Sample = Tuple[str, Dict[str, str], float]
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if v == int(v):
+        return str(int(v))
+    return repr(float(v))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"metric already registered: {metric.name}")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {list(self.labelnames)}, got {sorted(labels)}")
+        return tuple("" if labels[n] is None else str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterator[_Sample]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        if amount < 0:
+            raise ValueError("counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: object) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels: object) -> Iterator[None]:
+        """+1 for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        """Observe the wall time of the block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[_Sample]:
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, n) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield f"{self.name}_bucket", {**labels, "le": _fmt_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, n
+
+def render() -> str:
+    return REGISTRY.render()
+
+def error_label(error: BaseException) -> str:
+    """Low-cardinality label for a validation error ('missing required hashtags: [...]' -> prefix)."""
+    return str(error).split(":", 1)[0].strip()[:80] or type(error).__name__
+
+# -----------------------------
+# Pipeline metrics
+# -----------------------------
+_SLOT = ("template_id", "post_role")
+
+MODEL_CALL_SECONDS = Histogram(
+    "copywriter_model_call_seconds",
+    "Latency of model calls (call=brief|post|retry).",
+    ("call", "provider", "model") + _SLOT,
+)
+MODEL_TOKENS = Counter(
+    "copywriter_model_tokens_total",
+    "Tokens reported by the model API (kind=input|output|cached).",
+    ("call", "provider", "model", "kind") + _SLOT,
+)
+VALIDATION_SECONDS = Histogram(
+    "copywriter_validation_seconds",
+    "Time spent validating (and locally repairing) a post.",
+    _SLOT,
+)
+VALIDATION_FAILURES = Counter(
+    "copywriter_validation_failures_total",
+    "validate_post failures by error message (outcome=repaired|rejected).",
+    ("error", "outcome") + _SLOT,
+)
+POST_RETRIES = Counter(
+    "copywriter_post_retries_total",
+    "Correction calls sent to the model, by the validation error that caused them.",
+    ("error",) + _SLOT,
+)
+NEAR_DUPLICATES = Counter(
+    "copywriter_near_duplicates_total",
+    "Captions too similar to the brand's archive (outcome=regenerated|flagged).",
+    ("outcome",) + _SLOT,
+)
+IMAGE_PREPARE_SECONDS = Histogram(
+    "copywriter_image_prepare_seconds",
+    "Time to produce the data URL of an image (source=memory|disk|encoded).",
+    ("source",),
+)
+IMAGE_BYTES = Histogram(
+    "copywriter_image_bytes",
+    "Size of the image data URL sent to the model (source=memory|disk|encoded).",
+    ("source",),
+    buckets=BYTES_BUCKETS,
+)
+DERIVATIVE_SECONDS = Histogram(
+    "copywriter_derivative_seconds",
+    "Time to generate an upload derivative (kind=thumb|preview).",
+    ("kind",),
+)
+UPLOADS = Counter(
+    "copywriter_uploads_total",
+    "Uploaded files (deduplicated=true when the content was already stored).",
+    ("deduplicated",),
+)
+UPLOAD_BYTES = Counter(
+    "copywriter_upload_bytes_total",
+    "Bytes received by the upload endpoints.",
+    ("deduplicated",),
+)
+RATE_LIMIT_CONCURRENCY = Gauge(
+    "copywriter_ratelimit_concurrency_limit",
+    "Current adaptive (AIMD) concurrency limit of the provider.",
+    ("provider",),
+)
+RATE_LIMIT_QUEUED = Gauge(
+    "copywriter_ratelimit_queued",
+    "Model calls waiting for the rate limiter.",
+    ("provider",),
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "copywriter_ratelimit_wait_seconds",
+    "Time a model call waited in the rate limiter queue.",
+    ("provider",),
+)
+RATE_LIMITED = Counter(
+    "copywriter_rate_limited_total",
+    "429 responses received (each one is retried after retry-after).",
+    ("provider",),
+)
+GENERATIONS_IN_FLIGHT = Gauge(
+    "copywriter_generations_in_flight",
+    "Generations currently running (operation=generate_posts|regenerate_post).",
+    ("operation",),
+)
+GENERATION_SECONDS = Histogram(
+    "copywriter_generation_seconds",
+    "End-to-end duration of a generation.",
+    ("operation", "outcome"),
+)
@@ -0,0 +1,207 @@
+"""
+Banned-phrase matching.
+
+Le blacklist dei brand possono avere migliaia di frasi: invece di un'espressione
+regolare per frase, un automa Aho–Corasick trova tutte le occorrenze in una
+sola passata sul testo, con costo indipendente dal numero di frasi.
+
+Testo e frasi sono normalizzati allo stesso modo (minuscole, accenti rimossi,
+apostrofi tipografici e spazi uniformati), ma i match riportano gli offset
+nel testo originale. Una frase conta solo a parola intera: "unico" non
+matcha "unicorno".
+
+Un matcher si costruisce una volta per lista di frasi e resta in cache
+(matcher_for), così ogni brand paga la compilazione una volta sola.
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# -----------------------------
+# Knobs
+# -----------------------------
+PROMPT_PHRASES = 40       # frasi mandate nel prompt; il resto lo controlla solo la validazione
+MATCHER_CACHE_SIZE = 512  # matcher compilati tenuti in memoria (uno per blacklist/brand)
+
+_CHAR_MAP = {
+    "’": "'", "‘": "'", "ʼ": "'", "`": "'",
+    "“": '"', "”": '"',
+    "–": "-", "—": "-",
+}
+
+# -----------------------------
+# Normalization
+# -----------------------------
+def normalize(text: str) -> Tuple[str, List[int]]:
+    """(normalized text, offsets): offsets[i] = index in `text` of normalized char i."""
+    out: List[str] = []
+    offsets: List[int] = []
+    prev_space = True  # spazi iniziali scartati
+    for i, ch in enumerate(text):
+        ch = _CHAR_MAP.get(ch, ch)
+        if ch.isspace():
+            if not prev_space:
+                out.append(" ")
+                offsets.append(i)
+            prev_space = True
+            continue
+        prev_space = False
+        for c in unicodedata.normalize("NFKD", ch):
+            if unicodedata.combining(c):
+                continue
+            for folded in c.casefold():
+                out.append(folded)
+                offsets.append(i)
+    if out and out[-1] == " ":
+        out.pop()
+        offsets.pop()
+    return "".join(out), offsets
+
+def normalize_phrase(phrase: str) -> str:
+    return normalize(phrase)[0]
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+# -----------------------------
+# Matcher
+# -----------------------------
+class Match(NamedTuple):
+    phrase: str   # la frase come è scritta nella blacklist
+    start: int    # offset nel testo originale
+    end: int      # esclusivo
+    field: str = ""
+
+    def __str__(self) -> str:
+        where = f" in {self.field}" if self.field else ""
+        return f"'{self.phrase}'{where} [{self.start}:{self.end}]"
+
+class PhraseMatcher:
+    """Aho–Corasick automaton over normalized phrases."""
+
+    def __init__(self, phrases: Iterable[str]):
+        self.phrases: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]   # indici in self.phrases che finiscono in questo nodo
+        self._lengths: List[int] = []       # lunghezza normalizzata di ogni frase
+        seen = set()
+        for phrase in phrases:
+            norm = normalize_phrase(phrase)
+            if not norm or norm in seen:
+                continue
+            seen.add(norm)
+            self._add(norm, len(self.phrases))
+            self.phrases.append(phrase)
+            self._lengths.append(len(norm))
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def _add(self, norm: str, index: int) -> None:
+        node = 0
+        for c in norm:
+            nxt = self._goto[node].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(index)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(c, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text: str, field: str = "") -> List[Match]:
+        """Every whole-word occurrence of a phrase in `text`, in order of position."""
+        if not text or not self.phrases:
+            return []
+        norm, offsets = normalize(text)
+        hits: List[Match] = []
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, c in enumerate(norm):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for index in out[node]:
+                start = i - self._lengths[index] + 1
+                if start > 0 and _is_word_char(norm[start - 1]) and _is_word_char(norm[start]):
+                    continue
+                if i + 1 < len(norm) and _is_word_char(norm[i + 1]) and _is_word_char(norm[i]):
+                    continue
+                hits.append(Match(self.phrases[index], offsets[start], _end_offset(text, offsets, i), field))
+        hits.sort(key=lambda m: (m.start, -m.end))
+        return hits
+
+    def scan_post(self, post: Dict[str, Any]) -> List[Match]:
+        """Hits in caption, title and alt text of a generated post."""
+        fields = (
+            ("caption", post.get("caption")),
+            ("title", post.get("title")),
+            ("alt_text", (post.get("content") or {}).get("alt_text")),
+        )
+        hits: List[Match] = []
+        for field, text in fields:
+            if isinstance(text, str):
+                hits.extend(self.scan(text, field))
+        return hits
+
+def _end_offset(text: str, offsets: List[int], i: int) -> int:
+    """Exclusive end in `text` of the normalized char i (a char can expand to several)."""
+    end = offsets[i] + 1
+    # Combining marks dopo l'ultimo carattere (es. "e" + accento separato) fanno parte del match
+    while end < len(text) and unicodedata.combining(text[end]):
+        end += 1
+    return end
+
+# -----------------------------
+# Cache / prompt
+# -----------------------------
+_matchers: "OrderedDict[Tuple[str, ...], PhraseMatcher]" = OrderedDict()
+_matchers_lock = threading.Lock()
+
+def matcher_for(phrases: Sequence[str]) -> PhraseMatcher:
+    """Compiled matcher for a blacklist, built once and kept in an LRU cache."""
+    key = tuple(phrases)
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            return matcher
+    matcher = PhraseMatcher(key)
+    with _matchers_lock:
+        _matchers[key] = matcher
+        _matchers.move_to_end(key)
+        while len(_matchers) > MATCHER_CACHE_SIZE:
+            _matchers.popitem(last=False)
+    return matcher
+
+def prompt_phrases(phrases: Sequence[str], limit: Optional[int] = PROMPT_PHRASES) -> List[str]:
+    """The first `limit` distinct phrases, in blacklist (priority) order, for the prompt."""
+    out: List[str] = []
+    seen = set()
+    for phrase in phrases:
+        norm = normalize_phrase(phrase)
+        if not norm or norm in seen:
+            continue
+        seen.add(norm)
+        out.append(phrase)
+        if limit is not None and len(out) >= limit:
+            break
+    return out
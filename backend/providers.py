@@ -0,0 +1,329 @@
+"""
+LLM providers.
+
+copywriter costruisce i body nel formato della Responses API (gli stessi dei
+file batch); un provider li esegue e restituisce un `Completion` uniforme
+(testo, token, header della risposta).
+
+- OpenAIProvider: SDK ufficiale, Responses API.
+- OpenAICompatibleProvider: endpoint /chat/completions compatibile OpenAI
+  (vLLM, llama.cpp server, gateway...), body tradotto al volo.
+
+Ogni provider ha un solo httpx.Client con pool di connessioni keep-alive,
+condiviso da tutte le richieste e da tutti i thread di generazione del
+processo, e un RateLimiter (ratelimit.py) che gestisce RPM/TPM, concorrenza
+e retry: `complete()` passa dal limiter, `create()` no. Timeout, base URL,
+pool e limiti si configurano da variabili d'ambiente (vedi init_providers).
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+import ratelimit
+
+# -----------------------------
+# Knobs (override da env)
+# -----------------------------
+POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "64"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "32"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = 10.0
+DEFAULT_TIMEOUT = 120.0
+# Processi worker che condividono le stesse key (uvicorn e gunicorn leggono
+# WEB_CONCURRENCY come numero di worker): ognuno parte con 1/N di RPM e TPM,
+# poi gli header x-ratelimit-* riportano il residuo reale dell'account.
+WORKER_PROCESSES = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+class ProviderError(Exception):
+    """Error returned by a provider, with the HTTP status when there is one."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = {k.lower(): v for k, v in (headers or {}).items()}
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+class Completion:
+    """Uniform result of a provider call."""
+
+    def __init__(self, text: str, usage: Dict[str, int], headers: Optional[Dict[str, str]] = None, model: str = ""):
+        self.text = text
+        self.usage = usage
+        self.headers = {k.lower(): v for k, v in (headers or {}).items()}
+        self.model = model
+
+    # Stessa interfaccia del risultato dell'SDK usata da copywriter
+    @property
+    def output_text(self) -> str:
+        return self.text
+
+def _usage(input_tokens: Any, output_tokens: Any, cached_tokens: Any) -> Dict[str, int]:
+    return {
+        "input_tokens": input_tokens or 0,
+        "output_tokens": output_tokens or 0,
+        "cached_tokens": cached_tokens or 0,
+    }
+
+def make_http_client(timeout: float = DEFAULT_TIMEOUT) -> httpx.Client:
+    """Thread-safe pooled client; one per provider, shared by every request."""
+    return httpx.Client(
+        timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+class Provider:
+    name = ""
+    default_model = ""
+    limiter: Optional[ratelimit.RateLimiter] = None
+
+    def create(self, body: Dict[str, Any]) -> Completion:
+        """Single HTTP call, no retries."""
+        raise NotImplementedError
+
+    def complete(self, body: Dict[str, Any]) -> Completion:
+        """create() through the rate limiter: queued under RPM/TPM, retried on 429/5xx."""
+        if self.limiter is None:
+            return self.create(body)
+        return self.limiter.call(
+            lambda: self.create(body), ratelimit.estimate_tokens(body), ratelimit.call_kind(body)
+        )
+
+    def close(self) -> None:
+        pass
+
+# -----------------------------
+# OpenAI (Responses API)
+# -----------------------------
+class OpenAIProvider(Provider):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        name: str = "openai",
+        default_model: str = "",
+        limiter: Optional[ratelimit.RateLimiter] = None,
+    ):
+        from openai import OpenAI
+
+        self.name = name
+        self.default_model = default_model
+        self.limiter = limiter
+        self.http_client = make_http_client(timeout)
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,  # i retry li fa il RateLimiter, che vede anche i 429
+            http_client=self.http_client,
+        )
+
+    def create(self, body: Dict[str, Any]) -> Completion:
+        import openai
+
+        try:
+            raw = self.client.responses.with_raw_response.create(**body)
+        except openai.APIStatusError as e:
+            raise ProviderError(str(e), e.status_code, dict(e.response.headers)) from e
+        except openai.APIConnectionError as e:
+            raise ProviderError(str(e)) from e
+        resp = raw.parse()
+        u = getattr(resp, "usage", None)
+        details = getattr(u, "input_tokens_details", None)
+        return Completion(
+            resp.output_text,
+            _usage(getattr(u, "input_tokens", 0), getattr(u, "output_tokens", 0), getattr(details, "cached_tokens", 0)),
+            dict(raw.headers),
+            getattr(resp, "model", body.get("model", "")),
+        )
+
+    def close(self) -> None:
+        self.http_client.close()
+
+# -----------------------------
+# OpenAI-compatible (chat/completions)
+# -----------------------------
+def _chat_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return content
+    parts = []
+    for c in content:
+        if c["type"] in ("input_text", "output_text"):
+            parts.append({"type": "text", "text": c["text"]})
+        elif c["type"] == "input_image":
+            parts.append({"type": "image_url", "image_url": {"url": c["image_url"]}})
+        else:
+            raise ValueError(f"unsupported content type for chat/completions: {c['type']}")
+    return parts
+
+def chat_completions_body(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a Responses API body to a chat/completions one."""
+    out: Dict[str, Any] = {
+        "model": body["model"],
+        "messages": [{"role": m["role"], "content": _chat_content(m["content"])} for m in body["input"]],
+    }
+    if "temperature" in body:
+        out["temperature"] = body["temperature"]
+    if "max_output_tokens" in body:
+        out["max_tokens"] = body["max_output_tokens"]
+    fmt = body.get("text", {}).get("format")
+    if fmt and fmt.get("type") == "json_schema":
+        out["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": fmt["name"], "strict": fmt.get("strict", False), "schema": fmt["schema"]},
+        }
+    return out
+
+class OpenAICompatibleProvider(Provider):
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        name: str = "compat",
+        default_model: str = "",
+        limiter: Optional[ratelimit.RateLimiter] = None,
+    ):
+        self.name = name
+        self.default_model = default_model
+        self.limiter = limiter
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.http_client = make_http_client(timeout)
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def create(self, body: Dict[str, Any]) -> Completion:
+        try:
+            r = self.http_client.post(self.url, json=chat_completions_body(body), headers=self.headers)
+        except httpx.HTTPError as e:
+            raise ProviderError(f"{type(e).__name__}: {e}") from e
+        if r.status_code >= 400:
+            raise ProviderError(f"HTTP {r.status_code}: {r.text[:500]}", r.status_code, dict(r.headers))
+        data = r.json()
+        message = data["choices"][0]["message"]
+        u = data.get("usage") or {}
+        return Completion(
+            message.get("content") or "",
+            _usage(
+                u.get("prompt_tokens"),
+                u.get("completion_tokens"),
+                (u.get("prompt_tokens_details") or {}).get("cached_tokens"),
+            ),
+            dict(r.headers),
+            data.get("model", body["model"]),
+        )
+
+    def close(self) -> None:
+        self.http_client.close()
+
+# -----------------------------
+# Registry
+# -----------------------------
+_providers: Dict[str, Provider] = {}
+_default: Optional[str] = None
+_lock = threading.Lock()
+
+def register(provider: Provider, default: bool = False) -> Provider:
+    global _default
+    with _lock:
+        previous = _providers.get(provider.name)
+        _providers[provider.name] = provider
+        if default or _default is None:
+            _default = provider.name
+    if previous is not None and previous is not provider:
+        previous.close()
+    return provider
+
+def get(name: Optional[str] = None) -> Provider:
+    """Provider by name (None = default). Raises ValueError if not configured."""
+    with _lock:
+        key = name or _default
+        provider = _providers.get(key) if key else None
+    if provider is None:
+        raise ValueError(f"Provider non configurato: {name or 'default'}. Disponibili: {available()}")
+    return provider
+
+def available() -> List[str]:
+    with _lock:
+        return sorted(_providers)
+
+def snapshot() -> Dict[str, Any]:
+    """Configured providers with their rate limiter state."""
+    with _lock:
+        items = sorted(_providers.items())
+    return {
+        name: {
+            "default_model": p.default_model or None,
+            "rate_limiter": p.limiter.snapshot() if p.limiter is not None else None,
+        }
+        for name, p in items
+    }
+
+def default_name() -> Optional[str]:
+    return _default
+
+def close_all() -> None:
+    global _default
+    with _lock:
+        providers = list(_providers.values())
+        _providers.clear()
+        _default = None
+    for p in providers:
+        p.close()
+
+def limiter_from_env(name: str, prefix: str) -> Optional[ratelimit.RateLimiter]:
+    """{prefix}_RPM / {prefix}_TPM / {prefix}_MAX_CONCURRENCY; RPM=0 disables the limiter.
+
+    RPM e TPM sono quelli dell'account, divisi tra i WORKER_PROCESSES.
+    """
+    env = os.environ
+    rpm = float(env.get(f"{prefix}_RPM", ratelimit.DEFAULT_RPM))
+    if rpm <= 0:
+        return None
+    return ratelimit.RateLimiter(
+        name,
+        rpm=rpm,
+        tpm=float(env.get(f"{prefix}_TPM", ratelimit.DEFAULT_TPM)),
+        max_concurrency=int(env.get(f"{prefix}_MAX_CONCURRENCY", ratelimit.MAX_CONCURRENCY)),
+        share=1.0 / WORKER_PROCESSES,
+    )
+
+def init_providers(openai_api_key: Optional[str] = None) -> List[str]:
+    """Register the providers configured by the environment.
+
+    - openai: se c'è una API key (OPENAI_BASE_URL, OPENAI_TIMEOUT, OPENAI_RPM,
+      OPENAI_TPM, OPENAI_MAX_CONCURRENCY)
+    - compatibile: se COMPAT_BASE_URL è impostato (COMPAT_API_KEY, COMPAT_TIMEOUT,
+      COMPAT_NAME, COMPAT_MODEL, COMPAT_RPM, COMPAT_TPM, COMPAT_MAX_CONCURRENCY)
+    LLM_DEFAULT_PROVIDER sceglie il default (altrimenti il primo registrato).
+    """
+    env = os.environ
+    if openai_api_key:
+        register(OpenAIProvider(
+            openai_api_key,
+            base_url=env.get("OPENAI_BASE_URL") or None,
+            timeout=float(env.get("OPENAI_TIMEOUT", DEFAULT_TIMEOUT)),
+            limiter=limiter_from_env("openai", "OPENAI"),
+        ))
+    if env.get("COMPAT_BASE_URL"):
+        name = env.get("COMPAT_NAME", "compat")
+        register(OpenAICompatibleProvider(
+            env["COMPAT_BASE_URL"],
+            api_key=env.get("COMPAT_API_KEY") or None,
+            timeout=float(env.get("COMPAT_TIMEOUT", DEFAULT_TIMEOUT)),
+            name=name,
+            default_model=env.get("COMPAT_MODEL", ""),
+            limiter=limiter_from_env(name, "COMPAT"),
+        ))
+    if env.get("LLM_DEFAULT_PROVIDER"):
+        register(get(env["LLM_DEFAULT_PROVIDER"]), default=True)
+    return available()
@@ -0,0 +1,315 @@
+"""
+Adaptive rate limiter for model calls.
+
+Uno per provider, condiviso da tutti i thread del processo:
+- due token bucket, richieste/minuto (RPM) e token stimati/minuto (TPM,
+  immagini e max_output_tokens inclusi, come li conta OpenAI);
+- i limiti e i residui dichiarati dagli header x-ratelimit-* della risposta
+  correggono i bucket (contano anche gli altri processi con la stessa key);
+  con più worker ogni processo usa la sua quota (`share`) di quei valori;
+- le chiamate oltre il limite aspettano in coda FIFO invece di fallire;
+- la concorrenza si adatta AIMD: +1/limite per successo veloce, dimezzata
+  su 429, ridotta se la latenza sale molto sopra quella minima osservata
+  per lo stesso tipo di chiamata (brief, post con immagine, retry solo
+  testo); il minimo risale lentamente, così un cambio stabile di
+  latenza (modello, prompt più lunghi) non viene letto come congestione;
+- un 429 (o un 5xx) viene ritentato dopo retry-after, bloccando nel
+  frattempo tutte le chiamate del provider.
+"""
+
+import collections
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+# -----------------------------
+# Knobs
+# -----------------------------
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+MAX_CONCURRENCY = 32
+MIN_CONCURRENCY = 1
+INITIAL_CONCURRENCY = 8
+MAX_ATTEMPTS = 6                 # tentativi per chiamata (429/5xx/rete)
+DECREASE_FACTOR = 0.5            # su 429
+LATENCY_DECREASE_FACTOR = 0.9    # su latenza anomala
+LATENCY_TOLERANCE = 3.0          # "lenta" = oltre 3x la latenza minima osservata
+DECREASE_COOLDOWN = 2.0          # al massimo una riduzione ogni N secondi
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_FLOOR_HALFLIFE = 300.0   # il minimo dimezza la distanza dalla media in 5 minuti
+
+# Immagine dopo images.prepare_image (lato corto 768, lungo fino a 1024 per i
+# formati comuni): 2x2 = 4 tile da 512px * 170 + 85 di base
+IMAGE_TOKENS = 765
+CHARS_PER_TOKEN = 4
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_duration(value: str) -> Optional[float]:
+    """'6m0s' / '1.5s' / '200ms' -> seconds."""
+    parts = _DURATION_RE.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+def retry_after_seconds(headers: Dict[str, str]) -> Optional[float]:
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+def estimate_tokens(body: Dict[str, Any]) -> int:
+    """Tokens a Responses-format body counts against TPM (prompt + images + max output)."""
+    chars = 0
+    images = 0
+    for msg in body.get("input", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for c in content:
+            if c.get("type") == "input_image":
+                images += 1
+            else:
+                chars += len(c.get("text", ""))
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKENS + int(body.get("max_output_tokens") or 0)
+
+def call_kind(body: Dict[str, Any]) -> str:
+    """Latency class of a Responses-format body: brief, post (with image) or retry (text only)."""
+    if body.get("text", {}).get("format", {}).get("name") == "week_brief":
+        return "brief"
+    for msg in body.get("input", []):
+        content = msg.get("content")
+        if not isinstance(content, str) and any(c.get("type") == "input_image" for c in content):
+            return "post"
+    return "retry"
+
+class _Bucket:
+    """Token bucket refilled continuously at capacity/60 per second."""
+
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+class RateLimiter:
+    def __init__(
+        self,
+        name: str,
+        rpm: float = DEFAULT_RPM,
+        tpm: float = DEFAULT_TPM,
+        max_concurrency: int = MAX_CONCURRENCY,
+        min_concurrency: int = MIN_CONCURRENCY,
+        initial_concurrency: int = INITIAL_CONCURRENCY,
+        share: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,  # secondi monotoni, sostituibile nei test
+    ):
+        self.name = name
+        self.share = share  # quota dei limiti dell'account per questo processo
+        self.clock = clock
+        self.requests = _Bucket(rpm * share, clock())
+        self.tokens = _Bucket(tpm * share, clock())
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # Per tipo di chiamata: {"ewma", "floor", "at"} (at = ultimo aggiornamento del minimo)
+        self.latency: Dict[str, Dict[str, float]] = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._queue: "collections.deque[object]" = collections.deque()
+        self.stats = {"calls": 0, "rate_limited": 0, "retries": 0, "waited_seconds": 0.0}
+        metrics.RATE_LIMIT_CONCURRENCY.set(self.limit, provider=name)
+
+    # -----------------------------
+    # Acquire / release
+    # -----------------------------
+    def _wait_time(self, now: float, cost: float) -> float:
+        waits = [self.blocked_until - now, self.requests.wait_time(1), self.tokens.wait_time(cost)]
+        return max(0.0, *waits)
+
+    def acquire(self, cost: float) -> float:
+        """Block (FIFO) until a concurrency slot and budget are free; returns the charged cost."""
+        cost = min(float(cost), self.tokens.capacity)
+        me = object()
+        start = self.clock()
+        with self._cond:
+            self._queue.append(me)
+            metrics.RATE_LIMIT_QUEUED.inc(provider=self.name)
+            try:
+                while True:
+                    now = self.clock()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    timeout = None
+                    if self._queue[0] is me and self.in_flight < int(self.limit):
+                        timeout = self._wait_time(now, cost)
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+                self._queue.popleft()
+                self.requests.level -= 1
+                self.tokens.level -= cost
+                self.in_flight += 1
+                waited = self.clock() - start
+                self.stats["calls"] += 1
+                self.stats["waited_seconds"] += waited
+                self._cond.notify_all()
+            finally:
+                metrics.RATE_LIMIT_QUEUED.dec(provider=self.name)
+                if self._queue and me in self._queue:
+                    self._queue.remove(me)
+                    self._cond.notify_all()
+        metrics.RATE_LIMIT_WAIT_SECONDS.observe(waited, provider=self.name)
+        return cost
+
+    def release(
+        self,
+        charged: float,
+        actual_tokens: Optional[int] = None,
+        headers: Optional[Dict[str, str]] = None,
+        latency: Optional[float] = None,
+        rate_limited: bool = False,
+        kind: str = "",
+    ) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            now = self.clock()
+            if actual_tokens is not None:
+                # La stima era prudente: restituisci la differenza (o addebita il resto)
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + charged - actual_tokens)
+            if headers:
+                self._apply_headers(headers, now)
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                wait = retry_after_seconds(headers or {}) or 1.0
+                self.blocked_until = max(self.blocked_until, now + wait)
+                self._decrease(DECREASE_FACTOR, now)
+            elif latency is not None:
+                self._observe_latency(kind, latency, now)
+            metrics.RATE_LIMIT_CONCURRENCY.set(self.limit, provider=self.name)
+            self._cond.notify_all()
+
+    # -----------------------------
+    # Adaptation
+    # -----------------------------
+    def _decrease(self, factor: float, now: float) -> None:
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+
+    def _observe_latency(self, kind: str, latency: float, now: float) -> None:
+        s = self.latency.get(kind)
+        if s is None:
+            s = self.latency[kind] = {"ewma": latency, "floor": latency, "at": now}
+        else:
+            s["ewma"] = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * s["ewma"]
+            # Minimo che risale verso la media: un picco di pochi secondi lo sposta
+            # appena, una latenza stabilmente più alta diventa il nuovo riferimento
+            drift = 1 - 0.5 ** ((now - s["at"]) / LATENCY_FLOOR_HALFLIFE)
+            s["floor"] = min(s["ewma"], s["floor"] + (s["ewma"] - s["floor"]) * drift)
+            s["at"] = now
+        if s["ewma"] > LATENCY_TOLERANCE * s["floor"]:
+            self._decrease(LATENCY_DECREASE_FACTOR, now)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+
+    def _apply_headers(self, headers: Dict[str, str], now: float) -> None:
+        """Adopt server-side limits/remaining budget from x-ratelimit-* headers."""
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            try:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                if limit:
+                    bucket.capacity = float(limit) * self.share
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is not None:
+                    bucket.level = min(bucket.level, float(remaining) * self.share)
+            except ValueError:
+                continue
+            if remaining is not None and float(remaining) <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+                if reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+
+    # -----------------------------
+    # Call wrapper
+    # -----------------------------
+    def call(self, fn: Callable[[], T], cost: float, kind: str = "") -> T:
+        """Run fn under the limiter, retrying rate-limited and transient failures.
+
+        kind: tipo di chiamata (call_kind) a cui riferire la latenza.
+
+        Le eccezioni con `retryable` vero (providers.ProviderError) vengono
+        ritentate; `status_code` 429 e `headers` guidano attesa e adattamento.
+        Il risultato può esporre `usage` (token effettivi) e `headers`.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            charged = self.acquire(cost)
+            start = self.clock()
+            try:
+                result = fn()
+            except Exception as e:
+                if not getattr(e, "retryable", False) or attempt == MAX_ATTEMPTS - 1:
+                    self.release(charged)
+                    raise
+                headers = getattr(e, "headers", None) or {}
+                is_429 = getattr(e, "status_code", None) == 429
+                if is_429:
+                    metrics.RATE_LIMITED.inc(provider=self.name)
+                self.release(charged, headers=headers, rate_limited=is_429)
+                with self._cond:
+                    self.stats["retries"] += 1
+                if not is_429:
+                    # 5xx / rete: backoff esponenziale solo per questo chiamante
+                    time.sleep(retry_after_seconds(headers) or min(8.0, 0.5 * 2 ** attempt))
+                continue
+            usage = getattr(result, "usage", None)
+            self.release(
+                charged,
+                actual_tokens=usage["input_tokens"] + usage["output_tokens"] if isinstance(usage, dict) else None,
+                headers=getattr(result, "headers", None),
+                latency=self.clock() - start,
+                kind=kind,
+            )
+            return result
+        raise RuntimeError("unreachable")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "rpm": self.requests.capacity,
+                "tpm": self.tokens.capacity,
+                "share": round(self.share, 4),
+                "latency": {
+                    kind: {"ewma": round(s["ewma"], 4), "floor": round(s["floor"], 4)}
+                    for kind, s in sorted(self.latency.items())
+                },
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()},
+            }
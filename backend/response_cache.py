@@ -0,0 +1,112 @@
+"""
+Persistent cache for validated model responses.
+
+La chiave è un hash di tutto ciò che determina l'output (modello, schema,
+temperatura, istruzioni renderizzate, hash dell'immagine): rilanciare una
+campagna con un solo campo cambiato paga solo gli slot davvero diversi.
+Nel database finiscono solo JSON già validati.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from storage import DATA_DIR, SQLiteStore
+
+DEFAULT_PATH = DATA_DIR / "responses.sqlite3"
+TTL_SECONDS = 30 * 24 * 3600
+MAX_ENTRIES = 50_000
+EVICT_EVERY = 100  # controlla TTL/dimensione ogni N scritture
+TOUCH_INTERVAL = 60.0  # secondi: granularità di accessed_at per l'LRU
+
+def fingerprint(**parts: Any) -> str:
+    """Stable SHA-256 over JSON-serializable request parts."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class ResponseCache(SQLiteStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at);
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, ttl_seconds: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, accessed_at FROM responses WHERE key = ? AND created_at >= ?",
+            (key, now - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        # Un hit è una lettura: il write lock (condiviso tra i worker) solo se
+        # accessed_at è abbastanza vecchio da contare per l'LRU
+        if now - row["accessed_at"] > TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return json.loads(row["value"])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        conn = self.connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+        self._count("writes")
+        with self._lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones over max_entries."""
+        conn = self.connect()
+        with conn:
+            n = conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            n += conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        self._count("evicted", n)
+        return n
+
+    def invalidate(self, key: str) -> None:
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.stats)
+        total = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / total, 4) if total else 0.0
+        out["entries"] = self.connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return out
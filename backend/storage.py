@@ -0,0 +1,63 @@
+"""
+SQLite helpers condivisi dagli store locali (cache, job, archivio...).
+
+Ogni store apre una connessione per thread; il database è in WAL mode così
+letture e scritture da thread (e processi) diversi non si bloccano a vicenda.
+Con più worker uvicorn tutti i processi aprono gli stessi file sotto DATA_DIR:
+cache, brief, job e indice degli upload sono condivisi.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock solo tra i thread del processo
+    fcntl = None
+
+_fallback_lock = threading.Lock()
+
+DATA_DIR = Path(os.environ.get("COPYWRITER_DATA_DIR", "./data"))
+UPLOAD_DIR = Path(os.environ.get("COPYWRITER_UPLOAD_DIR", "./uploads"))
+
+class SQLiteStore:
+    """Base class: per-thread connections on a single database file."""
+
+    SCHEMA = ""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Exclusive lock across processes (and threads) on `path`, via flock."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with _fallback_lock:
+            yield
+        return
+    with open(path, "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# I moduli del backend sono flat (import copywriter, import storage...):
+# stessa sys.path di `python main.py`. DATA_DIR/UPLOAD_DIR sono letti
+# all'import di storage, quindi vanno impostati prima di qualsiasi import.
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+_TMP = Path(tempfile.mkdtemp(prefix="copywriter-tests-"))
+os.environ.setdefault("COPYWRITER_DATA_DIR", str(_TMP / "data"))
+os.environ.setdefault("COPYWRITER_UPLOAD_DIR", str(_TMP / "uploads"))
+
+import providers
+from bench.mock_responses import MockBehaviour
+
+class MockProvider(providers.Provider):
+    """Provider answered in-process by the bench mock; keeps every request body."""
+
+    name = "mock"
+
+    def __init__(self, **behaviour):
+        self.behaviour = MockBehaviour(**{"latency_ms": 0, "invalid_rate": 0.0, "retry_rate": 0.0, "seed": 0, **behaviour})
+        self.bodies = []
+
+    def create(self, body):
+        self.bodies.append(body)
+        resp = self.behaviour.respond(body)
+        u = resp["usage"]
+        return providers.Completion(
+            resp["output"][0]["content"][0]["text"],
+            {"input_tokens": u["input_tokens"], "output_tokens": u["output_tokens"],
+             "cached_tokens": u["input_tokens_details"]["cached_tokens"]},
+        )
+
+    def calls(self, kind):
+        """Bodies of one call kind: 'post' (with image), 'retry' or 'week_brief'."""
+        def kind_of(body):
+            name = body["text"]["format"]["name"]
+            if name != "post":
+                return name
+            images = any(c.get("type") == "input_image" for m in body["input"] if isinstance(m["content"], list) for c in m["content"])
+            return "post" if images else "retry"
+        return [b for b in self.bodies if kind_of(b) == kind]
+
+@pytest.fixture
+def mock_provider(monkeypatch):
+    """Factory for a default MockProvider; also disables the copywriter stores (tests enable them after)."""
+    import copywriter
+
+    monkeypatch.setattr(providers, "_providers", {})
+    monkeypatch.setattr(providers, "_default", None)
+    monkeypatch.setattr(copywriter, "img_to_data_url", lambda path: "data:image/jpeg;base64,AAAA")
+
+    def make(cls=MockProvider, **behaviour):
+        # Anche dopo lo startup di main, che abilita gli store con i path di default
+        for attr in ("response_cache", "brief_store", "caption_archive", "campaign_archive"):
+            monkeypatch.setattr(copywriter, attr, None)
+        return providers.register(cls(**behaviour), default=True)
+    return make
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient on main.app, started once: shutdown stops main's executors for good."""
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,88 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import archive
+import copywriter
+
+POSTS = [
+    # (giorno, brand, template, caption, hashtags)
+    ("2026-03-02", "bottega", "T1_OGGETTO", "Collana con farfalla in argento.", ["#handmade", "#gioielli"]),
+    ("2026-03-09", "bottega", "T2_DETTAGLIO", "Vaso in legno di noce, venatura a vista.", ["#handmade", "#legno"]),
+    ("2026-03-09", "altro", "T1_OGGETTO", "Farfalla di vetro soffiato.", ["#vetro"]),
+    ("2026-03-16", "bottega", "T1_OGGETTO", "Farfàlla intagliata nel legno.", ["#handmade"]),
+]
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(archive, "time", SimpleNamespace(time=lambda: clock.now))
+    store = archive.CampaignArchive(tmp_path / "archive.sqlite3")
+    for i, (day, brand, template_id, caption, tags) in enumerate(POSTS):
+        clock.now = datetime.fromisoformat(day).timestamp() + 3600 * (i + 1)
+        post = {
+            "template_id": template_id, "day_name": "mon", "caption": caption,
+            "keywords_used": [], "content": {"hashtags": tags, "alt_text": "Un oggetto."},
+        }
+        store.add_post(brand, post, week_brief_id=f"w{i}", slot_index=0, image=f"oggetto_{i}.jpg")
+    return store
+
+def ids(results):
+    return [r["post_id"] for r in results]
+
+def test_text_query_newest_first(store):
+    assert ids(store.search("farfalla")) == [4, 3, 1]
+    assert ids(store.search("farfalla", brand="bottega")) == [4, 1]
+    assert ids(store.search("farfalla", template_id="T2_DETTAGLIO")) == []
+    assert ids(store.search("farfalla legno")) == [4]
+
+def test_prefix_phrase_accents_and_hashtags(store):
+    assert ids(store.search("farf*")) == [4, 3, 1]
+    assert ids(store.search('"legno di noce"')) == [2]
+    assert ids(store.search('"noce legno"')) == []
+    assert ids(store.search("NÒCE")) == [2]
+    assert ids(store.search("gioielli")) == [1]
+
+def test_snippet_highlights_terms(store):
+    (hit,) = store.search("argento")
+    assert hit["snippet"] == "Collana con farfalla in [argento]."
+    assert hit["post"]["caption"] == POSTS[0][3]
+    assert (hit["brand"], hit["week_brief_id"], hit["image"]) == ("bottega", "w0", "oggetto_0.jpg")
+    # Senza testo: filtri sugli indici normali, nessuno snippet
+    results = store.search(brand="bottega")
+    assert ids(results) == [4, 2, 1]
+    assert {r["snippet"] for r in results} == {None}
+
+def test_date_ranges_are_inclusive(store):
+    assert ids(store.search(date_from="2026-03-09")) == [4, 3, 2]
+    assert ids(store.search(date_from="2026-03-09", date_to="2026-03-09")) == [3, 2]
+    assert ids(store.search("legno", date_to="2026-03-09")) == [2]
+    assert ids(store.search("farfalla", date_from="2026-03-03", date_to="2026-03-15")) == [3]
+    assert store.search("legno", date_from="2026-04-01") == []
+    assert store.search("legno", date_to="2026-03-01") == []
+    with pytest.raises(ValueError):
+        store.search("legno", date_from="2026-13-01")
+
+def test_limit_and_offset(store):
+    assert ids(store.search("farfalla", limit=2)) == [4, 3]
+    assert ids(store.search("farfalla", limit=2, offset=2)) == [1]
+
+def test_same_post_archived_once(store):
+    store.add_post("bottega", {"caption": POSTS[0][3]}, week_brief_id="w0", slot_index=0)
+    assert store.count() == len(POSTS)
+
+def test_malformed_match_expression_is_a_value_error(store, monkeypatch):
+    monkeypatch.setattr(archive, "match_query", lambda q="", **columns: "legno AND")
+    with pytest.raises(ValueError, match="query di ricerca non valida"):
+        store.search("legno")
+
+def test_search_endpoint_maps_bad_queries_to_400(store, monkeypatch, client):
+    monkeypatch.setattr(copywriter, "campaign_archive", store)
+    res = client.get("/archive/search", params={"q": "farfalla", "brand": "bottega", "date_to": "2026-03-09"})
+    assert res.status_code == 200
+    assert [r["post_id"] for r in res.json()["results"]] == [1]
+
+    assert client.get("/archive/search", params={"q": "x", "date_from": "09/03/2026"}).status_code == 400
+    monkeypatch.setattr(archive, "match_query", lambda q="", **columns: "legno AND")
+    assert client.get("/archive/search", params={"q": "legno"}).status_code == 400
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import batch
+import copywriter
+from bench.mock_responses import MockBehaviour
+
+IMAGES = ["oggetto_a_01", "oggetto_b_02", "oggetto_c_03", "dettaglio_x_01", "dettaglio_y_02", "processo_z_01", "storia_w_01"]
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    monkeypatch.setattr(copywriter, "img_to_data_url", lambda path: "data:image/jpeg;base64,AAAA")
+    monkeypatch.setattr(copywriter, "brief_store", None)
+    paths = []
+    for name in IMAGES:
+        p = tmp_path / f"{name}.jpg"
+        p.write_bytes(name.encode())
+        paths.append(str(p))
+    return paths
+
+def campaign(images, **kw):
+    return {
+        "goal": "far conoscere il laboratorio",
+        "theme": "legno e luce",
+        "images": images,
+        "brand_name": "Bottega",
+        "brand_tagline": "Fatto a mano.",
+        "start_date": "2026-03-02",
+        **kw,
+    }
+
+def answer(requests_path, results_path, fail=()):
+    """Batch results file for a requests file, answered by the bench mock."""
+    mock = MockBehaviour(latency_ms=0, invalid_rate=0.0, retry_rate=0.0, seed=0)
+    with open(requests_path, encoding="utf-8") as f, open(results_path, "w", encoding="utf-8") as out:
+        for line in f:
+            req = json.loads(line)
+            if req["custom_id"] in fail:
+                row = {"custom_id": req["custom_id"], "response": None, "error": {"code": "server_error"}}
+            else:
+                row = {"custom_id": req["custom_id"], "response": {"status_code": 200, "body": mock.respond(req["body"])}}
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+def run_all(run, tmp_path, fail=()):
+    for step, export in (("briefs", run.export_briefs), ("posts", run.export_posts), ("repairs", run.export_repairs)):
+        requests_path, results_path = tmp_path / f"{step}.jsonl", tmp_path / f"{step}_results.jsonl"
+        export(requests_path)
+        answer(requests_path, results_path, fail)
+        run.ingest(results_path)
+
+def test_assemble_round_trip(images, tmp_path):
+    run = batch.BatchRun.create({"a": campaign(images, n_posts=7), "b": campaign(images, n_posts=4)})
+    state_path = tmp_path / "state.json"
+    run.save(state_path)
+    run = batch.BatchRun.load(state_path)
+
+    run_all(run, tmp_path)
+    results = run.assemble()
+
+    assert run.pending() == {}
+    assert set(results) == {"a", "b"}
+    out = results["a"]
+    assert set(out) == {"week_brief", "week_brief_id", "schedule", "chosen_images", "posts", "usage"}
+    assert out["week_brief"]["week_id"] == "2026-03-02"
+    assert len(out["posts"]) == 7 and len(results["b"]["posts"]) == 4
+    assert all("#handmade" in p["content"]["hashtags"] for p in out["posts"])
+
+    totals = out["usage"]["totals"]
+    assert totals["brief"]["calls"] == 1
+    assert totals["post"]["calls"] == 7
+    assert totals["post"]["input_tokens"] > 0 and totals["post"]["output_tokens"] > 0
+    assert "retry" not in totals
+    assert sorted(c["slot_index"] for c in out["usage"]["calls"] if c["call"] == "post") == list(range(7))
+
+def test_failed_slot_stays_pending(images, tmp_path):
+    run = batch.BatchRun.create({"a": campaign(images)})
+    run_all(run, tmp_path, fail={"a|post|2"})
+
+    assert run.assemble() == {}
+    assert run.pending() == {"a": ['slot 2: {"code": "server_error"}']}
+
+    # Un nuovo giro di export riprende solo lo slot fallito
+    assert run.export_posts(tmp_path / "again.jsonl") == 1
+    answer(tmp_path / "again.jsonl", tmp_path / "again_results.jsonl")
+    run.ingest(tmp_path / "again_results.jsonl")
+    results = run.assemble()
+    assert results["a"]["usage"]["totals"]["post"]["calls"] == 6
+
+def test_start_date_defaults_to_plan_day(images):
+    kw = campaign(images)
+    del kw["start_date"]
+    run = batch.BatchRun.create({"a": kw})
+    assert run.state["campaigns"]["a"]["params"]["start_date"] == copywriter.date.today().isoformat()
+
+def test_campaign_id_with_separator_is_rejected(images):
+    with pytest.raises(ValueError):
+        batch.BatchRun.create({"a|b": campaign(images)})
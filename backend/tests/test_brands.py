@@ -0,0 +1,91 @@
+import pytest
+
+import brands
+import copywriter
+
+PROFILE = {"brand_name": "Bottega", "brand_tagline": "Fatto a mano.", "required_hashtags": ["#handmade", "#bottega"]}
+
+@pytest.fixture
+def builds():
+    return []
+
+@pytest.fixture
+def store(tmp_path, builds):
+    return open_store(tmp_path, builds)
+
+def open_store(tmp_path, builds):
+    """BrandStore on the shared test db, recording every (brand_id, brand_name) it compiles."""
+    def build(brand_id, profile):
+        builds.append((brand_id, profile["brand_name"]))
+        return copywriter.BrandProfile(**profile, brand_id=brand_id)
+    return brands.BrandStore(tmp_path / "brands.sqlite3", build=build)
+
+def test_put_fills_defaults_and_keeps_revision_for_same_content(store):
+    first = store.put("bottega", PROFILE)
+    assert first["profile"]["base_hashtags"] == [] and first["profile"]["custom_banned_phrases"] is None
+    again = store.put("bottega", dict(PROFILE))
+    assert again["revision"] == first["revision"]
+    assert again["updated_at"] == first["updated_at"]
+    changed = store.put("bottega", {**PROFILE, "brand_tagline": "Dal 1980."})
+    assert changed["revision"] != first["revision"]
+    assert changed["created_at"] == first["created_at"]
+
+@pytest.mark.parametrize("brand_id, profile", [
+    ("", PROFILE),
+    ("../x", PROFILE),
+    ("bottega", {"brand_name": " "}),
+    ("bottega", {**PROFILE, "colore": "blu"}),
+])
+def test_put_rejects_invalid_profiles(store, brand_id, profile):
+    with pytest.raises(ValueError):
+        store.put(brand_id, profile)
+
+def test_profile_compiled_once_per_revision(store, builds):
+    store.put("bottega", PROFILE)
+    profile = store.profile("bottega")
+    assert isinstance(profile, copywriter.BrandProfile)
+    assert (profile.brand_id, profile.brand_key, profile.brand_name) == ("bottega", "bottega", "Bottega")
+    assert store.profile("bottega") is profile
+    store.put("bottega", dict(PROFILE))  # stesso contenuto: stessa revisione
+    assert store.profile("bottega") is profile
+    assert builds == [("bottega", "Bottega")]
+
+def test_changed_profile_is_recompiled(store, builds):
+    store.put("bottega", PROFILE)
+    old = store.profile("bottega")
+    store.put("bottega", {**PROFILE, "brand_name": "Bottega Rossi", "required_hashtags": ["#rossi"]})
+    new = store.profile("bottega")
+    assert new is not old
+    assert new.brand_name == "Bottega Rossi" and new.required_hashtags == ["#rossi"]
+    assert "Bottega Rossi" in new.brand_facts
+    assert new.brand_key == old.brand_key == "bottega"
+    assert builds == [("bottega", "Bottega"), ("bottega", "Bottega Rossi")]
+
+def test_update_from_another_worker_is_never_served_stale(store, builds, tmp_path):
+    store.put("bottega", PROFILE)
+    assert store.profile("bottega").brand_name == "Bottega"
+
+    other = open_store(tmp_path, builds)  # stesso db, altro processo
+    other.put("bottega", {**PROFILE, "brand_name": "Nuovo nome"})
+    assert store.profile("bottega").brand_name == "Nuovo nome"
+
+    other.delete("bottega")
+    assert store.profile("bottega") is None
+    other.put("bottega", PROFILE)
+    assert store.profile("bottega").brand_name == "Bottega"
+
+def test_compiled_cache_is_bounded(store, builds, monkeypatch):
+    monkeypatch.setattr(brands, "COMPILED_CACHE_SIZE", 2)
+    for brand_id in ("a", "b", "c"):
+        store.put(brand_id, {"brand_name": brand_id.upper()})
+        store.profile(brand_id)
+    store.profile("c")
+    store.profile("a")  # uscito dalla cache: ricompilato
+    assert builds == [("a", "A"), ("b", "B"), ("c", "C"), ("a", "A")]
+
+def test_list_pages_by_brand_id(store):
+    for brand_id in ("c", "a", "b"):
+        store.put(brand_id, {"brand_name": brand_id})
+    assert [b["brand_id"] for b in store.list(limit=2)] == ["a", "b"]
+    assert [b["brand_id"] for b in store.list(limit=2, cursor="b")] == ["c"]
+    assert store.delete("a") and not store.delete("a")
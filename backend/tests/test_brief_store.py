@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pytest
+
+import brief_store
+import copywriter
+from brief_store import BriefStore, brief_id
+
+BRIEF = {"week_id": "2026-03-02", "keywords": ["legno"], "cta": {"day": "sun", "text": "Scrivici in DM."}}
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(brief_store, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+@pytest.fixture
+def store(tmp_path):
+    return BriefStore(tmp_path / "briefs.sqlite3", ttl_seconds=60)
+
+def test_save_is_idempotent_and_content_addressed(store):
+    bid = store.save(BRIEF, input_key="in-1")
+    assert bid == brief_id(dict(BRIEF)) == store.save(dict(BRIEF), input_key="in-2")
+    assert store.lookup("in-1") == store.lookup("in-2") == BRIEF
+    assert store.lookup("altro") is None
+    found = store.get(bid)
+    assert (found["week_brief_id"], found["week_brief"], found["pinned"]) == (bid, BRIEF, False)
+
+def test_unpinned_briefs_expire_and_can_be_bypassed(store, clock):
+    store.save(BRIEF, input_key="in")
+    assert store.lookup("in", include_unpinned=False) is None
+    clock.now += 61
+    assert store.lookup("in") is None
+
+def test_pinned_brief_never_expires_and_survives_bypass(store, clock):
+    bid = store.save(BRIEF, input_key="in")
+    assert store.pin(bid)
+    clock.now += 10 * 60
+    assert store.lookup("in") == BRIEF
+    assert store.lookup("in", include_unpinned=False) == BRIEF
+    assert store.pin(bid, False) and store.lookup("in") is None
+    assert not store.pin("sconosciuto")
+
+def test_invalidate_forgets_brief_and_inputs(store):
+    bid = store.save(BRIEF, input_key="in")
+    assert store.invalidate(bid)
+    assert store.get(bid) is None and store.lookup("in") is None
+    assert not store.invalidate(bid)
+
+def generate(tmp_path, **kw):
+    image = tmp_path / "oggetto_vaso_01.jpg"
+    image.write_bytes(b"vaso")
+    kw = {"goal": "far conoscere il laboratorio", "theme": "legno", "brand_name": "Bottega", "start_date": "2026-03-02", **kw}
+    return copywriter.generate_posts(images=[str(image)], n_posts=1, **kw)
+
+def test_generate_reuses_brief_for_same_inputs(mock_provider, tmp_path, monkeypatch):
+    llm = mock_provider()
+    monkeypatch.setattr(copywriter, "brief_store", BriefStore(tmp_path / "briefs.sqlite3"))
+
+    first = generate(tmp_path)
+    again = generate(tmp_path)
+    assert again["week_brief_id"] == first["week_brief_id"]
+    assert len(llm.calls("week_brief")) == 1
+    assert again["usage"]["totals"]["brief"]["cache_hits"] == 1
+
+    generate(tmp_path, start_date="2026-03-09")  # altra settimana: altro brief
+    assert len(llm.calls("week_brief")) == 2
+
+def test_bypass_regenerates_unless_pinned(mock_provider, tmp_path, monkeypatch):
+    llm = mock_provider()
+    store = BriefStore(tmp_path / "briefs.sqlite3")
+    monkeypatch.setattr(copywriter, "brief_store", store)
+
+    first = generate(tmp_path)
+    generate(tmp_path, use_cache=False)
+    assert len(llm.calls("week_brief")) == 2
+
+    store.pin(first["week_brief_id"])
+    pinned = generate(tmp_path, use_cache=False)
+    assert pinned["week_brief_id"] == first["week_brief_id"]
+    assert len(llm.calls("week_brief")) == 2
+
+def test_pin_endpoints(client, store, monkeypatch):
+    monkeypatch.setattr(copywriter, "brief_store", store)
+    bid = store.save(BRIEF)
+
+    assert client.put(f"/briefs/{bid}/pin").json() == {"week_brief_id": bid, "pinned": True}
+    assert client.get(f"/briefs/{bid}").json()["pinned"] is True
+    assert client.delete(f"/briefs/{bid}/pin").json()["pinned"] is False
+    assert client.delete(f"/briefs/{bid}").json() == {"deleted": bid}
+    assert client.get(f"/briefs/{bid}").status_code == 404
+    assert client.put(f"/briefs/{bid}/pin").status_code == 404
@@ -0,0 +1,84 @@
+import pytest
+
+import copywriter
+
+# mercoledì 4 marzo -> martedì 17 marzo 2026: settimana iniziale e finale parziali
+START, END = "2026-03-04", "2026-03-17"
+
+def make_images(tmp_path, **counts):
+    paths = []
+    for prefix, n in counts.items():
+        for i in range(n):
+            path = tmp_path / f"{prefix}_pezzo_{i:02d}.jpg"
+            path.write_bytes(f"{prefix}{i}".encode())
+            paths.append(str(path))
+    return paths
+
+def test_partial_first_and_last_weeks():
+    weeks = copywriter.build_calendar(START, END, n_posts=6)
+    assert [w["week_start"] for w in weeks] == ["2026-03-02", "2026-03-09", "2026-03-16"]
+    assert [[slot[0] for slot in w["schedule"]] for w in weeks] == [
+        ["wed", "thu", "fri", "sat"],
+        ["mon", "tue", "wed", "thu", "fri", "sat"],
+        ["mon", "tue"],
+    ]
+    assert weeks[0]["dates"] == ["2026-03-04", "2026-03-05", "2026-03-06", "2026-03-07"]
+    assert weeks[-1]["dates"] == ["2026-03-16", "2026-03-17"]
+
+def test_weeks_without_slots_are_dropped():
+    # Domenica 8: con 6 post a settimana la domenica non ha slot
+    weeks = copywriter.build_calendar("2026-03-08", "2026-03-10", n_posts=6)
+    assert [w["week_start"] for w in weeks] == ["2026-03-09"]
+    weeks = copywriter.build_calendar("2026-03-08", "2026-03-10", n_posts=7)
+    assert [w["dates"] for w in weeks] == [["2026-03-08"], ["2026-03-09", "2026-03-10"]]
+    assert weeks[0]["schedule"] == [copywriter.CTA_SLOT]
+
+def test_invalid_ranges():
+    with pytest.raises(ValueError, match="end_date"):
+        copywriter.build_calendar(END, START)
+    with pytest.raises(ValueError, match="at most"):
+        copywriter.build_calendar("2026-01-01", "2026-12-31")
+
+def test_plan_routes_images_over_the_whole_range(tmp_path):
+    images = make_images(tmp_path, oggetto=6, dettaglio=4, processo=2)
+    weeks = copywriter.plan_calendar(images, START, END, n_posts=6, theme="legno", strict_routing=True)
+
+    chosen = [p for w in weeks for p in w["chosen_images"]]
+    assert sorted(chosen) == sorted(images)  # nessuna immagine riusata tra settimane
+    for week in weeks:
+        assert [copywriter._infer_prefix(p) for p in week["chosen_images"]] == [
+            {"T1_OGGETTO": "oggetto", "T2_DETTAGLIO": "dettaglio", "T3_PROCESSO": "processo"}[slot[1]]
+            for slot in week["schedule"]
+        ]
+        assert len(week["angles"]) == len(week["subjects"]) == len(week["schedule"])
+    # L'angolo continua da una settimana all'altra
+    assert weeks[0]["prev_angle"] is None
+    assert weeks[1]["prev_angle"] == weeks[0]["angles"][-1]
+    assert weeks[0]["subjects"][0] == "pezzo"
+
+def test_plan_needs_one_image_per_slot(tmp_path):
+    images = make_images(tmp_path, oggetto=6, dettaglio=4, processo=1)
+    with pytest.raises(ValueError, match="12 slots but only 11 images"):
+        copywriter.plan_calendar(images, START, END, n_posts=6, theme="legno")
+
+def test_generate_calendar(mock_provider, tmp_path):
+    llm = mock_provider()
+    images = make_images(tmp_path, oggetto=6, dettaglio=4, processo=2)
+    out = copywriter.generate_calendar(
+        goal="far conoscere il laboratorio", theme="legno", images=images,
+        start_date=START, end_date=END, n_posts=6, brand_name="Bottega", max_concurrency=4,
+    )
+
+    assert (out["start_date"], out["end_date"], out["n_posts_per_week"]) == (START, END, 6)
+    weeks = out["weeks"]
+    assert [len(w["posts"]) for w in weeks] == [4, 6, 2]
+    for week in weeks:
+        assert week["week_brief"]["week_id"] == week["week_start"]
+        assert [p["day_name"] for p in week["posts"]] == [slot[0] for slot in week["schedule"]]
+        assert [p["template_id"] for p in week["posts"]] == [slot[1] for slot in week["schedule"]]
+    chosen = [p for w in weeks for p in w["chosen_images"]]
+    assert len(set(chosen)) == len(chosen) == 12
+
+    assert len(llm.calls("week_brief")) == 3 and len(llm.calls("post")) == 12
+    totals = out["usage"]["totals"]
+    assert totals["brief"]["calls"] == 3 and totals["post"]["calls"] == 12
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import copywriter
+import dedup
+from conftest import MockProvider
+from response_cache import ResponseCache
+
+# Caption del bench mock per lo slot 0 (keyword "legno")
+MOCK_CAPTION = "Un oggetto in legno sul banco di lavoro. La luce segue la superficie lisciata a mano."
+REWRITTEN = "Il ciotolo nasce da un tronco di noce. Ogni venatura resta visibile."
+
+class RewritingProvider(MockProvider):
+    """Bench mock whose correction calls return a different caption."""
+
+    def create(self, body):
+        resp = super().create(body)
+        if body not in self.calls("retry"):
+            return resp
+        post = json.loads(resp.text)
+        post["ig_caption_full"] = post["ig_caption_full"].replace(post["caption"], REWRITTEN)
+        post["caption"] = REWRITTEN
+        resp.text = json.dumps(post, ensure_ascii=False)
+        return resp
+
+def test_signature_similarity():
+    a = dedup.signature(MOCK_CAPTION)
+    assert dedup.similarity(a, dedup.signature(MOCK_CAPTION.upper())) == 1.0
+    assert dedup.similarity(a, dedup.signature(MOCK_CAPTION.replace("lisciata", "levigata"))) >= 0.8
+    assert dedup.similarity(a, dedup.signature(REWRITTEN)) < 0.3
+
+def test_archive_find_by_brand_and_post_key(tmp_path):
+    archive = dedup.CaptionArchive(tmp_path / "captions.sqlite3")
+    archive.add("bottega", MOCK_CAPTION, post_key="k1", template_id="T1_OGGETTO")
+    archive.add("altro", MOCK_CAPTION, post_key="k1")
+
+    (match,) = archive.find("bottega", MOCK_CAPTION.replace("lisciata", "levigata"))
+    assert match["caption"] == MOCK_CAPTION and match["template_id"] == "T1_OGGETTO"
+    assert match["similarity"] >= 0.8
+    assert archive.find("bottega", REWRITTEN) == []
+    assert archive.find("bottega", MOCK_CAPTION, exclude_post_key="k1") == []
+    assert archive.find("nuovo", MOCK_CAPTION) == []
+
+    archive.add("bottega", REWRITTEN, post_key="k1")  # stessa richiesta rigenerata: sostituisce
+    assert archive.count("bottega") == 1
+    assert archive.find("bottega", MOCK_CAPTION) == []
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    def enable():
+        store = dedup.CaptionArchive(tmp_path / "captions.sqlite3")
+        store.add("Bottega", MOCK_CAPTION, post_key="published")
+        monkeypatch.setattr(copywriter, "caption_archive", store)
+        return store
+    return enable
+
+def generate(tmp_path, **kw):
+    image = tmp_path / "oggetto_vaso_01.jpg"
+    image.write_bytes(b"vaso")
+    out = copywriter.generate_posts(
+        goal="far conoscere il laboratorio", theme="legno", images=[str(image)], n_posts=1,
+        brand_name="Bottega", start_date="2026-03-02", **kw,
+    )
+    return out["posts"][0]
+
+def test_duplicate_is_regenerated(mock_provider, archive, tmp_path):
+    llm = mock_provider(RewritingProvider)
+    store = archive()
+
+    post = generate(tmp_path)
+    assert post["caption"] == REWRITTEN
+    assert "near_duplicates" not in post
+    assert len(llm.calls("retry")) == 1
+    assert store.count("Bottega") == 2
+
+def test_duplicate_flagged_when_retry_is_still_similar(mock_provider, archive, tmp_path):
+    llm = mock_provider()
+    archive()
+
+    post = generate(tmp_path)
+    assert post["caption"] == MOCK_CAPTION
+    assert [d["caption"] for d in post["near_duplicates"]] == [MOCK_CAPTION]
+    assert len(llm.calls("retry")) == 1
+
+def test_flag_action_skips_the_retry(mock_provider, archive, tmp_path, monkeypatch):
+    llm = mock_provider()
+    archive()
+    monkeypatch.setattr(dedup, "ACTION", "flag")
+
+    post = generate(tmp_path)
+    assert post["near_duplicates"][0]["similarity"] == 1.0
+    assert llm.calls("retry") == []
+
+def test_cache_hits_are_checked(mock_provider, tmp_path, monkeypatch):
+    llm = mock_provider()
+    monkeypatch.setattr(copywriter, "response_cache", ResponseCache(tmp_path / "responses.sqlite3"))
+    store = dedup.CaptionArchive(tmp_path / "captions.sqlite3")
+    monkeypatch.setattr(copywriter, "caption_archive", store)
+
+    first = generate(tmp_path)
+    assert "near_duplicates" not in first
+    # La stessa richiesta dalla cache non è un duplicato di se stessa
+    assert generate(tmp_path) == first
+    assert len(llm.calls("post")) == 1
+
+    # Una caption simile archiviata dopo (da un'altra richiesta)
+    store.add("Bottega", MOCK_CAPTION, post_key="other")
+    monkeypatch.setattr(dedup, "ACTION", "flag")
+    flagged = generate(tmp_path)
+    assert len(llm.calls("post")) == 1
+    assert [d["caption"] for d in flagged["near_duplicates"]] == [MOCK_CAPTION]
+
+    # Con regenerate il post in cache non viene riusato
+    monkeypatch.setattr(dedup, "ACTION", "regenerate")
+    generate(tmp_path)
+    assert len(llm.calls("post")) == 2
+    assert len(llm.calls("retry")) == 1
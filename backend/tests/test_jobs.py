@@ -0,0 +1,67 @@
+import threading
+import time
+
+import jobs
+from jobs import JobProgress, JobRunner, JobStore
+
+def expire(store, job_id):
+    """Make a running job look orphaned (no heartbeat for longer than the lease)."""
+    conn = store.connect()
+    with conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ?", (time.time() - jobs.LEASE_SECONDS - 1, job_id))
+
+def test_stale_attempt_cannot_finish(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job_id = store.create({"n_posts": 1})
+    first = store.claim("w1")
+    expire(store, job_id)
+    second = store.claim("w2")
+    assert second["attempts"] == 2
+
+    # Il primo worker torna dopo aver perso il lease: niente scritture
+    assert not store.heartbeat(job_id, "w1", 1)
+    assert not store.finish(job_id, first["worker"], first["attempts"], result={"posts": ["old"]})
+    assert store.get(job_id)["status"] == jobs.RUNNING
+
+    assert store.finish(job_id, second["worker"], second["attempts"], result={"posts": ["new"]})
+    assert store.get(job_id)["result"] == {"posts": ["new"]}
+
+def test_orphan_over_max_attempts_fails(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job_id = store.create({})
+    for i in range(jobs.MAX_ATTEMPTS):
+        assert store.claim(f"w{i}")["job_id"] == job_id
+        expire(store, job_id)
+    assert store.claim("last") is None
+    job = store.get(job_id)
+    assert job["status"] == jobs.FAILED
+    assert job["attempts"] == jobs.MAX_ATTEMPTS
+
+def test_runner_heartbeats_while_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_SECONDS", 0.01)
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    beats = []
+    heartbeat = store.heartbeat
+    monkeypatch.setattr(store, "heartbeat", lambda *a: beats.append(a) or heartbeat(*a))
+    done = threading.Event()
+
+    def execute(request, progress: JobProgress):
+        time.sleep(0.1)
+        progress.post_ready(0, {})
+        done.set()
+        return {"ok": True}
+
+    runner = JobRunner(store, execute, total_slots=lambda r: 1, workers=1)
+    job_id = runner.submit({})
+    runner.start()
+    assert done.wait(5)
+    for _ in range(100):
+        if store.get(job_id)["status"] == jobs.DONE:
+            break
+        time.sleep(0.02)
+    runner.stop()
+
+    job = store.get(job_id)
+    assert job["status"] == jobs.DONE and job["result"] == {"ok": True}
+    assert job["progress"]["completed"] == [0]
+    assert len(beats) >= 3
@@ -0,0 +1,73 @@
+import io
+
+import pytest
+
+import derivatives
+from upload_store import UploadStore
+
+def _jpeg(color) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+def test_reindex_commits_blob_for_hand_copied_files(tmp_path):
+    indexed = []
+    store = UploadStore(tmp_path / "uploads", index_path=tmp_path / "uploads.sqlite3", on_index=indexed.append)
+    copied = store.root / "oggetto_a_01.jpg"
+    copied.write_bytes(b"not really a jpeg")
+
+    assert store.reindex() == 1
+    (row,) = store.list()
+    blob = store.blob_path(row["sha256"])
+    assert blob.read_bytes() == b"not really a jpeg"
+    assert copied.samefile(blob)
+    assert indexed == [row["sha256"]]
+
+    # Già allineato: nessun nuovo commit
+    assert store.reindex() == 0
+    assert indexed == [row["sha256"]]
+
+def test_reindex_collects_blob_of_rewritten_file(tmp_path):
+    collected = []
+    store = UploadStore(tmp_path / "uploads", index_path=tmp_path / "uploads.sqlite3", on_collect=collected.append)
+    alias = store.root / "dettaglio_b_01.jpg"
+    alias.write_bytes(b"first")
+    store.reindex()
+    old = store.list()[0]["sha256"]
+
+    alias.unlink()
+    alias.write_bytes(b"second version")
+    assert store.reindex() == 1
+    new = store.list()[0]["sha256"]
+    assert new != old
+    assert not store.blob_path(old).exists()
+    assert alias.samefile(store.blob_path(new))
+    assert collected == [old]
+
+def test_media_serves_uploaded_and_reindexed_files(client):
+    import main
+
+    uploaded, copied = _jpeg("red"), _jpeg("blue")
+    res = client.post("/upload", files={"file": ("oggetto_media_01.jpg", uploaded, "image/jpeg")})
+    assert res.status_code == 200
+    upload_urls = res.json()["derivatives"]
+
+    (main.UPLOAD_DIR / "storia_media_01.jpg").write_bytes(copied)
+    main.upload_store.reindex()
+    (row,) = main.upload_store.catalog.get_many(["storia_media_01.jpg"]).values()
+    copied_urls = derivatives.media_urls(row["sha256"])
+
+    for urls, content in ((upload_urls, uploaded), (copied_urls, copied)):
+        for kind, url in urls.items():
+            res = client.get(url)
+            assert res.status_code == 200, url
+            assert res.headers["content-type"].startswith("image/")
+            if kind == derivatives.ORIGINAL:
+                assert res.content == content
+            cached = client.get(url, headers={"If-None-Match": res.headers["etag"]})
+            assert cached.status_code == 304
+            assert cached.headers["etag"] == res.headers["etag"]
+
+    for name in ("oggetto_media_01.jpg", "storia_media_01.jpg"):
+        main.upload_store.delete(name)
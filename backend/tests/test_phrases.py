@@ -0,0 +1,81 @@
+import pytest
+
+import copywriter
+import phrases
+from phrases import PhraseMatcher
+
+def spans(matcher, text):
+    return [(m.phrase, text[m.start:m.end]) for m in matcher.scan(text)]
+
+def test_overlapping_phrases_all_reported_in_order():
+    matcher = PhraseMatcher(["a mano", "fatto a mano", "mano", "fatto"])
+    text = "Tutto fatto a mano."
+    hits = matcher.scan(text)
+    assert [(m.phrase, m.start, m.end) for m in hits] == [
+        ("fatto a mano", 6, 18),
+        ("fatto", 6, 11),
+        ("a mano", 12, 18),
+        ("mano", 14, 18),
+    ]
+
+def test_offsets_point_into_original_text():
+    matcher = PhraseMatcher(["qualita unica"])
+    text = "  La nostra Qualità \n  UNICA, sempre."
+    (hit,) = matcher.scan(text, field="caption")
+    assert text[hit.start:hit.end] == "Qualità \n  UNICA"
+    assert hit.field == "caption"
+    assert str(hit) == f"'qualita unica' in caption [{hit.start}:{hit.end}]"
+
+def test_accent_case_and_punctuation_folding():
+    matcher = PhraseMatcher(["perché no", "l'unico", "STRASSE"])
+    assert spans(matcher, "E PERCHÉ NO?") == [("perché no", "PERCHÉ NO")]
+    # Accento come carattere combinante separato: incluso nel match
+    assert spans(matcher, "e perche\u0301 no") == [("perché no", "perche\u0301 no")]
+    assert spans(matcher, "È l’unico pezzo") == [("l'unico", "l’unico")]
+    assert spans(matcher, "in der Straße") == [("STRASSE", "Straße")]
+
+def test_whole_words_only():
+    matcher = PhraseMatcher(["unico", "5 euro", "sconto"])
+    assert matcher.scan("un unicorno") == []
+    assert matcher.scan("prezzo 15 euro") == []
+    assert matcher.scan("scontobello") == []
+    assert spans(matcher, "(sconto) unico!") == [("sconto", "sconto"), ("unico", "unico")]
+    assert spans(matcher, "5 euro") == [("5 euro", "5 euro")]
+
+def test_duplicate_and_empty_phrases_are_skipped():
+    matcher = PhraseMatcher(["Sconto", "sconto", "  ", "SCONTO"])
+    assert len(matcher) == 1
+    assert spans(matcher, "sconto") == [("Sconto", "sconto")]
+    assert phrases.prompt_phrases(["Sconto", "sconto", "promo", "offerta"], limit=2) == ["Sconto", "promo"]
+
+def test_matcher_for_is_cached():
+    assert phrases.matcher_for(["a", "b"]) is phrases.matcher_for(["a", "b"])
+    assert phrases.matcher_for(["a", "b"]) is not phrases.matcher_for(["b", "a"])
+
+def test_scan_post_fields():
+    matcher = PhraseMatcher(["promo"])
+    post = {"caption": "Niente promo.", "title": "Promo", "content": {"alt_text": "Un vaso."}}
+    assert [(m.field, m.start) for m in matcher.scan_post(post)] == [("caption", 7), ("title", 0)]
+
+def test_validate_post_rejects_banned_phrase():
+    brief = {"keywords": ["legno"], "cta": {"day": "sun", "text": "Scrivici in DM."}}
+    specs = copywriter.build_template_specs("Bottega", "")
+    caption = "Un vaso in legno. Ultimi pezzi in Offerta speciale."
+    post = {
+        "template_id": "T1_OGGETTO",
+        "day_name": "mon",
+        "title": None,
+        "caption": caption,
+        "keywords_used": ["legno"],
+        "ig_caption_full": caption + "\n#handmade",
+        "content": {"hashtags": ["#handmade"], "alt_text": "Un vaso."},
+    }
+    args = ("T1_OGGETTO", "mon", brief, False, specs, ["#handmade"])
+    copywriter.validate_post(post, *args)  # senza blacklist è valido
+
+    banned = copywriter.banned_matcher(["offerta speciale"])
+    with pytest.raises(ValueError, match=r"banned phrases: 'offerta speciale' in caption \[34:50\]"):
+        copywriter.validate_post(post, *args, banned=banned)
+    # Non è un errore meccanico: repair_post non lo corregge
+    with pytest.raises(ValueError, match="banned phrases"):
+        copywriter.validate_or_repair(post, *args, banned=banned)
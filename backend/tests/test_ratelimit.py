@@ -0,0 +1,100 @@
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+def limiter(clock, **kw):
+    kw.setdefault("initial_concurrency", 4)
+    kw.setdefault("max_concurrency", 8)
+    return RateLimiter("test", clock=clock, **kw)
+
+def call(lim, clock, latency=None, **kw):
+    """One acquire/release pair taking `latency` seconds of stub time."""
+    assert lim._wait_time(clock.now, 100) == 0.0  # il clock è fermo: acquire non deve aspettare
+    charged = lim.acquire(100)
+    clock.now += latency or 0.0
+    lim.release(charged, latency=latency, **kw)
+
+def test_fast_calls_increase_additively(clock):
+    lim = limiter(clock)
+    call(lim, clock, latency=1.0)
+    assert lim.limit == pytest.approx(4.25)
+    for _ in range(200):
+        call(lim, clock, latency=1.0)
+    assert lim.limit == 8.0  # mai oltre max_concurrency
+
+def test_429_halves_once_per_cooldown(clock):
+    lim = limiter(clock)
+    call(lim, clock, headers={"retry-after-ms": "500"}, rate_limited=True)
+    assert lim.limit == 2.0
+    assert lim.blocked_until == pytest.approx(clock.now + 0.5)
+
+    clock.now = lim.blocked_until
+    call(lim, clock, rate_limited=True)
+    assert lim.limit == 2.0  # stessa raffica: una sola riduzione
+
+    clock.now += ratelimit.DECREASE_COOLDOWN
+    call(lim, clock, rate_limited=True)
+    assert lim.limit == 1.0
+    clock.now += ratelimit.DECREASE_COOLDOWN
+    call(lim, clock, rate_limited=True)
+    assert lim.limit == 1.0  # mai sotto min_concurrency
+
+def test_slow_calls_decrease(clock):
+    lim = limiter(clock)
+    for _ in range(5):
+        call(lim, clock, latency=1.0)
+    before = lim.limit
+    for _ in range(10):
+        call(lim, clock, latency=10.0)
+    assert lim.limit < before * ratelimit.LATENCY_DECREASE_FACTOR
+
+def test_rpm_bucket_refills_with_clock(clock):
+    lim = limiter(clock, rpm=60)
+    for _ in range(60):
+        call(lim, clock)
+    assert lim._wait_time(clock.now, 1) == pytest.approx(1.0)
+    clock.now += 1.0
+    lim.requests.refill(clock.now)
+    assert lim._wait_time(clock.now, 1) == 0.0
+
+def test_latency_floor_is_per_call_kind(clock):
+    lim = limiter(clock)
+    for _ in range(5):
+        call(lim, clock, latency=0.5, kind="retry")
+    before = lim.limit
+    # Post con immagine: più lenti dei retry solo testo, ma non congestionati
+    for _ in range(20):
+        call(lim, clock, latency=4.0, kind="post")
+    assert lim.limit > before
+    assert lim.snapshot()["latency"]["retry"]["floor"] == 0.5
+
+def test_latency_floor_drifts_up(clock):
+    lim = limiter(clock, max_concurrency=64)
+    call(lim, clock, latency=1.0, kind="post")
+    # Latenza stabilmente più alta per mezz'ora: diventa il nuovo riferimento
+    for _ in range(180):
+        call(lim, clock, latency=10.0, kind="post")
+    assert lim.latency["post"]["floor"] > 10.0 / ratelimit.LATENCY_TOLERANCE
+    before = lim.limit
+    for _ in range(10):
+        call(lim, clock, latency=10.0, kind="post")
+    assert lim.limit > before
+
+def test_call_kind():
+    image = {"type": "input_image", "image_url": "data:image/jpeg;base64,AAAA"}
+    text = {"type": "input_text", "text": "..."}
+    assert ratelimit.call_kind({"text": {"format": {"name": "week_brief"}}, "input": []}) == "brief"
+    assert ratelimit.call_kind({"input": [{"role": "user", "content": [text, image]}]}) == "post"
+    assert ratelimit.call_kind({"input": [{"role": "assistant", "content": "{}"}, {"role": "user", "content": [text]}]}) == "retry"
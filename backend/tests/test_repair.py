@@ -0,0 +1,128 @@
+import pytest
+
+import copywriter
+
+BRIEF = {
+    "week_id": "2026-03-02",
+    "keywords": ["legno", "mani", "luce"],
+    "cta": {"day": "sun", "text": "Scrivici in DM per informazioni."},
+}
+SPECS = copywriter.build_template_specs("Bottega", "Fatto a mano.")
+REQUIRED = ["#handmade", "#bottega"]
+
+def post(**kw):
+    caption = kw.pop("caption", "Un vaso in legno sul banco. La luce segue la venatura.")
+    tags = kw.pop("hashtags", REQUIRED + ["#legno"])
+    return {
+        "template_id": "T1_OGGETTO",
+        "day_name": "mon",
+        "title": None,
+        "caption": caption,
+        "keywords_used": ["legno"],
+        "ig_caption_full": caption + "\n" + " ".join(tags),
+        "content": {"hashtags": tags, "alt_text": "Un vaso.", "visual_description": "Vaso chiaro."},
+        **kw,
+    }
+
+def check(p, template_id="T1_OGGETTO", day_name="mon", cta_enabled=False):
+    """validate_or_repair on `p`; returns (result, REPAIR_STATS delta)."""
+    before = copywriter.repair_stats()
+    out = copywriter.validate_or_repair(p, template_id, day_name, BRIEF, cta_enabled, SPECS, REQUIRED)
+    after = copywriter.repair_stats()
+    return out, {k: after[k] - before[k] for k in after}
+
+def test_valid_post_is_returned_unchanged():
+    p = post()
+    out, delta = check(p)
+    assert out is p
+    assert delta == {"validation_failures": 0, "repaired_locally": 0, "model_retries": 0}
+
+def test_missing_required_hashtags_and_stale_full_caption():
+    p = post(hashtags=["#legno", "#legno"])
+    p["ig_caption_full"] = p["caption"]
+    out, delta = check(p)
+    assert out["content"]["hashtags"] == ["#handmade", "#bottega", "#legno"]
+    assert out["ig_caption_full"] == out["caption"] + "\n#handmade #bottega #legno"
+    assert delta == {"validation_failures": 1, "repaired_locally": 1, "model_retries": 0}
+
+def test_emoji_and_long_title_are_trimmed():
+    p = post(
+        template_id="T4_STORIA",
+        title="La storia 🌳 della nostra bottega",
+        caption="Un vaso in legno 🌳 sul banco. La luce segue la venatura.",
+    )
+    out, delta = check(p, template_id="T4_STORIA")
+    assert out["title"] == "La storia della"
+    assert out["caption"] == "Un vaso in legno sul banco. La luce segue la venatura."
+    assert delta["repaired_locally"] == 1
+
+def test_title_dropped_and_slot_fields_restored():
+    p = post(template_id="T2_DETTAGLIO", day_name="tue", title="Legno")
+    out, delta = check(p)
+    assert (out["template_id"], out["day_name"], out["title"]) == ("T1_OGGETTO", "mon", None)
+    assert delta["repaired_locally"] == 1
+
+def test_cta_moved_to_last_line():
+    cta = BRIEF["cta"]["text"]
+    p = post(caption=f"{cta}\nUn vaso in legno sul banco.", keywords_used=["resina"])
+    out, delta = check(p, day_name="sun", cta_enabled=True)
+    assert out["caption"].splitlines() == ["Un vaso in legno sul banco.", cta]
+    assert out["keywords_used"] == ["legno"]  # keyword fuori dal brief: ripresa dalla caption
+    assert delta["repaired_locally"] == 1
+
+def test_unrepairable_post_raises_original_error():
+    p = post(caption="Uno. Due. Tre. Quattro.")
+    before = copywriter.repair_stats()
+    with pytest.raises(ValueError, match="caption > 3 sentences"):
+        copywriter.validate_or_repair(p, "T1_OGGETTO", "mon", BRIEF, False, SPECS, REQUIRED)
+    after = copywriter.repair_stats()
+    assert after["validation_failures"] - before["validation_failures"] == 1
+    assert after["repaired_locally"] == before["repaired_locally"]
+
+def test_repair_post_does_not_touch_input():
+    p = post(hashtags=[])
+    copywriter.repair_post(p, "T1_OGGETTO", "mon", BRIEF, False, SPECS, REQUIRED)
+    assert p["content"]["hashtags"] == []
+
+def campaign(tmp_path, n_posts):
+    images = []
+    for name in ("oggetto_a_01", "dettaglio_b_01", "processo_c_01", "storia_d_01", "oggetto_e_02", "dettaglio_f_02"):
+        path = tmp_path / f"{name}.jpg"
+        path.write_bytes(name.encode())
+        images.append(str(path))
+    return copywriter.generate_posts(
+        goal="far conoscere il laboratorio", theme="legno", images=images, n_posts=n_posts,
+        brand_name="Bottega", start_date="2026-03-02", max_concurrency=1,
+    )
+
+def test_locally_repairable_posts_skip_the_retry(mock_provider, tmp_path):
+    llm = mock_provider(invalid_rate=1.0)
+    before = copywriter.repair_stats()
+    out = campaign(tmp_path, 3)
+    after = copywriter.repair_stats()
+
+    assert len(out["posts"]) == 3
+    assert all("#handmade" in p["content"]["hashtags"] for p in out["posts"])
+    assert llm.calls("retry") == []
+    assert after["repaired_locally"] - before["repaired_locally"] == 3
+    assert after["model_retries"] == before["model_retries"]
+
+def test_unrepairable_posts_fall_back_to_text_only_retry(mock_provider, tmp_path):
+    llm = mock_provider(retry_rate=1.0)
+    before = copywriter.repair_stats()
+    out = campaign(tmp_path, 3)
+    after = copywriter.repair_stats()
+
+    assert [copywriter.count_sentences(p["caption"]) <= 3 for p in out["posts"]] == [True] * 3
+    assert len(llm.calls("post")) == 3 and len(llm.calls("retry")) == 3
+    assert after["model_retries"] - before["model_retries"] == 3
+    assert after["validation_failures"] - before["validation_failures"] == 3
+    assert out["usage"]["totals"]["retry"]["calls"] == 3
+
+def test_repair_stats_endpoint(mock_provider, tmp_path, client):
+    before = client.get("/repair/stats").json()
+    mock_provider(retry_rate=1.0)
+    campaign(tmp_path, 1)
+    after = client.get("/repair/stats").json()
+    assert set(after) == {"validation_failures", "repaired_locally", "model_retries"}
+    assert after["model_retries"] - before["model_retries"] == 1
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+import copywriter
+import response_cache
+from response_cache import ResponseCache, fingerprint
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+def test_fingerprint_is_stable():
+    assert fingerprint(a=1, b={"x": [1, 2], "y": "è"}) == fingerprint(b={"y": "è", "x": [1, 2]}, a=1)
+    assert fingerprint(a=1) != fingerprint(a=2)
+
+def test_hit_miss_and_stats(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite3")
+    assert cache.get("k") is None
+    cache.put("k", {"caption": "Vaso in legno."})
+    assert cache.get("k") == {"caption": "Vaso in legno."}
+    cache.invalidate("k")
+    assert cache.get("k") is None
+
+    stats = cache.snapshot()
+    assert {k: stats[k] for k in ("hits", "misses", "writes", "entries")} == {"hits": 1, "misses": 2, "writes": 1, "entries": 0}
+    assert stats["hit_rate"] == round(1 / 3, 4)
+
+def test_expired_entries_miss(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "responses.sqlite3", ttl_seconds=60)
+    cache.put("k", {"v": 1})
+    clock.now += 61
+    assert cache.get("k") is None
+    assert cache.evict() == 1
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "responses.sqlite3", max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"key": key})
+        clock.now += response_cache.TOUCH_INTERVAL + 1
+    assert cache.get("a") == {"key": "a"}  # "a" torna recente
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+def generate(tmp_path, **kw):
+    image = tmp_path / "oggetto_vaso_01.jpg"
+    image.write_bytes(b"vaso")
+    kw = {"goal": "far conoscere il laboratorio", "theme": "legno", "brand_name": "Bottega", **kw}
+    return copywriter.generate_posts(images=[str(image)], n_posts=1, start_date="2026-03-02", **kw)
+
+def test_generate_reuses_validated_posts(mock_provider, tmp_path, monkeypatch):
+    llm = mock_provider()
+    cache = ResponseCache(tmp_path / "responses.sqlite3")
+    monkeypatch.setattr(copywriter, "response_cache", cache)
+
+    first = generate(tmp_path)
+    again = generate(tmp_path)
+    assert again["posts"] == first["posts"]
+    assert len(llm.calls("post")) == 1
+    assert again["usage"]["totals"]["post"] == {
+        "calls": 0, "cache_hits": 1, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cached_ratio": 0.0,
+    }
+
+    # Input diverso (tema => soggetto e istruzioni): miss
+    generate(tmp_path, theme="noce", subject_from_file=False)
+    assert len(llm.calls("post")) == 2
+
+def test_bypass_regenerates_and_replaces(mock_provider, tmp_path, monkeypatch):
+    llm = mock_provider()
+    cache = ResponseCache(tmp_path / "responses.sqlite3")
+    monkeypatch.setattr(copywriter, "response_cache", cache)
+
+    generate(tmp_path)
+    writes = cache.snapshot()["writes"]
+    generate(tmp_path, use_cache=False)
+    assert len(llm.calls("post")) == 2
+    assert cache.snapshot()["writes"] == writes + 1
+    generate(tmp_path)
+    assert len(llm.calls("post")) == 2
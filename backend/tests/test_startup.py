@@ -0,0 +1,45 @@
+import importlib
+
+import pytest
+
+import copywriter
+import storage
+
+# Store abilitati all'avvio di main.py, tutti con il path di default
+INITS = ["init_response_cache", "init_brief_store", "init_caption_archive", "init_campaign_archive", "init_brand_store"]
+# Store che non hanno un path di default per costruzione
+NEEDS_ARGS = {"UploadCatalog"}  # path e cartella li passa UploadStore
+STORE_MODULES = ["archive", "brands", "brief_store", "dedup", "jobs", "response_cache", "upload_store"]
+
+def _subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+@pytest.mark.parametrize("name", INITS)
+def test_copywriter_init_with_defaults(name, monkeypatch):
+    attr = {"init_caption_archive": "caption_archive", "init_campaign_archive": "campaign_archive"}.get(
+        name, name[len("init_"):]
+    )
+    monkeypatch.setattr(copywriter, attr, None)  # ripristina il global dopo il test
+    store = getattr(copywriter, name)()
+    assert getattr(copywriter, attr) is store
+    assert store.path.parent == storage.DATA_DIR
+
+def test_every_store_opens_with_default_path():
+    for module in STORE_MODULES:
+        importlib.import_module(module)
+    stores = list(_subclasses(storage.SQLiteStore))
+    assert stores
+    for cls in stores:
+        if cls.__name__ in NEEDS_ARGS:
+            continue
+        store = cls()
+        assert store.path.parent == storage.DATA_DIR, cls.__name__
+
+def test_app_startup(client):
+    import main
+
+    assert client.get("/").status_code == 200
+    assert client.get("/archive/search", params={"q": "legno"}).json() == {"results": [], "count": 0}
+    assert client.get("/brands").status_code == 200
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import io
+import os
+import sqlite3
+
+import pytest
+
+from upload_store import UploadCatalog, UploadStore
+
+@pytest.fixture
+def collected():
+    return []
+
+@pytest.fixture
+def store(tmp_path, collected):
+    return UploadStore(tmp_path / "uploads", index_path=tmp_path / "uploads.sqlite3", on_collect=collected.append)
+
+def save(store, filename, data, brand=None):
+    stream = io.BytesIO(data)
+
+    async def read(n):
+        return stream.read(n)
+    return asyncio.run(store.save(filename, read, brand=brand))
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+def test_same_content_is_stored_once(store):
+    first = save(store, "oggetto_a_01.jpg", b"vaso")
+    second = save(store, "oggetto_b_01.jpg", b"vaso")
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert first["sha256"] == second["sha256"] == sha(b"vaso")
+
+    blob = store.blob_path(sha(b"vaso"))
+    assert blob.read_bytes() == b"vaso"
+    assert blob.stat().st_nlink == 3  # blob + due alias
+    assert (store.root / "oggetto_a_01.jpg").samefile(blob)
+    assert (store.root / "oggetto_b_01.jpg").samefile(blob)
+    assert list(store.tmp_dir.iterdir()) == []
+
+def test_reupload_under_same_name_relinks_and_collects(store, collected):
+    save(store, "oggetto_a_01.jpg", b"prima")
+    save(store, "oggetto_a_01.jpg", b"dopo")
+    alias = store.root / "oggetto_a_01.jpg"
+    assert alias.read_bytes() == b"dopo"
+    assert alias.samefile(store.blob_path(sha(b"dopo")))
+    assert not store.blob_path(sha(b"prima")).exists()
+    assert collected == [sha(b"prima")]
+    assert [r["sha256"] for r in store.list()] == [sha(b"dopo")]
+
+def test_blob_kept_while_another_alias_uses_it(store, collected):
+    save(store, "oggetto_a_01.jpg", b"vaso")
+    save(store, "oggetto_b_01.jpg", b"vaso")
+    save(store, "oggetto_a_01.jpg", b"altro")  # relink: il blob resta per b
+    assert store.blob_path(sha(b"vaso")).exists()
+    assert collected == []
+
+def test_delete_collects_orphan_blob(store, collected):
+    save(store, "oggetto_a_01.jpg", b"vaso", brand="bottega")
+    save(store, "oggetto_b_01.jpg", b"vaso")
+    blob = store.blob_path(sha(b"vaso"))
+
+    assert store.delete("oggetto_a_01.jpg")
+    assert blob.exists() and collected == []
+    assert store.delete("oggetto_b_01.jpg")
+    assert not blob.exists()
+    assert collected == [sha(b"vaso")]
+    assert store.list() == []
+    assert not store.delete("oggetto_b_01.jpg")
+
+@pytest.mark.parametrize("filename", ["", ".objects", ".lock"])
+def test_invalid_names_are_rejected(store, filename):
+    with pytest.raises(ValueError):
+        save(store, filename, b"x")
+    with pytest.raises(ValueError):
+        store.delete(filename)
+
+def test_catalog_entry(store):
+    entry = save(store, "dir/oggetto_vaso_01.jpg", b"vaso", brand="bottega")
+    assert entry["filename"] == "oggetto_vaso_01.jpg"  # solo il nome, mai un path
+    (row,) = store.list()
+    assert {k: row[k] for k in ("filename", "sha256", "size", "prefix", "brand")} == {
+        "filename": "oggetto_vaso_01.jpg", "sha256": sha(b"vaso"), "size": 4, "prefix": "oggetto", "brand": "bottega",
+    }
+
+def test_workers_share_the_catalog(store, tmp_path):
+    other = UploadStore(store.root, index_path=tmp_path / "uploads.sqlite3")  # altro worker
+    save(store, "oggetto_a_01.jpg", b"vaso")
+    assert [r["filename"] for r in other.list()] == ["oggetto_a_01.jpg"]
+    assert other.delete("oggetto_a_01.jpg")
+    assert store.list() == []
+    assert not store.blob_path(sha(b"vaso")).exists()
+
+def test_reindex_tracks_files_changed_on_disk(store, collected):
+    save(store, "oggetto_a_01.jpg", b"vaso")
+    save(store, "oggetto_b_01.jpg", b"coppa")
+    assert store.reindex() == 0
+
+    # Rimosso a mano
+    (store.root / "oggetto_b_01.jpg").unlink()
+    # Riscritto con la stessa dimensione: cambia solo l'mtime, va ri-hashato
+    alias = store.root / "oggetto_a_01.jpg"
+    alias.unlink()
+    alias.write_bytes(b"broc")
+    st = alias.stat()
+    os.utime(alias, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    # Copiato a mano; i file non immagine restano fuori
+    (store.root / "dettaglio_c_01.png").write_bytes(b"piatto")
+    (store.root / "note.txt").write_text("x")
+
+    assert store.reindex() == 3
+    rows = {r["filename"]: r for r in store.list()}
+    assert set(rows) == {"oggetto_a_01.jpg", "dettaglio_c_01.png"}
+    assert rows["oggetto_a_01.jpg"]["sha256"] == sha(b"broc")
+    assert rows["dettaglio_c_01.png"]["prefix"] == "dettaglio"
+    assert sorted(collected) == sorted([sha(b"vaso"), sha(b"coppa")])  # rimossi e riscritti: blob raccolti
+    assert set(store.objects_dir.glob("??/*")) == {store.blob_path(sha(b"broc")), store.blob_path(sha(b"piatto"))}
+
+    # Solo touch: riga aggiornata, nessun cambio
+    os.utime(alias, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    assert store.reindex() == 0
+
+def test_catalog_columns_added_to_old_index(tmp_path):
+    index = tmp_path / "uploads.sqlite3"
+    conn = sqlite3.connect(index)
+    conn.execute(
+        "CREATE TABLE uploads (filename TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, uploaded_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO uploads VALUES ('oggetto_a_01.jpg', 'x', 1, 0)")
+    conn.commit()
+    conn.close()
+
+    store = UploadStore(tmp_path / "uploads", index_path=index)
+    (row,) = store.list()
+    assert set(UploadCatalog.COLUMNS) <= set(row)
+    assert row["template_id"] is None
+    # Riga di una versione precedente, file sparito: reindex la rimuove
+    assert store.reindex() == 1 and store.list() == []
+
+def test_catalog_pages_and_filters(tmp_path):
+    templates = {"oggetto": "T1_OGGETTO", "dettaglio": "T2_DETTAGLIO"}
+    store = UploadStore(
+        tmp_path / "uploads", index_path=tmp_path / "uploads.sqlite3",
+        template_of=lambda name: templates.get(name.split("_")[0], "unknown"),
+    )
+    names = ["oggetto_a_01.jpg", "dettaglio_b_01.jpg", "oggetto_c_01.jpg", "vaso.jpg", "oggetto_d_01.jpg"]
+    for i, name in enumerate(names):
+        save(store, name, name.encode(), brand="bottega" if i % 2 == 0 else "altro")
+
+    def pages(**filters):
+        out, cursor = [], None
+        while True:
+            rows = store.list(limit=2, cursor=cursor, **filters)
+            if not rows:
+                return out
+            out.append([r["filename"] for r in rows])
+            cursor = rows[-1]["filename"]
+
+    assert pages() == [["dettaglio_b_01.jpg", "oggetto_a_01.jpg"], ["oggetto_c_01.jpg", "oggetto_d_01.jpg"], ["vaso.jpg"]]
+    assert pages(template_id="T1_OGGETTO") == [["oggetto_a_01.jpg", "oggetto_c_01.jpg"], ["oggetto_d_01.jpg"]]
+    assert pages(prefix="") == [["vaso.jpg"]]
+    assert pages(brand="altro") == [["dettaglio_b_01.jpg", "vaso.jpg"]]
+    assert pages(template_id="T1_OGGETTO", brand="bottega") == [["oggetto_a_01.jpg", "oggetto_c_01.jpg"], ["oggetto_d_01.jpg"]]
+    assert store.list(template_id="unknown")[0]["filename"] == "vaso.jpg"
+
+    outside = str(tmp_path / "oggetto_a_01.jpg")
+    found = store.catalog.lookup([str(store.root / "vaso.jpg"), outside, str(store.root / "manca.jpg")])
+    assert list(found) == [str(store.root / "vaso.jpg")]
+
+def test_uploads_endpoint_pagination(client):
+    import main
+
+    names = [f"dettaglio_pagina_{i:02d}.jpg" for i in range(5)]
+    for name in names:
+        res = client.post(
+            "/upload", files={"file": (name, name.encode(), "image/jpeg")}, data={"brand": "paginazione"}
+        )
+        assert res.status_code == 200
+
+    seen, cursor = [], None
+    while True:
+        params = {"brand": "paginazione", "prefix": "DETTAGLIO", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/uploads", params=params).json()
+        seen.append([f["filename"] for f in body["files"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [names[:2], names[2:4], names[4:]]
+    entry = client.get("/uploads", params={"brand": "paginazione", "limit": 1}).json()["files"][0]
+    assert entry["inferred_template"] == "T2_DETTAGLIO"
+    assert entry["path"] == f"/uploads/{names[0]}"
+
+    for name in names:
+        main.upload_store.delete(name)
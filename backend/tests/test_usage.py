@@ -0,0 +1,34 @@
+import copywriter
+import providers
+
+def test_record_usage_appends_counts_and_meta():
+    usage = []
+    resp = providers.Completion("{}", {"input_tokens": 1200, "output_tokens": 300, "cached_tokens": 1024})
+    copywriter.record_usage(usage, resp, call="post", slot_index=2, image=True)
+    copywriter.record_usage(None, resp, call="post")  # non raccoglie: nessun errore
+    assert usage == [{
+        "call": "post", "slot_index": 2, "image": True,
+        "input_tokens": 1200, "output_tokens": 300, "cached_tokens": 1024,
+    }]
+
+def test_summarize_usage_totals_per_call_kind():
+    usage = [
+        {"call": "brief", "cache_hit": True},
+        {"call": "post", "slot_index": 0, "input_tokens": 2000, "output_tokens": 400, "cached_tokens": 1536},
+        {"call": "post", "slot_index": 1, "input_tokens": 2000, "output_tokens": 350, "cached_tokens": 0},
+        {"call": "post", "slot_index": 2, "cache_hit": True},
+        {"call": "retry", "slot_index": 1, "input_tokens": 900, "output_tokens": 300, "cached_tokens": 0},
+    ]
+    totals = copywriter.summarize_usage(usage)
+
+    assert totals["brief"] == {
+        "calls": 0, "cache_hits": 1, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cached_ratio": 0.0,
+    }
+    assert totals["post"] == {
+        "calls": 2, "cache_hits": 1, "input_tokens": 4000, "output_tokens": 750, "cached_tokens": 1536,
+        "cached_ratio": 0.384,
+    }
+    assert totals["retry"]["calls"] == 1 and totals["retry"]["cached_ratio"] == 0.0
+
+def test_summarize_usage_empty():
+    assert copywriter.summarize_usage([]) == {}
@@ -0,0 +1,377 @@
+"""
+Content-addressed upload store.
+
+Ogni upload viene scritto a chunk (senza bloccare l'event loop) in un file
+temporaneo, calcolando lo SHA-256 durante la scrittura. Il contenuto finisce
+una sola volta in uploads/.objects/<sha[:2]>/<sha>; il nome originale del file
+resta in uploads/<filename> come hard link al blob, così StaticFiles,
+_infer_prefix e i path /uploads/<filename> continuano a funzionare.
+
+Ricaricare la stessa cartella di foto non scrive nulla di nuovo su disco.
+
+Con più worker: blob e alias arrivano al loro path solo con rename atomici
+(nessun processo vede un file parziale), commit e cancellazioni sono
+serializzati da un file lock (un blob non viene raccolto mentre un altro
+processo ci sta linkando un alias) e l'elenco degli upload sta in un
+catalogo SQLite condiviso (UploadCatalog), aggiornato dopo che l'alias è al
+suo posto.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import images
+from storage import DATA_DIR, SQLiteStore, file_lock
+
+CHUNK_SIZE = 1024 * 1024
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+def filename_prefix(filename: str) -> str:
+    """Routing prefix of a filename ('oggetto_vaso.jpg' -> 'oggetto'), '' if none."""
+    stem = Path(filename).stem.lower()
+    return stem.split("_", 1)[0].strip() if "_" in stem else ""
+
+class UploadCatalog(SQLiteStore):
+    """One row per upload alias, shared by every worker process.
+
+    Mantenuto da UploadStore su upload e delete (e da reindex per i file
+    copiati a mano): l'elenco, i filtri e il routing delle immagini non
+    toccano più il filesystem.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS uploads (
+        filename TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        uploaded_at REAL NOT NULL
+    );
+    """
+    # Colonne aggiunte dopo la prima versione dell'indice (ALTER su db esistenti)
+    COLUMNS = {
+        "prefix": "TEXT",
+        "template_id": "TEXT",
+        "brand": "TEXT",
+        "width": "INTEGER",
+        "height": "INTEGER",
+        "mtime_ns": "INTEGER",  # reindex: stessa size ma mtime diverso => file riscritto, va ri-hashato
+    }
+    INDEXES = """
+    CREATE INDEX IF NOT EXISTS uploads_template ON uploads(template_id, filename);
+    CREATE INDEX IF NOT EXISTS uploads_prefix ON uploads(prefix, filename);
+    CREATE INDEX IF NOT EXISTS uploads_brand ON uploads(brand, filename);
+    CREATE INDEX IF NOT EXISTS uploads_sha256 ON uploads(sha256);
+    """
+    FIELDS = ("filename", "sha256", "size", "uploaded_at", *COLUMNS)
+
+    def __init__(self, path: Path, root: Path):
+        super().__init__(path)
+        self.root = Path(root)
+        conn = self.connect()
+        with conn:
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(uploads)")}
+            for name, kind in self.COLUMNS.items():
+                if name not in existing:
+                    try:
+                        conn.execute(f"ALTER TABLE uploads ADD COLUMN {name} {kind}")
+                    except sqlite3.OperationalError:
+                        pass  # aggiunta nel frattempo da un altro worker
+        conn.executescript(self.INDEXES)
+
+    def put(self, entry: Dict[str, Any]) -> None:
+        row = {k: entry.get(k) for k in self.FIELDS}
+        row["uploaded_at"] = row["uploaded_at"] or time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO uploads ({', '.join(self.FIELDS)})"
+                f" VALUES ({', '.join('?' for _ in self.FIELDS)})",
+                [row[k] for k in self.FIELDS],
+            )
+
+    def remove(self, filename: str) -> None:
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM uploads WHERE filename = ?", (filename,))
+
+    def get_many(self, filenames: List[str]) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        conn = self.connect()
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            rows = conn.execute(
+                f"SELECT * FROM uploads WHERE filename IN ({', '.join('?' for _ in chunk)})", chunk
+            ).fetchall()
+            out.update((r["filename"], dict(r)) for r in rows)
+        return out
+
+    def list(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        template_id: Optional[str] = None,
+        prefix: Optional[str] = None,
+        brand: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Rows ordered by filename, after `cursor` (a filename), optionally filtered."""
+        where, params = [], []
+        for column, value in (("template_id", template_id), ("prefix", prefix), ("brand", brand)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if cursor:
+            where.append("filename > ?")
+            params.append(cursor)
+        sql = "SELECT * FROM uploads"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY filename"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(r) for r in self.connect().execute(sql, params).fetchall()]
+
+    def lookup(self, paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Catalog rows of the paths that point into the upload dir (path -> row)."""
+        root = self.root.resolve()
+        names = {}
+        for p in paths:
+            path = Path(p)
+            if path.parent.resolve() == root:
+                names[p] = path.name
+        found = self.get_many(sorted(set(names.values())))
+        return {p: found[name] for p, name in names.items() if name in found}
+
+class UploadStore:
+    def __init__(
+        self,
+        root: Path,
+        index_path: Optional[Path] = None,
+        on_collect: Optional[Callable[[str], None]] = None,
+        template_of: Optional[Callable[[str], str]] = None,
+        on_index: Optional[Callable[[str], None]] = None,
+    ):
+        self.root = Path(root)
+        self.objects_dir = self.root / ".objects"
+        self.tmp_dir = self.objects_dir / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.objects_dir / ".lock"
+        self.catalog = UploadCatalog(index_path or DATA_DIR / "uploads.sqlite3", self.root)
+        self.on_collect = on_collect  # digest di un blob rimosso (es. per le derivate)
+        self.template_of = template_of or (lambda filename: "unknown")
+        self.on_index = on_index  # digest di un blob creato da reindex (es. per le derivate)
+
+    # -----------------------------
+    # Paths
+    # -----------------------------
+    def alias_path(self, filename: str) -> Path:
+        name = Path(filename).name
+        if not name or name.startswith("."):
+            raise ValueError(f"Nome file non valido: {filename!r}")
+        return self.root / name
+
+    def blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    def _tmp_path(self) -> Path:
+        return self.tmp_dir / uuid.uuid4().hex
+
+    # -----------------------------
+    # Write
+    # -----------------------------
+    async def save(
+        self,
+        filename: str,
+        read: Callable[[int], Awaitable[bytes]],
+        brand: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Stream `read(n)` chunks to disk and link `filename` to the content blob."""
+        alias = self.alias_path(filename)
+        tmp = self._tmp_path()
+        h = hashlib.sha256()
+        size = 0
+
+        f = await asyncio.to_thread(open, tmp, "wb")
+        try:
+            while True:
+                chunk = await read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                await asyncio.to_thread(_write_chunk, f, h, chunk)
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            tmp.unlink(missing_ok=True)
+            raise
+        await asyncio.to_thread(f.close)
+
+        digest = h.hexdigest()
+        entry = await asyncio.to_thread(self._entry, alias.name, digest, size, tmp, brand)
+        entry["deduplicated"] = await asyncio.to_thread(self._commit, tmp, digest, alias, entry)
+        return entry
+
+    def _entry(self, name: str, digest: str, size: int, path: Path, brand: Optional[str], uploaded_at: Optional[float] = None) -> Dict[str, Any]:
+        width, height = images.image_size(str(path)) or (None, None)
+        return {
+            "filename": name,
+            "sha256": digest,
+            "size": size,
+            "uploaded_at": uploaded_at or time.time(),
+            "prefix": filename_prefix(name),
+            "template_id": self.template_of(name),
+            "brand": brand,
+            "width": width,
+            "height": height,
+            "mtime_ns": path.stat().st_mtime_ns,
+        }
+
+    def _commit(self, tmp: Path, digest: str, alias: Path, entry: Dict[str, Any]) -> bool:
+        with file_lock(self.lock_path):
+            return self._commit_locked(tmp, digest, alias, entry)
+
+    def _commit_locked(self, tmp: Path, digest: str, alias: Path, entry: Dict[str, Any]) -> bool:
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        deduplicated = blob.exists()
+        if deduplicated:
+            tmp.unlink()
+        else:
+            os.chmod(tmp, 0o444)  # i blob sono condivisi tra alias: mai scriverci sopra
+            os.replace(tmp, blob)
+        self._link_alias(blob, alias)
+        images.prime_digest(str(alias), digest)
+        # L'alias condivide l'inode del blob (o è una copia): il suo mtime, non quello del tmp
+        entry["mtime_ns"] = alias.stat().st_mtime_ns
+        self.catalog.put(entry)
+        return deduplicated
+
+    def _link_alias(self, blob: Path, alias: Path) -> None:
+        try:
+            if os.path.samefile(blob, alias):
+                return
+        except FileNotFoundError:
+            pass
+        # Link su un path temporaneo e rename atomico: chi legge l'alias vede
+        # sempre il file vecchio o quello nuovo, mai uno parziale.
+        tmp = self._tmp_path()
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        previous = self._blob_of(alias)
+        os.replace(tmp, alias)
+        if previous is not None:
+            self._collect(previous)
+
+    # -----------------------------
+    # Delete
+    # -----------------------------
+    def _blob_of(self, alias: Path) -> Optional[Path]:
+        if not alias.is_file():
+            return None
+        blob = self.blob_path(images.file_digest(str(alias)))
+        try:
+            return blob if os.path.samefile(blob, alias) else None
+        except FileNotFoundError:
+            return None
+
+    def _collect(self, blob: Path) -> None:
+        """Remove a blob once no alias links to it anymore."""
+        try:
+            if blob.stat().st_nlink > 1:
+                return
+            blob.unlink()
+        except FileNotFoundError:
+            return
+        if self.on_collect is not None:
+            self.on_collect(blob.name)
+
+    def delete(self, filename: str) -> bool:
+        alias = self.alias_path(filename)
+        with file_lock(self.lock_path):
+            if not alias.is_file():
+                self.catalog.remove(alias.name)
+                return False
+            blob = self._blob_of(alias)
+            alias.unlink()
+            if blob is not None:
+                self._collect(blob)
+            self.catalog.remove(alias.name)
+        return True
+
+    # -----------------------------
+    # Catalog
+    # -----------------------------
+    def list(self, **filters: Any) -> List[Dict[str, Any]]:
+        return self.catalog.list(**filters)
+
+    def reindex(self) -> int:
+        """Align the catalog with the files in root (e.g. copied there by hand); returns changes."""
+        with file_lock(self.lock_path):
+            indexed = {row["filename"]: row for row in self.catalog.list()}
+            on_disk = {
+                f.name: f for f in self.root.iterdir()
+                if f.is_file() and not f.name.startswith(".") and f.suffix.lower() in IMAGE_EXTENSIONS
+            }
+            changes = 0
+            for name in indexed.keys() - on_disk.keys():
+                self.catalog.remove(name)
+                # Alias cancellato a mano: il blob resta orfano se nessun altro lo usa
+                self._collect(self.blob_path(indexed[name]["sha256"]))
+                changes += 1
+            for name, path in on_disk.items():
+                st = path.stat()
+                row = indexed.get(name)
+                if (
+                    row is not None and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns
+                    and row["template_id"] is not None
+                ):
+                    continue
+                brand = row["brand"] if row is not None else None
+                uploaded_at = row["uploaded_at"] if row is not None else st.st_mtime
+                digest = images.file_digest(str(path))
+                entry = self._entry(name, digest, st.st_size, path, brand, uploaded_at)
+                if row is not None and row["sha256"] != digest:
+                    self._drop_stale(self.blob_path(row["sha256"]), path)
+                # Stesso percorso di save: blob in .objects e alias linkato, così /media lo trova
+                self._commit_locked(self._snapshot(path), digest, path, entry)
+                if self.on_index is not None:
+                    self.on_index(digest)
+                # Solo mtime aggiornato (es. touch, o riga di una versione senza mtime_ns): non è un cambio
+                if row is None or row["sha256"] != digest or row["size"] != st.st_size or row["template_id"] is None:
+                    changes += 1
+        return changes
+
+    def _snapshot(self, path: Path) -> Path:
+        """Temp hard link (or copy) of a file copied into root by hand, ready for _commit_locked."""
+        tmp = self._tmp_path()
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        return tmp
+
+    def _drop_stale(self, blob: Path, alias: Path) -> None:
+        """Collect the blob of an alias whose content changed on disk."""
+        try:
+            rewritten = os.path.samefile(blob, alias)
+        except FileNotFoundError:
+            return
+        if not rewritten:
+            self._collect(blob)
+            return
+        # Riscritto sul posto: il vecchio blob ha ormai il contenuto nuovo, non vale più per il suo hash
+        blob.unlink()
+        if self.on_collect is not None:
+            self.on_collect(blob.name)
+
+def _write_chunk(f, h, chunk: bytes) -> None:
+    h.update(chunk)
+    f.write(chunk)